@@ -0,0 +1,92 @@
+import os
+
+from openrouteservice import exceptions as ors_exceptions
+from requests.adapters import HTTPAdapter
+
+from limitador_ors import AgendadorORS
+from metricas import METRICAS
+from roteamento import MAX_CONCORRENCIA_ROTEAMENTO_LOTE, BackendRoteamento
+
+# ----- ACESSO CONCORRENTE AO OPENROUTESERVICE -----
+# Uma instância por processo (ver `st.cache_resource` no app): as conexões HTTP ficam num
+# pool reaproveitado entre requisições e sessões, os executores (interativo e de lote)
+# limitam quantas chamadas ao ORS podem estar em andamento ao mesmo tempo e toda chamada
+# passa pelo agendador (limite de taxa, retentativas com backoff e disjuntor).
+MAX_CONCORRENCIA_ORS = int(os.environ.get("ORS_MAX_CONCORRENCIA", 4))
+
+
+# O cliente do openrouteservice repete sozinho respostas 503 por até `retry_timeout` (60 s),
+# por baixo do backoff do AgendadorORS. Respostas 5xx viram ApiError aqui, antes disso, para
+# a política de retentativas (e o disjuntor) ficar só no agendador. `retry_timeout=0` não
+# serve: o cliente compara o tempo decorrido já antes da primeira tentativa.
+def _recusar_retentativa_do_cliente(resposta, *args, **kwargs):
+    if resposta.status_code >= 500:
+        raise ors_exceptions.ApiError(resposta.status_code, resposta.text[:500])
+
+
+class AcessoORS(BackendRoteamento):
+    nome = "ors"
+
+    def __init__(self, client, max_concorrencia=MAX_CONCORRENCIA_ORS, agendador=None,
+                 max_concorrencia_lote=MAX_CONCORRENCIA_ROTEAMENTO_LOTE):
+        super().__init__(max_concorrencia, max_concorrencia_lote)
+        self.client = client
+        self.agendador = agendador or AgendadorORS()
+        sessao = getattr(client, "_session", None)
+        if sessao is not None:
+            conexoes = max_concorrencia + max_concorrencia_lote
+            adaptador = HTTPAdapter(pool_connections=conexoes, pool_maxsize=conexoes, pool_block=True)
+            sessao.mount("https://", adaptador)
+            sessao.mount("http://", adaptador)
+            sessao.hooks['response'].append(_recusar_retentativa_do_cliente)
+        METRICAS.registrar_coletor("agendador_ors", self._metricas_agendador)
+
+    # Contadores do agendador (tentativas HTTP, retentativas, respostas 429 e chamadas
+    # recusadas pelo disjuntor ou pela fila) no formato de `RegistroMetricas`.
+    def _metricas_agendador(self):
+        contadores = self.agendador.contadores()
+        return [
+            ("ors_requisicoes_total", "counter", {}, contadores['requisicoes']),
+            ("ors_retentativas_total", "counter", {}, contadores['retentativas']),
+            ("ors_limite_excedido_total", "counter", {}, contadores['limites_excedidos']),
+            ("ors_rejeitadas_total", "counter", {}, contadores['rejeitadas']),
+            ("ors_disjuntor_aberto", "gauge", {}, int(self.segundos_para_recuperacao() > 0)),
+            ("ors_tokens_disponiveis", "gauge", {}, round(self.agendador.limitador.tokens_disponiveis(), 2)),
+        ]
+
+    def geocodificar(self, nome_lugar):
+        METRICAS.incrementar("api_chamadas_total", backend=self.nome, operacao="geocodificar")
+        geocode_result = self.agendador.executar(self.client.pelias_search, text=nome_lugar, size=1)
+        if geocode_result and geocode_result.get('features'):
+            return geocode_result['features'][0]['geometry']['coordinates']
+        return None
+
+    def rota(self, coords_origem, coords_destino, perfil):
+        METRICAS.incrementar("api_chamadas_total", backend=self.nome, operacao="rota")
+        rota_result = self.agendador.executar(
+            self.client.directions,
+            coordinates=[coords_origem, coords_destino],
+            profile=perfil, format="geojson", geometry="true"
+        )
+        if not (rota_result and rota_result.get('features')):
+            return None
+        feature = rota_result['features'][0]
+        distancia_metros = feature['properties']['segments'][0]['distance']
+        return distancia_metros / 1000, feature['geometry']['coordinates']
+
+    def matriz_distancias(self, origens, destinos, perfil):
+        METRICAS.incrementar("api_chamadas_total", backend=self.nome, operacao="matriz")
+        locais = [list(o) for o in origens] + [list(d) for d in destinos]
+        resultado = self.agendador.executar(
+            self.client.distance_matrix,
+            locations=locais,
+            sources=list(range(len(origens))),
+            destinations=list(range(len(origens), len(locais))),
+            profile=perfil, metrics=["distance"], units="km",
+        )
+        return resultado['distances']
+
+    def segundos_para_recuperacao(self):
+        if self.agendador.disjuntor.estado() != self.agendador.disjuntor.ABERTO:
+            return 0.0
+        return self.agendador.disjuntor.segundos_para_recuperacao()
@@ -0,0 +1,298 @@
+import csv
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_right
+from contextlib import closing
+from datetime import datetime
+
+from metricas import METRICAS, logger
+
+# ----- TABELA DE FRETE ANTT E BUSCA DO NORMATIVO VIGENTE -----
+# As tarifas ficam num arquivo externo (CSV, Parquet ou SQLite com a tabela `tarifas_antt`),
+# uma linha por (vigência, tipo de carga, número de eixos): uma nova portaria é só uma linha
+# a mais no arquivo, sem deploy. O arquivo é lido uma vez para índices em memória e
+# relido em segundo plano quando muda em disco; cotações em andamento continuam com a
+# versão que já tinham em mãos. Tipo de carga ou eixos em branco valem para qualquer valor.
+CAMINHO_TARIFAS_ANTT = os.environ.get(
+    "ANTT_TARIFAS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dados", "tarifas_antt.csv")
+)
+INTERVALO_VERIFICACAO_TARIFAS_S = float(os.environ.get("ANTT_TARIFAS_VERIFICACAO_S", 5))
+COLUNAS_TARIFAS = ['vigencia', 'normativo', 'tipo_carga', 'eixos', 'coef_desloc_antt', 'valor_fixo_cd_antt']
+
+
+def normalizar_tipo_carga(tipo_carga):
+    if tipo_carga is None or tipo_carga != tipo_carga:
+        return ""
+    texto = unicodedata.normalize("NFKD", str(tipo_carga))
+    return " ".join("".join(c for c in texto if not unicodedata.combining(c)).casefold().split())
+
+
+def normalizar_eixos(eixos):
+    if eixos is None or eixos != eixos or str(eixos).strip() == "":
+        return None
+    return int(float(eixos)) or None
+
+
+class IndiceANTT:
+    # Tabela compilada uma única vez: datas ordenadas para busca por bisect (uma data) e, na
+    # primeira busca vetorizada, arrays numpy (datetime64[D] e float) para searchsorted (uma
+    # série inteira). numpy só é importado aí, para o formulário poder ler as tarifas sem ele.
+    # `tabela`: {normativo: [coef_desloc, valor_fixo_cd, 'dd/mm/aaaa']}.
+    def __init__(self, tabela):
+        entradas = []
+        for normativo, valores in tabela.items():
+            try:
+                data_normativo_obj = datetime.strptime(valores[2], '%d/%m/%Y')
+            except ValueError:
+                continue
+            entradas.append((data_normativo_obj, normativo, float(valores[0]), float(valores[1])))
+        entradas.sort(key=lambda item: item[0])
+        self.datas = [item[0] for item in entradas]
+        self.normativos = [item[1] for item in entradas]
+        self.coeficientes = [item[2] for item in entradas]
+        self.valores_fixos = [item[3] for item in entradas]
+        self._arrays = None
+
+    def __len__(self):
+        return len(self.datas)
+
+    def buscar(self, data_req_obj):
+        i = bisect_right(self.datas, data_req_obj) - 1
+        if i < 0:
+            return None, None
+        return self.normativos[i], [self.coeficientes[i], self.valores_fixos[i]]
+
+    # `datas`: Series de datetime (NaT = data inválida). Devolve um DataFrame com o mesmo
+    # índice e as colunas normativo, coef_desloc_antt e valor_fixo_cd_antt (NaN sem normativo).
+    def buscar_vetorizado(self, datas):
+        import numpy as np
+        import pandas as pd
+
+        if self._arrays is None:
+            self._arrays = (np.array(self.datas, dtype='datetime64[D]'), np.array(self.normativos, dtype=object),
+                            np.array(self.coeficientes, dtype=float), np.array(self.valores_fixos, dtype=float))
+        datas_np, normativos, coeficientes, valores_fixos = self._arrays
+        valores = pd.to_datetime(datas).to_numpy(dtype='datetime64[D]')
+        posicoes = np.searchsorted(datas_np, valores, side='right') - 1
+        validas = (posicoes >= 0) & ~np.isnat(valores)
+        posicoes = np.where(validas, posicoes, 0)
+        if not len(self):
+            validas[:] = False
+            posicoes = np.zeros(len(valores), dtype=int)
+            normativos, coeficientes, valores_fixos = np.array([None]), np.array([np.nan]), np.array([np.nan])
+        return pd.DataFrame({
+            'normativo': np.where(validas, normativos[posicoes], None),
+            'coef_desloc_antt': np.where(validas, coeficientes[posicoes], np.nan),
+            'valor_fixo_cd_antt': np.where(validas, valores_fixos[posicoes], np.nan),
+        }, index=datas.index)
+
+
+INDICE_VAZIO = IndiceANTT({})
+
+
+class VersaoTarifasANTT:
+    # Uma leitura completa do arquivo de tarifas, imutável depois de criada: um índice por
+    # (tipo_carga normalizado, eixos). `versao` é o início do SHA-1 do conteúdo do arquivo.
+    def __init__(self, registros, versao="", caminho=None):
+        tabelas = {}
+        # Tipo de carga normalizado -> como aparece no arquivo, para exibição.
+        self.nomes_tipos_carga = {}
+        for vigencia, normativo, tipo_carga, eixos, coef, fixo in registros:
+            chave_tipo = normalizar_tipo_carga(tipo_carga)
+            if chave_tipo:
+                self.nomes_tipos_carga.setdefault(chave_tipo, str(tipo_carga).strip())
+            tabelas.setdefault((chave_tipo, normalizar_eixos(eixos)), {})[normativo] = [coef, fixo, vigencia]
+        self.indices = {chave: IndiceANTT(tabela) for chave, tabela in tabelas.items()}
+        self.versao = versao
+        self.caminho = caminho
+        self.carregada_em = datetime.now()
+
+    def __len__(self):
+        return sum(len(indice) for indice in self.indices.values())
+
+    # Tabelas existentes para a combinação pedida, da mais específica para a geral: uma tabela
+    # com tipo de carga ou eixos em branco serve de reserva para qualquer valor.
+    def indices_candidatos(self, tipo_carga=None, eixos=None):
+        tipo_carga, eixos = normalizar_tipo_carga(tipo_carga), normalizar_eixos(eixos)
+        chaves = dict.fromkeys(((tipo_carga, eixos), (tipo_carga, None), ("", eixos), ("", None)))
+        return [self.indices[chave] for chave in chaves if chave in self.indices]
+
+    # Tabela mais específica disponível para a combinação pedida.
+    def indice(self, tipo_carga=None, eixos=None):
+        candidatos = self.indices_candidatos(tipo_carga, eixos)
+        return candidatos[0] if candidatos else INDICE_VAZIO
+
+    # Normativo vigente na data, na tabela mais específica que tenha um: se a tabela do tipo
+    # de carga/eixos só começa depois da data, vale a reserva (geral) vigente nela.
+    def buscar(self, data_req_obj, tipo_carga=None, eixos=None):
+        for indice in self.indices_candidatos(tipo_carga, eixos):
+            normativo, frete = indice.buscar(data_req_obj)
+            if normativo is not None:
+                return normativo, frete
+        return None, None
+
+    # Como `buscar`, para uma Series de datas (ver IndiceANTT.buscar_vetorizado).
+    def buscar_vetorizado(self, datas, tipo_carga=None, eixos=None):
+        candidatos = self.indices_candidatos(tipo_carga, eixos) or [INDICE_VAZIO]
+        resultado = candidatos[0].buscar_vetorizado(datas)
+        for indice in candidatos[1:]:
+            faltando = resultado['normativo'].isna()
+            if not faltando.any():
+                break
+            reserva = indice.buscar_vetorizado(datas[faltando])
+            for coluna in resultado.columns:
+                resultado.loc[faltando, coluna] = reserva[coluna]
+        return resultado
+
+    def tipos_carga(self):
+        return sorted(self.nomes_tipos_carga.values(), key=normalizar_tipo_carga)
+
+    def eixos(self):
+        return sorted({eixos for _, eixos in self.indices if eixos})
+
+
+def _linhas_tarifas(caminho):
+    extensao = os.path.splitext(caminho)[1].lower()
+    if extensao == ".parquet":
+        import pandas as pd
+        return pd.read_parquet(caminho).astype(object).where(lambda df: df.notna(), "").to_dict("records")
+    if extensao in (".sqlite", ".sqlite3", ".db"):
+        with closing(sqlite3.connect(f"file:{caminho}?mode=ro", uri=True)) as conexao:
+            conexao.row_factory = sqlite3.Row
+            return [dict(linha) for linha in conexao.execute("SELECT * FROM tarifas_antt")]
+    with open(caminho, encoding="utf-8-sig", newline="") as arquivo:
+        return list(csv.DictReader(arquivo))
+
+
+# Lê e valida o arquivo inteiro; qualquer linha inválida rejeita a leitura (ValueError), para
+# que um arquivo pela metade ou com erro de digitação nunca substitua uma versão boa.
+def ler_tarifas(caminho=CAMINHO_TARIFAS_ANTT):
+    with open(caminho, "rb") as arquivo:
+        versao = hashlib.sha1(arquivo.read()).hexdigest()[:12]
+    linhas = _linhas_tarifas(caminho)
+    if linhas and not set(COLUNAS_TARIFAS) <= set(linhas[0]):
+        raise ValueError(f"{caminho}: colunas esperadas {', '.join(COLUNAS_TARIFAS)}.")
+    registros, erros = [], []
+    for numero, linha in enumerate(linhas, start=2):
+        try:
+            vigencia = linha['vigencia']
+            if not isinstance(vigencia, str):
+                vigencia = vigencia.strftime('%d/%m/%Y')
+            datetime.strptime(vigencia.strip(), '%d/%m/%Y')
+            registros.append((vigencia.strip(), str(linha['normativo']).strip(),
+                              linha['tipo_carga'], normalizar_eixos(linha['eixos']),
+                              float(linha['coef_desloc_antt']), float(linha['valor_fixo_cd_antt'])))
+        except (ValueError, TypeError, AttributeError) as e:
+            erros.append(f"linha {numero}: {e}")
+    if erros:
+        raise ValueError(f"{caminho}: {len(erros)} linha(s) inválida(s) - " + "; ".join(erros[:5]))
+    return VersaoTarifasANTT(registros, versao, caminho)
+
+
+class RepositorioTarifasANTT:
+    # Dono da versão atual das tarifas. `versao()` nunca espera por leitura de disco: no
+    # máximo a cada `intervalo_verificacao_s` dispara uma thread que compara mtime/tamanho
+    # do arquivo e, se mudou, lê e troca a referência da versão atual de uma só vez.
+    def __init__(self, caminho=CAMINHO_TARIFAS_ANTT, intervalo_verificacao_s=INTERVALO_VERIFICACAO_TARIFAS_S):
+        self.caminho = caminho
+        self.intervalo_verificacao_s = intervalo_verificacao_s
+        self._lock_recarga = threading.Lock()
+        # (mtime, tamanho) do arquivo na última leitura; None se ausente.
+        self._assinatura = ()
+        self._proxima_verificacao = time.monotonic() + intervalo_verificacao_s
+        self._versao = VersaoTarifasANTT([])
+        self.recarregar()
+
+    def _assinatura_arquivo(self):
+        try:
+            estado = os.stat(self.caminho)
+        except OSError:
+            return None
+        return estado.st_mtime_ns, estado.st_size
+
+    # Leitura síncrona (na criação e pela linha de comando). Devolve True se trocou a versão.
+    # Um arquivo ausente ou inválido é registrado uma vez e só relido quando mudar de novo.
+    def recarregar(self):
+        assinatura = self._assinatura_arquivo()
+        if assinatura == self._assinatura:
+            return False
+        self._assinatura = assinatura
+        if assinatura is None:
+            logger.error(f"arquivo de tarifas ANTT não encontrado: {self.caminho}")
+            METRICAS.incrementar("tarifas_antt_recargas_total", resultado="erro")
+            return False
+        try:
+            versao = ler_tarifas(self.caminho)
+        except (OSError, ValueError) as e:
+            logger.error(f"tarifas ANTT mantidas na versão {self._versao.versao or '-'}: {e}")
+            METRICAS.incrementar("tarifas_antt_recargas_total", resultado="erro")
+            return False
+        self._versao = versao
+        METRICAS.incrementar("tarifas_antt_recargas_total", resultado="ok")
+        logger.info("tarifas ANTT carregadas", extra={'campos': {
+            'versao': versao.versao, 'caminho': self.caminho, 'tarifas': len(versao),
+            'tabelas': len(versao.indices)}})
+        return True
+
+    def _recarregar_em_segundo_plano(self):
+        try:
+            self.recarregar()
+        finally:
+            self._lock_recarga.release()
+
+    def versao(self):
+        agora = time.monotonic()
+        if agora >= self._proxima_verificacao and self._lock_recarga.acquire(blocking=False):
+            self._proxima_verificacao = agora + self.intervalo_verificacao_s
+            threading.Thread(target=self._recarregar_em_segundo_plano, name="recarga-tarifas-antt",
+                             daemon=True).start()
+        return self._versao
+
+
+# Repositório de tarifas do processo. Não é um dicionário: quem precisa das tarifas pede
+# `repositorio_tarifas_antt.versao()` (ou passa o repositório a encontrar_frete_vigente).
+repositorio_tarifas_antt = RepositorioTarifasANTT()
+
+
+# Versão das tarifas a usar numa cotação: a atual do repositório ou, para quem ainda passa um
+# dicionário {normativo: [coef, fixo, data]}, uma versão montada a partir dele.
+def obter_versao_tarifas(tabela=repositorio_tarifas_antt):
+    if isinstance(tabela, RepositorioTarifasANTT):
+        return tabela.versao()
+    if isinstance(tabela, VersaoTarifasANTT):
+        return tabela
+    return VersaoTarifasANTT((valores[2], normativo, "", None, valores[0], valores[1])
+                             for normativo, valores in tabela.items())
+
+
+def obter_indice_antt(tabela=repositorio_tarifas_antt, tipo_carga=None, eixos=None):
+    return obter_versao_tarifas(tabela).indice(tipo_carga, eixos)
+
+
+def encontrar_frete_vigente(tabela, data_requisicao_str, tipo_carga=None, eixos=None):
+    try:
+        data_req_obj = datetime.strptime(data_requisicao_str, '%d/%m/%Y')
+    except ValueError:
+        return None, None, None
+    normativo_aplicavel, frete_aplicavel = obter_versao_tarifas(tabela).buscar(data_req_obj, tipo_carga, eixos)
+    return normativo_aplicavel, frete_aplicavel, data_req_obj
+
+
+# Valida um arquivo de tarifas antes de publicá-lo (ex.: copiar por cima do atual):
+#   python antt.py dados/tarifas_antt.csv
+if __name__ == "__main__":
+    caminho = sys.argv[1] if len(sys.argv) > 1 else CAMINHO_TARIFAS_ANTT
+    try:
+        versao = ler_tarifas(caminho)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"✅ {caminho}: versão {versao.versao}, {len(versao)} tarifas em {len(versao.indices)} tabela(s).")
+    for (tipo_carga, eixos), indice in sorted(versao.indices.items(), key=lambda item: (item[0][0], item[0][1] or 0)):
+        print(f"  - {tipo_carga or 'qualquer carga'} / {f'{eixos} eixos' if eixos else 'qualquer nº de eixos'}: "
+              f"{len(indice)} normativos, último em {indice.datas[-1]:%d/%m/%Y}")
@@ -1,162 +1,244 @@
+import time
+inicio_execucao = time.perf_counter()
+
 import streamlit as st
 from datetime import datetime
-import openrouteservice
 from openrouteservice import exceptions as ors_exceptions
-import pandas as pd
+import itertools
+from concurrent.futures import Future
 import os
+import tempfile
+import threading
+from roteamento import ROTEAMENTO_BACKEND, criar_backend, ServicoRoteamentoIndisponivel, ErroRoteamento
+from cache_geocodificacao import CacheGeocodificacao, DIRETORIO_CACHE_PADRAO
+from municipios import carregar_indice_municipios
+from antt import repositorio_tarifas_antt, encontrar_frete_vigente
+from cache_rotas import CacheRotas
+from metricas import (METRICAS, METRICAS_PORTA, RegistroCotacao, configurar_log_json, iniciar_servidor_metricas,
+                      metricas_de_cache, logger, NIVEL_SUCESSO, NIVEL_INFO, NIVEL_AVISO, NIVEL_ERRO)
+# pandas, numpy e pydeck (~0,5 s de importação) não entram aqui: a tela inicial não precisa
+# deles. Os módulos que os usam (precificacao, geometria, cotacao_lote) são importados
+# onde a cotação acontece e pré-carregados em segundo plano após a primeira renderização.
+
+
+# pydeck (e o jinja2 que ele importa) só é carregado quando há mapa para desenhar.
+def importar_pydeck():
+    try:
+        import pydeck
+    except ImportError:
+        return None
+    return pydeck
 
-
-# Tenta importar Pydeck e define 'pdk'
-try:
-    import pydeck as pdk
-    PYDECK_AVAILABLE = True
-except ImportError:
-    PYDECK_AVAILABLE = False
-    pdk = None
-
-# ----- CONFIGURAÇÃO DO CLIENTE OPENROUTESERVICE -----
-ORS_API_KEY = st.secrets["ORS_API_KEY"]
+# ----- CONFIGURAÇÃO DO BACKEND DE ROTEAMENTO (OpenRouteService por padrão) -----
+ROTEAMENTO_BACKEND = st.secrets.get("ROTEAMENTO_BACKEND", ROTEAMENTO_BACKEND)
+ORS_API_KEY = st.secrets.get("ORS_API_KEY")
 ORS_CLIENT_VALID = False
-ors_client = None
+backend_roteamento = None
+
+# Backend (cliente, pool de conexões e limitador) criado uma vez por processo e compartilhado entre sessões.
+@st.cache_resource
+def obter_backend_roteamento(nome, api_key, osrm_url, ors_base_url=None):
+    geocodificador = criar_backend("ors", ors_api_key=api_key, ors_base_url=ors_base_url) if nome == "osrm" and api_key else None
+    return criar_backend(nome, ors_api_key=api_key, ors_base_url=ors_base_url, osrm_url=osrm_url,
+                         geocodificador=geocodificador)
 
-if ORS_API_KEY:
+if ORS_API_KEY or ROTEAMENTO_BACKEND != "ors":
     try:
-        ors_client = openrouteservice.Client(key=ORS_API_KEY)
+        backend_roteamento = obter_backend_roteamento(ROTEAMENTO_BACKEND, ORS_API_KEY, st.secrets.get("OSRM_URL"),
+                                                      st.secrets.get("ORS_BASE_URL"))
         ORS_CLIENT_VALID = True
     except Exception as e:
         ORS_CLIENT_VALID = False
 else:
     pass
 
-# ----- INÍCIO DAS DEFINIÇÕES DE DADOS E FUNÇÕES -----
-tabela_antt = {
-    'PORTARIA Nº 3, DE 7 DE fevereiro DE 2025': [7.639, 623.070, '07/02/2025'],
-    'RESOLUÇÃO Nº 6.046, DE 11 DE JULHO DE 2024': [7.486, 675.050, '11/07/2024'],
-    'RESOLUÇÃO Nº 6.034, DE 18 DE JANEIRO DE 2024': [7.413, 664.970, '18/01/2024'],
-    'PORTARIA Nº 20, DE 28 DE AGOSTO DE 2023': [7.277, 618.410, '28/08/2023'],
-    'PORTARIA Nº 19, DE 21 DE AGOSTO DE 2023': [6.933, 618.410, '21/08/2023'],
-    'RESOLUÇÃO Nº 6.022, DE 20 DE JULHO DE 2023': [6.646, 618.410, '20/07/2023'],
-    'PORTARIA Nº 13, DE 5 DE JUNHO DE 2023': [6.608, 597.020, '05/06/2023'],
-    'PORTARIA Nº 11, DE 22 DE MAIO DE 2023': [6.795, 597.020, '22/05/2023'],
-    'PORTARIA Nº 8, DE 25 DE ABRIL DE 2023': [7.001, 597.020, '25/04/2023'],
-    'PORTARIA Nº 5, DE 17 DE FEVEREIRO DE 2023': [7.195, 597.020, '07/02/2023'],
-    'RESOLUÇÃO Nº 6.006, DE 19 DE JANEIRO DE 2023': [7.426, 597.020, '19/01/2023'],
-    'PORTARIA SUROC Nº 219, DE 3 DE OUTUBRO DE 2022': [6.938, 463.840, '03/10/2022'],
-    'PORTARIA Nº 214, DE 22 DE AGOSTO DE 2022': [7.188, 463.840, '22/08/2022'],
-    'RESOLUÇÃO Nº 5.985, DE 19 DE JULHO DE 2022': [7.471, 463.840, '19/07/2022'],
-    'PORTARIA Nº 210, DE 24 DE JUNHO DE 2022': [7.381, 436.580, '24/06/2022'],
-    'PORTARIA Nº 169, DE 18 DE MARÇO DE 2022': [6.802, 436.580, '18/03/2022'],
-    'RESOLUÇÃO Nº 5.959, DE 20 DE JANEIRO DE 2022': [5.969, 436.580, '20/01/2022'],
-    'PORTARIA Nº 496, DE 19 DE OUTUBRO DE 2021': [5.436, 398.380, '19/10/2021'],
-    'RESOLUÇÃO Nº 5.949, DE 13 DE JULHO DE 2021': [5.145, 398.380, '13/07/2021'],
-    'RESOLUÇÃO Nº 5.923, DE 18 DE JANEIRO DE 2021': [4.487, 380.860, '18/01/2021'],
-    'PORTARIA Nº 399, DE 3 DE NOVEMBRO DE 2020': [4.380, 369.700, '03/11/2020'],
-    'RESOLUÇÃO Nº 5.899, DE 14 DE JULHO DE 2020': [4.099, 369.700, '14/07/2020'],
-    'RESOLUÇÃO Nº 5.890, DE 26 DE MAIO DE 2020': [4.423, 413.790, '26/05/2020']
-}
-
-def encontrar_frete_vigente(tabela, data_requisicao_str):
+# ----- MÉTRICAS E LOG ESTRUTURADO -----
+# Log JSON no stderr (ou LOG_JSON_PATH); métricas em .cache/metricas.prom e, com
+# METRICAS_PORTA configurada, também em http://<host>:<porta>/metrics.
+configurar_log_json()
+METRICAS_PORTA = int(st.secrets.get("METRICAS_PORTA", METRICAS_PORTA))
+
+@st.cache_resource
+def obter_servidor_metricas(porta):
     try:
-        data_req_obj = datetime.strptime(data_requisicao_str, '%d/%m/%Y')
-    except ValueError:
-        return None, None, None
-    entradas_ordenadas = []
-    for normativo, valores in tabela.items():
-        data_normativo_str = valores[2]
-        try:
-            data_normativo_obj = datetime.strptime(data_normativo_str, '%d/%m/%Y')
-            entradas_ordenadas.append((data_normativo_obj, normativo, [valores[0], valores[1]]))
-        except ValueError:
-            continue
-    if not entradas_ordenadas:
-        return None, None, data_req_obj
-    entradas_ordenadas.sort(key=lambda item: item[0])
-    frete_aplicavel = None
-    normativo_aplicavel = None
-    if data_req_obj < entradas_ordenadas[0][0]:
-        return None, None, data_req_obj
-    for i in range(len(entradas_ordenadas)):
-        data_normativo_atual, normativo_atual, frete_atual = entradas_ordenadas[i]
-        if data_req_obj >= data_normativo_atual:
-            frete_aplicavel = frete_atual
-            normativo_aplicavel = normativo_atual
-            if (i + 1 == len(entradas_ordenadas)) or (data_req_obj < entradas_ordenadas[i+1][0]):
-                break
-    return normativo_aplicavel, frete_aplicavel, data_req_obj
-
-def obter_coordenadas_ors(nome_lugar, client_ors_func):
-    global ORS_CLIENT_VALID
-    if not ORS_CLIENT_VALID or not client_ors_func:
-        st.session_state.ors_log.append(f"⚠️ ORS: Cliente não válido para geocodificar '{nome_lugar}'.")
+        return iniciar_servidor_metricas(porta)
+    except OSError as e:
+        logger.warning(f"endpoint de métricas não iniciado na porta {porta}: {e}")
         return None
+
+if METRICAS_PORTA:
+    obter_servidor_metricas(METRICAS_PORTA)
+
+def gravar_arquivo_metricas():
     try:
-        geocode_result = client_ors_func.pelias_search(text=nome_lugar, size=1)
-        if geocode_result and geocode_result.get('features'):
-            coordenadas = geocode_result['features'][0]['geometry']['coordinates']
-            st.session_state.ors_log.append(f"✅ Coordenadas para '{nome_lugar}': {coordenadas}")
+        METRICAS.gravar_arquivo()
+    except OSError as e:
+        logger.warning(f"arquivo de métricas não gravado: {e}")
+
+# ----- CACHES DE GEOCODIFICAÇÃO E ROTAS (compartilhados entre sessões) -----
+# Backends de teste usam caches em memória; rotas de backends diferentes do ORS ficam em
+# arquivos próprios, pois as distâncias de cada serviço não são intercambiáveis.
+@st.cache_resource
+def obter_cache_geocodificacao(persistir):
+    cache = CacheGeocodificacao() if persistir else CacheGeocodificacao(":memory:")
+    METRICAS.registrar_coletor("cache_geocodificacao", lambda: metricas_de_cache("geocodificacao", cache.estatisticas()))
+    return cache
+
+@st.cache_resource
+def obter_cache_rotas(nome_backend, persistir):
+    if not persistir:
+        cache = CacheRotas(":memory:")
+    elif nome_backend == "ors":
+        cache = CacheRotas()
+    else:
+        cache = CacheRotas(os.path.join(DIRETORIO_CACHE_PADRAO, f"rotas_{nome_backend}.sqlite3"))
+    METRICAS.registrar_coletor("cache_rotas", lambda: metricas_de_cache("rotas", cache.estatisticas()))
+    return cache
+
+persistir_cache = backend_roteamento.persistir_cache if backend_roteamento else True
+cache_geocodificacao = obter_cache_geocodificacao(persistir_cache)
+cache_rotas = obter_cache_rotas(ROTEAMENTO_BACKEND, persistir_cache)
+PERFIL_ROTA_ORS = "driving-car"
+
+# Gazetteer de municípios carregado uma vez por processo.
+@st.cache_resource
+def obter_indice_municipios():
+    return carregar_indice_municipios()
+
+indice_municipios = obter_indice_municipios()
+
+# ----- INÍCIO DAS DEFINIÇÕES DE DADOS E FUNÇÕES -----
+# Pode rodar numa thread do executor do ORS: as mensagens vão para o `registro` da cotação
+# e não para o st.session_state, que só é acessível a partir da thread do script.
+def obter_coordenadas_ors(nome_lugar, backend, registro):
+    municipio = indice_municipios.buscar(nome_lugar)
+    if municipio:
+        codigo_ibge, nome_municipio, uf, longitude, latitude = municipio
+        METRICAS.incrementar("geocodificacao_total", fonte="municipio")
+        registro.evento(NIVEL_SUCESSO, f"Coordenadas (município {nome_municipio}/{uf}, IBGE {codigo_ibge}) para '{nome_lugar}': {[longitude, latitude]}",
+                        localidade=nome_lugar, fonte="municipio")
+        return [longitude, latitude]
+    encontrado_cache, coordenadas_cache = cache_geocodificacao.obter(nome_lugar)
+    if encontrado_cache:
+        METRICAS.incrementar("geocodificacao_total", fonte="cache")
+        if coordenadas_cache:
+            registro.evento(NIVEL_SUCESSO, f"Coordenadas (cache) para '{nome_lugar}': {coordenadas_cache}",
+                            localidade=nome_lugar, fonte="cache")
+        else:
+            registro.evento(NIVEL_AVISO, f"Cache: '{nome_lugar}' não encontrado anteriormente pelo ORS.",
+                            localidade=nome_lugar, fonte="cache")
+        return coordenadas_cache
+    if not ORS_CLIENT_VALID or not backend:
+        registro.evento(NIVEL_AVISO, f"ORS: Cliente não válido para geocodificar '{nome_lugar}'.", localidade=nome_lugar)
+        return None
+    METRICAS.incrementar("geocodificacao_total", fonte="backend")
+    try:
+        coordenadas = backend.geocodificar(nome_lugar)
+        if coordenadas:
+            registro.evento(NIVEL_SUCESSO, f"Coordenadas para '{nome_lugar}': {coordenadas}",
+                            localidade=nome_lugar, fonte="backend")
+            cache_geocodificacao.gravar(nome_lugar, coordenadas)
             return coordenadas
         else:
-            st.session_state.ors_log.append(f"⚠️ ORS: Não encontrou coordenadas para '{nome_lugar}'.")
+            registro.evento(NIVEL_AVISO, f"ORS: Não encontrou coordenadas para '{nome_lugar}'.",
+                            localidade=nome_lugar, fonte="backend")
+            cache_geocodificacao.gravar(nome_lugar, None)
             return None
-    except ors_exceptions.RateLimitExceeded as rle:
-        st.session_state.ors_log.append(f"❌ ORS API Error (geocoding '{nome_lugar}'): Limite de taxa excedido. {rle}")
-        ORS_CLIENT_VALID = False
-        st.error("ORS: Limite de requisições da API atingido. Tente novamente mais tarde.")
-        return None
-    except ors_exceptions.ApiError as e:
-        st.session_state.ors_log.append(f"❌ ORS API Error (geocoding '{nome_lugar}'): {e}")
+    except ServicoRoteamentoIndisponivel as e:
+        registro.evento(NIVEL_ERRO, f"ORS API Error (geocoding '{nome_lugar}'): Serviço indisponível. {e}",
+                        localidade=nome_lugar, fonte="backend")
+        raise
+    except (ors_exceptions.ApiError, ErroRoteamento) as e:
+        registro.evento(NIVEL_ERRO, f"ORS API Error (geocoding '{nome_lugar}'): {e}", localidade=nome_lugar, fonte="backend")
         return None
     except Exception as e:
-        st.session_state.ors_log.append(f"❌ ORS Unexpected Error (geocoding '{nome_lugar}'): {e}")
+        registro.evento(NIVEL_ERRO, f"ORS Unexpected Error (geocoding '{nome_lugar}'): {e}", localidade=nome_lugar, fonte="backend")
         return None
 
-def calcular_rota_e_distancia_ors(nome_origem_str, nome_destino_str, client_ors_func):
-    global ORS_CLIENT_VALID
-    st.session_state.ors_log = [f"Iniciando cálculo de rota ORS: '{nome_origem_str}' -> '{nome_destino_str}'"]
+def geocodificar_etapa(etapa, nome_lugar, backend, registro):
+    with registro.etapa(etapa, localidade=nome_lugar):
+        return obter_coordenadas_ors(nome_lugar, backend, registro)
 
-    if not ORS_CLIENT_VALID or not client_ors_func:
-        st.session_state.ors_log.append("⚠️ ORS: Cliente não válido para cálculo de rota.")
-        return None, None, None, None
+def calcular_rota_e_distancia_ors(nome_origem_str, nome_destino_str, backend):
+    registro = st.session_state.registro_cotacao = RegistroCotacao(origem=nome_origem_str, destino=nome_destino_str,
+                                                                  backend=ROTEAMENTO_BACKEND)
+    registro.evento(NIVEL_INFO, f"Iniciando cálculo de rota ORS: '{nome_origem_str}' -> '{nome_destino_str}'")
 
-    coords_origem = obter_coordenadas_ors(nome_origem_str, client_ors_func)
-    if not ORS_CLIENT_VALID: return None, coords_origem, None, None
+    if not ORS_CLIENT_VALID or not backend:
+        registro.evento(NIVEL_AVISO, "ORS: Cliente não válido para cálculo de rota.")
+        return None, None, None, None
 
-    coords_destino = obter_coordenadas_ors(nome_destino_str, client_ors_func)
-    if not ORS_CLIENT_VALID: return None, coords_origem, coords_destino, None
+    # Origem e destino são geocodificados em paralelo.
+    futuro_origem = backend.submeter(geocodificar_etapa, "geocodificar_origem", nome_origem_str, backend, registro)
+    futuro_destino = backend.submeter(geocodificar_etapa, "geocodificar_destino", nome_destino_str, backend, registro)
+    coordenadas, erro_indisponivel = [], None
+    for futuro in (futuro_origem, futuro_destino):
+        try:
+            coordenadas.append(futuro.result())
+        except ServicoRoteamentoIndisponivel as e:
+            coordenadas.append(None)
+            erro_indisponivel = e
+    coords_origem, coords_destino = coordenadas
+    if erro_indisponivel is not None:
+        st.error(f"ORS: Serviço temporariamente indisponível ({erro_indisponivel}). Tente novamente em instantes.")
+        return None, coords_origem, coords_destino, None
 
     if coords_origem and coords_destino:
+        distancia_cache = cache_rotas.obter_distancia(coords_origem, coords_destino, PERFIL_ROTA_ORS)
+        if distancia_cache is not None:
+            geometria_cache = cache_rotas.obter_geometria(coords_origem, coords_destino, PERFIL_ROTA_ORS)
+            if geometria_cache is not None:
+                METRICAS.incrementar("rotas_total", fonte="cache")
+                registro.evento(NIVEL_SUCESSO, f"Cache: Distância: {distancia_cache:.2f} km. Geometria da rota obtida do cache.",
+                                fonte="cache")
+                return distancia_cache, coords_origem, coords_destino, geometria_cache
+        METRICAS.incrementar("rotas_total", fonte="backend")
         try:
-            st.session_state.ors_log.append(f" Tentando obter rota entre {coords_origem} e {coords_destino}...")
-            rota_result = client_ors_func.directions(
-                coordinates=[coords_origem, coords_destino],
-                profile="driving-car", format="geojson", geometry="true"
-            )
-            if rota_result and rota_result.get('features'):
-                feature = rota_result['features'][0]
-                distancia_metros = feature['properties']['segments'][0]['distance']
-                distancia_km = distancia_metros / 1000
-                route_geometry = feature['geometry']['coordinates']
-                st.session_state.ors_log.append(f"✅ ORS: Distância: {distancia_km:.2f} km. Geometria da rota obtida.")
+            registro.evento(NIVEL_INFO, f"Tentando obter rota entre {coords_origem} e {coords_destino}...")
+            with registro.etapa("rota"):
+                rota_result = backend.rota(coords_origem, coords_destino, PERFIL_ROTA_ORS)
+            if rota_result:
+                distancia_km, route_geometry = rota_result
+                registro.evento(NIVEL_SUCESSO, f"ORS: Distância: {distancia_km:.2f} km. Geometria da rota obtida.",
+                                fonte="backend", vertices=len(route_geometry))
+                cache_rotas.gravar(coords_origem, coords_destino, PERFIL_ROTA_ORS, distancia_km, route_geometry)
                 return distancia_km, coords_origem, coords_destino, route_geometry
             else:
-                st.session_state.ors_log.append(f"❌ ORS Error: Resposta da rota inesperada ou vazia.")
+                registro.evento(NIVEL_ERRO, "ORS Error: Resposta da rota inesperada ou vazia.")
                 return None, coords_origem, coords_destino, None
-        except ors_exceptions.RateLimitExceeded as rle:
-            st.session_state.ors_log.append(f"❌ ORS API Error (routing): Limite de taxa excedido. {rle}")
-            ORS_CLIENT_VALID = False
-            st.error("ORS: Limite de requisições da API atingido. Tente novamente mais tarde.")
+        except ServicoRoteamentoIndisponivel as e:
+            registro.evento(NIVEL_ERRO, f"ORS API Error (routing): Serviço indisponível. {e}")
+            st.error(f"ORS: Serviço temporariamente indisponível ({e}). Tente novamente em instantes.")
             return None, coords_origem, coords_destino, None
-        except ors_exceptions.ApiError as e:
-            st.session_state.ors_log.append(f"❌ ORS API Error (routing): {e}")
+        except (ors_exceptions.ApiError, ErroRoteamento) as e:
+            registro.evento(NIVEL_ERRO, f"ORS API Error (routing): {e}")
             if hasattr(e, 'response') and e.response is not None:
-                 st.session_state.ors_log.append(f"Detalhes: {e.response.text}")
+                 registro.evento(NIVEL_INFO, f"Detalhes: {e.response.text}")
             return None, coords_origem, coords_destino, None
         except (KeyError, IndexError, TypeError) as e:
-            st.session_state.ors_log.append(f"❌ ORS Error (processando resposta da rota): {e}")
+            registro.evento(NIVEL_ERRO, f"ORS Error (processando resposta da rota): {e}")
             return None, coords_origem, coords_destino, None
     else:
-        st.session_state.ors_log.append("⚠️ ORS: Rota não calculada (origem ou destino não geocodificado).")
+        registro.evento(NIVEL_AVISO, "ORS: Rota não calculada (origem ou destino não geocodificado).")
         return None, coords_origem, coords_destino, None
+
+# Tipo de carga e eixos só aparecem quando o arquivo de tarifas tem tabelas específicas.
+# Devolve (tipo_carga, eixos), None = tabela geral.
+def seletores_tarifa_antt(versao_tarifas, chave):
+    tipo_carga, eixos = None, None
+    if versao_tarifas.tipos_carga() or versao_tarifas.eixos():
+        col_tipo_carga, col_eixos = st.columns(2)
+        with col_tipo_carga:
+            tipo_carga = st.selectbox("Tipo de carga:", [None] + versao_tarifas.tipos_carga(),
+                                      format_func=lambda tipo: "Qualquer (tabela geral)" if tipo is None else tipo,
+                                      disabled=not versao_tarifas.tipos_carga(), key=f"tipo_carga_{chave}")
+        with col_eixos:
+            eixos = st.selectbox("Número de eixos:", [None] + versao_tarifas.eixos(),
+                                 format_func=lambda eixos: "Qualquer (tabela geral)" if eixos is None else f"{eixos} eixos",
+                                 disabled=not versao_tarifas.eixos(), key=f"eixos_{chave}")
+    st.caption(f"Tarifas ANTT: versão `{versao_tarifas.versao or '-'}`, carregada em "
+               f"{versao_tarifas.carregada_em:%d/%m/%Y %H:%M:%S}.")
+    return tipo_carga, eixos
 # ----- FIM DAS DEFINIÇÕES DE DADOS E FUNÇÕES -----
 
 st.set_page_config(layout="wide", page_title="Calculadora de Frete ANTT")
@@ -164,8 +246,11 @@ st.title("Cálculo de Frete ANTT e Distância 🚚")
 
 if not ORS_CLIENT_VALID:
     st.error("Cliente OpenRouteService não inicializado ou chave API inválida/não configurada. Funcionalidade de distância e mapa estarão desabilitadas.")
+elif backend_roteamento.segundos_para_recuperacao() > 0:
+    st.warning(f"Serviço de roteamento instável: novas consultas serão tentadas automaticamente em "
+               f"{backend_roteamento.segundos_para_recuperacao():.0f}s.")
 
-if 'ors_log' not in st.session_state: st.session_state.ors_log = []
+if 'registro_cotacao' not in st.session_state: st.session_state.registro_cotacao = None
 if 'map_data' not in st.session_state:
     st.session_state.map_data = {'points': None, 'route': None}
 
@@ -198,6 +283,8 @@ with st.form(key="input_form"):
         peso_mercadoria_kg_input = st.number_input("Peso da Mercadoria (KG):",
                                                        min_value=0.0, value=0.0, format="%.2f",
                                                        help="Peso da Mercadoria na Viagem em quilogramas.")
+    versao_tarifas = repositorio_tarifas_antt.versao()
+    tipo_carga_input, eixos_input = seletores_tarifa_antt(versao_tarifas, "cotacao")
     st.markdown("---")
     submit_button = st.form_submit_button("Calcular Frete e Distância ⚙️", disabled=not ORS_CLIENT_VALID)
 
@@ -209,8 +296,16 @@ if submit_button:
         valid_input = False
 
     if valid_input and ORS_CLIENT_VALID:
+        import pandas as pd
+        from geometria import zoom_inicial_mapa, simplificar_para_zoom, codificar_polilinha, decodificar_polilinha
+        from precificacao import (precificar, CAPACIDADE_TOTAL_CAMINHAO_KG, SITUACAO_PROPORCIONAL,
+                                  SITUACAO_CAPACIDADE_TOTAL, SITUACAO_SEM_PESO, SITUACAO_DISTANCIA_ZERO,
+                                  SITUACAO_SEM_DISTANCIA)
+
         with st.spinner("Calculando distância via ORS e frete... ⏳"):
-            distancia, coords_o, coords_d, route_geom = calcular_rota_e_distancia_ors(origem_nome_input, destino_nome_input, ors_client)
+            inicio_cotacao = time.perf_counter()
+            distancia, coords_o, coords_d, route_geom = calcular_rota_e_distancia_ors(origem_nome_input, destino_nome_input, backend_roteamento)
+            registro = st.session_state.registro_cotacao
 
             # Prepara dados para o mapa
             map_points_list = []
@@ -218,9 +313,22 @@ if submit_button:
             if coords_d: map_points_list.append({'latitude': coords_d[1], 'longitude': coords_d[0], 'tipo': 'Destino', 'cor': [0, 0, 255, 200]})
 
             st.session_state.map_data['points'] = pd.DataFrame(map_points_list) if map_points_list else None
-            st.session_state.map_data['route'] = [{"path": route_geom, "name": "Rota Calculada"}] if route_geom else None
+            # Só a rota simplificada para o zoom do mapa vai para a sessão, como polilinha codificada;
+            # a geometria completa fica apenas no cache de rotas em disco.
+            if route_geom:
+                zoom_rota = zoom_inicial_mapa(len(map_points_list), distancia)
+                with registro.etapa("mapa", vertices=len(route_geom)):
+                    st.session_state.map_data['route'] = {
+                        'polilinha': codificar_polilinha(simplificar_para_zoom(route_geom, zoom_rota)),
+                        'name': "Rota Calculada",
+                    }
+            else:
+                st.session_state.map_data['route'] = None
 
-            normativo, frete_componentes, data_obj = encontrar_frete_vigente(tabela_antt, data_usuario_str)
+            with registro.etapa("normativo_antt", versao_tarifas=versao_tarifas.versao):
+                normativo, frete_componentes, data_obj = encontrar_frete_vigente(versao_tarifas, data_usuario_str,
+                                                                                 tipo_carga_input, eixos_input)
+            situacao = None
 
             st.markdown("---")
             st.subheader("📊 RESULTADOS DO CÁLCULO")
@@ -251,51 +359,25 @@ if submit_button:
                 f_col1.metric("R$ / km (Base ANTT)", f"{coef_desloc_antt:.3f}")
                 f_col2.metric("Valor Fixo Carga/Descarga (ANTT)", f"R$ {valor_fixo_cd_antt:.2f}")
 
-                if distancia is not None and distancia > 0:
-                    custo_deslocamento_antt = coef_desloc_antt * distancia
-                    custo_adicional_desloc = adicional_deslocamento_taxa_input * distancia
-
-                    # CÁLCULO DO FRETE TOTAL "CHEIO" (custo para o caminhão completo)
-                    frete_total_cheio = (custo_deslocamento_antt + valor_fixo_cd_antt +
-                                         custo_adicional_desloc + valor_dificuldade_input)
-
-                    # --- LÓGICA PARA CALCULAR O VALOR TOTAL ESTIMADO COM BASE NO PESO DA MERCADORIA ---
-                    # IMPORTANTÍSSIMO: Ajuste este valor para a capacidade total do caminhão que você está usando como base!
-                    CAPACIDADE_TOTAL_CAMINHAO_KG = 20000.00 # Exemplo: 23520 kg (capacidade total)
-
-                    frete_total_calculado = frete_total_cheio # Valor padrão, se não houver proporção
-
-                    if peso_mercadoria_kg_input > 0 and CAPACIDADE_TOTAL_CAMINHAO_KG > 0:
-                        if peso_mercadoria_kg_input < CAPACIDADE_TOTAL_CAMINHAO_KG:
-                            proporcao_peso = peso_mercadoria_kg_input / CAPACIDADE_TOTAL_CAMINHAO_KG
-                            frete_total_calculado = frete_total_cheio * proporcao_peso
-                            st.info(f"**Nota:** Frete total ajustado proporcionalmente ao peso da mercadoria ({proporcao_peso*100:.2f}% da capacidade do caminhão), pois o peso é inferior à capacidade total.")
-                        else:
-                            # Se o peso da mercadoria é maior ou igual à capacidade, cobra-se o frete cheio.
-                            frete_total_calculado = frete_total_cheio
-                            st.info(f"**Nota:** Frete calculado para capacidade total, pois o peso da mercadoria ({peso_mercadoria_kg_input:.2f} kg) é igual ou superior à capacidade do caminhão ({CAPACIDADE_TOTAL_CAMINHAO_KG:.2f} kg).")
-                    elif peso_mercadoria_kg_input == 0:
+                with registro.etapa("precificacao"):
+                    calculo = precificar(
+                        distancia if distancia is not None else float('nan'), coef_desloc_antt, valor_fixo_cd_antt,
+                        peso_mercadoria_kg_input, adicional_deslocamento_taxa_input, valor_dificuldade_input,
+                        CAPACIDADE_TOTAL_CAMINHAO_KG,
+                    ).iloc[0]
+                situacao = calculo['situacao']
+
+                if situacao not in (SITUACAO_DISTANCIA_ZERO, SITUACAO_SEM_DISTANCIA):
+                    if situacao == SITUACAO_PROPORCIONAL:
+                        st.info(f"**Nota:** Frete total ajustado proporcionalmente ao peso da mercadoria ({calculo['proporcao_peso']*100:.2f}% da capacidade do caminhão), pois o peso é inferior à capacidade total.")
+                    elif situacao == SITUACAO_CAPACIDADE_TOTAL:
+                        st.info(f"**Nota:** Frete calculado para capacidade total, pois o peso da mercadoria ({peso_mercadoria_kg_input:.2f} kg) é igual ou superior à capacidade do caminhão ({CAPACIDADE_TOTAL_CAMINHAO_KG:.2f} kg).")
+                    elif situacao == SITUACAO_SEM_PESO:
                          st.warning("Peso da mercadoria é 0. O frete estimado considera apenas custos fixos e adicionais não relacionados ao peso.")
-                         frete_total_calculado = valor_fixo_cd_antt + valor_dificuldade_input # Apenas custos fixos se não há peso
-                    else: # Caso CAPACIDADE_TOTAL_CAMINHAO_KG seja 0 ou não definido
+                    else: # SITUACAO_SEM_CAPACIDADE
                         st.warning("Capacidade total do caminhão não definida ou é zero. O cálculo proporcional não pôde ser aplicado.")
-                        frete_total_calculado = frete_total_cheio
-                    # --- FIM DA LÓGICA DE PROPORÇÃO ---
-
-
-                    # CORREÇÃO: Aplicando a sua fórmula exata para peso_transportado_calculado
-                    # Certifique-se de que o 23520 e a unidade do peso_mercadoria_kg_input (KG)
-                    # fazem sentido no contexto da sua fórmula.
-                    # Se 'tarifa' é frete_total_calculado, então:
-                    if peso_mercadoria_kg_input > 0 and distancia > 0: # Evita divisão por zero ou resultados sem sentido
-                        peso_transportado_calculado = peso_mercadoria_kg_input
-                    else:
-                        peso_transportado_calculado = 0.0 # Define como 0 se não houver peso ou distância
-
-                    frete_real_por_km = frete_total_calculado / distancia
-                    delta_vs_base = frete_real_por_km - coef_desloc_antt
-                    percent_change = (delta_vs_base / coef_desloc_antt * 100) if coef_desloc_antt > 0 else 0
 
+                    delta_vs_base = calculo['delta_vs_base_antt']
                     delta_color = "off"
                     arrow = "―"
                     if delta_vs_base > 0.001:
@@ -307,27 +389,24 @@ if submit_button:
 
                     st.markdown("#### 💰 Cálculos de Frete Detalhados")
                     det_cols = st.columns(4)
-                    det_cols[0].metric("Custo Desloc. (ANTT)", f"R$ {custo_deslocamento_antt:.2f}")
-                    det_cols[1].metric("Custo Adic. Desloc.", f"R$ {custo_adicional_desloc:.2f}", help=f"{adicional_deslocamento_taxa_input:.3f} R$/km * {distancia:.2f} km")
+                    det_cols[0].metric("Custo Desloc. (ANTT)", f"R$ {calculo['custo_deslocamento_antt']:.2f}")
+                    det_cols[1].metric("Custo Adic. Desloc.", f"R$ {calculo['custo_adicional_desloc']:.2f}", help=f"{adicional_deslocamento_taxa_input:.3f} R$/km * {distancia:.2f} km")
                     det_cols[2].metric("Valor por Dificuldade", f"R$ {valor_dificuldade_input:.2f}")
 
                     st.markdown("---")
                     st.subheader("Estimativas Finais do Frete:")
-                    # CORREÇÃO: Crie 3 colunas para os resultados finais
                     final_col1, final_col2, final_col3 = st.columns(3)
-                    final_col1.metric("Valor Total Final Estimado", f"R$ {frete_total_calculado:.2f}")
+                    final_col1.metric("Valor Total Final Estimado", f"R$ {calculo['frete_total_calculado']:.2f}")
                     final_col2.metric(label=f"Frete Real (R$/km Total) {arrow}",
-                                      value=f"R$ {frete_real_por_km:.3f}",
-                                      delta=f"{percent_change:.1f}% vs Base ANTT",
+                                      value=f"R$ {calculo['frete_real_por_km']:.3f}",
+                                      delta=f"{calculo['percent_vs_base_antt']:.1f}% vs Base ANTT",
                                       delta_color=delta_color)
-                    # CORREÇÃO: Exibindo o resultado da sua fórmula
                     final_col3.metric(label="Peso Transportado (KG)",
-                                      value=f"{peso_transportado_calculado:.2f} (KG)") # Adicionado o value
+                                      value=f"{calculo['peso_transportado_kg']:.2f} (KG)")
 
-                elif distancia == 0:
+                elif situacao == SITUACAO_DISTANCIA_ZERO:
                     st.warning("Distância calculada é 0 km. Cálculos de R$/km e Peso Transportado não aplicáveis.")
-                    custos_fixos_total = valor_fixo_cd_antt + valor_dificuldade_input
-                    st.metric("Valor Total Estimado (Custos Fixos)", f"R$ {custos_fixos_total:.2f}")
+                    st.metric("Valor Total Estimado (Custos Fixos)", f"R$ {calculo['frete_total_calculado']:.2f}")
                 else:
                     st.warning("Sem distância calculada, não é possível detalhar custos variáveis ou o 'Frete Real'.")
                     st.markdown(f"**Valor Fixo Carga/Descarga (ANTT):** R$ {valor_fixo_cd_antt:.2f}")
@@ -343,10 +422,12 @@ if submit_button:
             route_data = st.session_state.map_data.get('route')
 
             if map_df is not None and not map_df.empty:
+                pdk = importar_pydeck()
+                PYDECK_AVAILABLE = pdk is not None
                 if len(map_df) >= 1:
                     center_lat = map_df['latitude'].mean()
                     center_lon = map_df['longitude'].mean()
-                    initial_zoom = 3 if len(map_df) == 2 and distancia and distancia > 500 else 10 if len(map_df)==1 else 5
+                    initial_zoom = zoom_inicial_mapa(len(map_df), distancia)
                 else:
                     center_lat = -15.788497
                     center_lon = -47.879873
@@ -366,7 +447,7 @@ if submit_button:
                 if PYDECK_AVAILABLE and pdk is not None and route_data:
                     layers_map.append(pdk.Layer(
                         "PathLayer",
-                        data=route_data,
+                        data=[{"path": decodificar_polilinha(route_data['polilinha']), "name": route_data['name']}],
                         get_path="path",
                         get_width=15,
                         get_color=[0, 100, 255, 180],
@@ -377,19 +458,20 @@ if submit_button:
 
                 if PYDECK_AVAILABLE and pdk is not None:
                     try:
-                        st.pydeck_chart(pdk.Deck(
-                            map_style='mapbox://styles/mapbox/light-v9',
-                            initial_view_state=pdk.ViewState(
-                                latitude=center_lat,
-                                longitude=center_lon,
-                                zoom=initial_zoom,
-                                pitch=45,
-                                bearing=0
-                            ),
-                            layers=layers_map,
-                            tooltip={"html": "<b>{tipo}</b><br/>Lat: {latitude}<br/>Lon: {longitude}",
-                                     "style": {"backgroundColor": "steelblue", "color": "white"}}
-                        ))
+                        with registro.etapa("renderizacao_mapa"):
+                            st.pydeck_chart(pdk.Deck(
+                                map_style='mapbox://styles/mapbox/light-v9',
+                                initial_view_state=pdk.ViewState(
+                                    latitude=center_lat,
+                                    longitude=center_lon,
+                                    zoom=initial_zoom,
+                                    pitch=45,
+                                    bearing=0
+                                ),
+                                layers=layers_map,
+                                tooltip={"html": "<b>{tipo}</b><br/>Lat: {latitude}<br/>Lon: {longitude}",
+                                         "style": {"backgroundColor": "steelblue", "color": "white"}}
+                            ))
                     except Exception as e_map:
                         st.error(f"Erro ao gerar mapa com Pydeck: {e_map}. Usando st.map como fallback se possível.")
                         if not map_df.empty: st.map(map_df, zoom=initial_zoom)
@@ -399,14 +481,308 @@ if submit_button:
             else:
                 st.caption("Coordenadas não disponíveis para exibir o mapa.")
 
+            duracao_cotacao_s = time.perf_counter() - inicio_cotacao
+            METRICAS.observar("cotacao_duracao_segundos", duracao_cotacao_s)
+            METRICAS.incrementar("cotacoes_total", situacao=situacao or "sem_normativo")
+            registro.concluir(situacao=situacao, distancia_km=distancia, duracao_ms=round(duracao_cotacao_s * 1000, 3))
+            gravar_arquivo_metricas()
+
             with st.expander("🔍 Ver Log de Processamento OpenRouteService", expanded=False):
-                if st.session_state.ors_log:
-                    for msg in st.session_state.ors_log:
-                        if "✅" in msg: st.success(msg)
-                        elif "⚠️" in msg: st.warning(msg)
-                        elif "❌" in msg: st.error(msg)
-                        else: st.text(msg)
+                if registro.eventos:
+                    for evento in registro.eventos:
+                        if evento['nivel'] == NIVEL_SUCESSO: st.success(evento['mensagem'], icon="✅")
+                        elif evento['nivel'] == NIVEL_AVISO: st.warning(evento['mensagem'], icon="⚠️")
+                        elif evento['nivel'] == NIVEL_ERRO: st.error(evento['mensagem'], icon="❌")
+                        else: st.text(evento['mensagem'])
                 else:
                     st.caption("Nenhuma mensagem de log do ORS gerada.")
+                if registro.etapas:
+                    st.caption(f"Cotação `{registro.id}` em {duracao_cotacao_s*1000:.0f} ms. Tempo por etapa: "
+                               + " · ".join(f"{etapa['etapa']} {etapa['duracao_ms']:.1f} ms" for etapa in registro.etapas))
+                est_cache = cache_geocodificacao.estatisticas()
+                st.caption(f"Cache de geocodificação: {est_cache['entradas']} entradas, "
+                           f"{est_cache['acertos'] + est_cache['acertos_negativos']} acertos, "
+                           f"{est_cache['falhas']} falhas ({est_cache['taxa_acerto']*100:.0f}% de acerto).")
+                est_rotas = cache_rotas.estatisticas()
+                st.caption(f"Cache de rotas: {est_rotas['entradas']} rotas, {est_rotas['acertos']} acertos, "
+                           f"{est_rotas['falhas']} falhas ({est_rotas['taxa_acerto']*100:.0f}% de acerto).")
     elif not ORS_CLIENT_VALID:
         st.error("Cálculo não pode prosseguir: Cliente OpenRouteService não inicializado.")
+
+# ----- ROTA COM MÚLTIPLAS PARADAS -----
+st.markdown("---")
+st.subheader("🧭 Rota com Múltiplas Paradas")
+st.caption("Informe uma parada por linha; a primeira é a origem. As distâncias entre todas as paradas vêm do "
+           "cache de rotas ou de uma única matriz do ORS, e a ordem de visita é otimizada antes da precificação.")
+with st.form(key="paradas_form"):
+    col_paradas, col_opcoes = st.columns([2, 1])
+    with col_paradas:
+        paradas_input = st.text_area("Paradas:", value="Fortaleza, CE\nNatal, RN\nRecife, PE\nJoão Pessoa, PB",
+                                     height=160, help="Uma localidade por linha, ex.: Recife, PE")
+    with col_opcoes:
+        data_paradas_dt = st.date_input("Data da requisição:", datetime.now(), key="data_paradas")
+        retorno_paradas_input = st.checkbox("Voltar à origem ao final", value=False)
+        fixar_fim_paradas_input = st.checkbox("Manter a última parada como destino final", value=False)
+    col_adic1, col_adic2, col_adic3 = st.columns(3)
+    with col_adic1:
+        dificuldade_paradas_input = st.number_input("Valor por Dificuldade (R$):", min_value=0.0, value=0.0,
+                                                    format="%.2f", key="dificuldade_paradas")
+    with col_adic2:
+        adicional_paradas_input = st.number_input("Adicional por deslocamento (R$/km):", min_value=0.0, value=0.0,
+                                                  format="%.3f", key="adicional_paradas")
+    with col_adic3:
+        peso_paradas_input = st.number_input("Peso da Mercadoria (KG):", min_value=0.0, value=0.0, format="%.2f",
+                                             key="peso_paradas")
+    versao_tarifas_paradas = repositorio_tarifas_antt.versao()
+    tipo_carga_paradas_input, eixos_paradas_input = seletores_tarifa_antt(versao_tarifas_paradas, "paradas")
+    paradas_button = st.form_submit_button("Otimizar e Cotar Rota 🧭", disabled=not ORS_CLIENT_VALID)
+
+if paradas_button and ORS_CLIENT_VALID:
+    from multiparadas import planejar_paradas, METODO_EXATO
+    from precificacao import precificar, CAPACIDADE_TOTAL_CAMINHAO_KG
+    import pandas as pd
+
+    with st.spinner("Calculando matriz de distâncias e ordem de visita... ⏳"):
+        inicio_paradas = time.perf_counter()
+        try:
+            plano = planejar_paradas(paradas_input.splitlines(), backend_roteamento, cache_geocodificacao, cache_rotas,
+                                     PERFIL_ROTA_ORS, indice_municipios, fixar_fim=fixar_fim_paradas_input,
+                                     retorno=retorno_paradas_input)
+        except ServicoRoteamentoIndisponivel as e:
+            plano = {'erro': f"ORS: Serviço temporariamente indisponível ({e}). Tente novamente em instantes."}
+        except (ors_exceptions.ApiError, ErroRoteamento) as e:
+            plano = {'erro': f"ORS API Error (matriz de distâncias): {e}"}
+
+    data_paradas_str = data_paradas_dt.strftime('%d/%m/%Y')
+    normativo_paradas, frete_paradas, _ = encontrar_frete_vigente(
+        versao_tarifas_paradas, data_paradas_str, tipo_carga_paradas_input, eixos_paradas_input)
+    situacao_paradas = None
+    if plano['erro']:
+        st.error(plano['erro'])
+    elif not frete_paradas:
+        st.warning(f"Nenhuma tabela de frete ANTT para a data {data_paradas_str}.")
+    else:
+        distancia_total = plano['distancia_total_km']
+        calculo_paradas = precificar(
+            distancia_total, frete_paradas[0], frete_paradas[1], peso_paradas_input, adicional_paradas_input,
+            dificuldade_paradas_input, CAPACIDADE_TOTAL_CAMINHAO_KG,
+        ).iloc[0]
+        situacao_paradas = calculo_paradas['situacao']
+
+        st.info(f"**Normativo Aplicável:** {normativo_paradas}")
+        res_cols = st.columns(4)
+        res_cols[0].metric("Distância Total", f"{distancia_total:.2f} km")
+        informada = plano['distancia_ordem_informada_km']
+        if informada:
+            economia = informada - distancia_total
+            res_cols[1].metric("Economia vs Ordem Informada", f"{economia:.2f} km",
+                               delta=f"-{economia / informada * 100:.1f}%" if economia > 0.005 else None,
+                               delta_color="inverse")
+        res_cols[2].metric("Valor Total Final Estimado", f"R$ {calculo_paradas['frete_total_calculado']:.2f}")
+        if distancia_total > 0:
+            res_cols[3].metric("Frete Real (R$/km Total)", f"R$ {calculo_paradas['frete_real_por_km']:.3f}")
+        st.caption(f"Ordem de visita {'exata' if plano['metodo'] == METODO_EXATO else 'aproximada (vizinho mais próximo + 2-opt)'} "
+                   f"para {len(plano['paradas']) - (1 if retorno_paradas_input else 0)} paradas; "
+                   f"valor fixo de carga/descarga ANTT aplicado uma vez à viagem.")
+
+        df_paradas = pd.DataFrame(plano['paradas'])
+        df_paradas['acumulado_km'] = df_paradas['trecho_km'].cumsum()
+        st.dataframe(df_paradas[['ordem', 'parada', 'trecho_km', 'acumulado_km']], hide_index=True, width="stretch")
+
+        # Trechos desenhados com a geometria do cache de rotas quando existe; senão, em linha reta.
+        # Nenhuma chamada de `directions` é feita só para o mapa.
+        pdk = importar_pydeck()
+        if pdk is not None:
+            pontos_paradas = [[p['longitude'], p['latitude']] for p in plano['paradas']]
+            trechos_mapa = []
+            for origem_trecho, destino_trecho in zip(pontos_paradas, pontos_paradas[1:]):
+                geometria_trecho = cache_rotas.obter_geometria(origem_trecho, destino_trecho, PERFIL_ROTA_ORS)
+                trechos_mapa.append({'path': geometria_trecho or [origem_trecho, destino_trecho]})
+            df_paradas['tipo'] = df_paradas['ordem'].astype(str) + ". " + df_paradas['parada']
+            st.pydeck_chart(pdk.Deck(
+                map_style='mapbox://styles/mapbox/light-v9',
+                initial_view_state=pdk.ViewState(latitude=df_paradas['latitude'].mean(),
+                                                 longitude=df_paradas['longitude'].mean(), zoom=5, pitch=0),
+                layers=[
+                    pdk.Layer("PathLayer", data=trechos_mapa, get_path="path", get_width=15,
+                              get_color=[0, 100, 255, 180], width_min_pixels=2),
+                    pdk.Layer('ScatterplotLayer', data=df_paradas, get_position='[longitude, latitude]',
+                              get_fill_color=[200, 30, 0, 200], get_radius=20000, pickable=True),
+                ],
+                tooltip={"html": "<b>{tipo}</b>", "style": {"backgroundColor": "steelblue", "color": "white"}},
+            ))
+        else:
+            st.map(df_paradas, zoom=5)
+
+    duracao_paradas_s = time.perf_counter() - inicio_paradas
+    METRICAS.observar("cotacao_duracao_segundos", duracao_paradas_s)
+    METRICAS.incrementar("cotacoes_total", situacao=situacao_paradas or ("erro" if plano['erro'] else "sem_normativo"))
+    METRICAS.incrementar("cotacoes_multiparadas_total", metodo=plano.get('metodo') or "erro")
+    gravar_arquivo_metricas()
+
+# ----- COTAÇÃO EM LOTE -----
+INTERVALO_ATUALIZACAO_LOTES_S = float(st.secrets.get("LOTE_INTERVALO_ATUALIZACAO_S", 2))
+st.markdown("---")
+st.subheader("📦 Cotação em Lote")
+st.caption("Envie um CSV ou XLSX com as colunas `data` (dd/mm/aaaa), `origem`, `destino` e, opcionalmente, "
+           "`peso_kg`, `adicional_km` (R$/km), `dificuldade` (R$), `tipo_carga` e `eixos` (tabela ANTT da linha). "
+           "Números com vírgula decimal (`1.234,5`) ou ponto decimal (`1234.5`), um formato por coluna; uma coluna "
+           "só com valores como `1.234` é recusada por ser ambígua. "
+           "O lote é cotado em segundo plano: a página pode ser fechada e reaberta pelo mesmo endereço.")
+with st.form(key="lote_form"):
+    arquivo_lote = st.file_uploader("Planilha de cotações:", type=["csv", "xlsx"])
+    formato_saida_lote = st.radio("Formato do resultado:", ["csv", "xlsx"], horizontal=True)
+    lote_button = st.form_submit_button("Cotar Lote 📦", disabled=not ORS_CLIENT_VALID)
+
+# Fila de lotes do processo: os jobs rodam fora da sessão, com checkpoint em disco por bloco.
+# Criada numa thread (importa pandas) e entregue como Future; backends de teste usam um
+# diretório temporário, como os caches em memória.
+@st.cache_resource
+def obter_fila_lotes(nome_backend, persistir):
+    futuro = Future()
+    def criar():
+        try:
+            from fila_lotes import FilaLotes, DIRETORIO_LOTES
+            diretorio = DIRETORIO_LOTES if persistir else tempfile.mkdtemp(prefix=f"lotes_{nome_backend}_")
+            futuro.set_result(FilaLotes(backend_roteamento, cache_geocodificacao, cache_rotas, PERFIL_ROTA_ORS,
+                                        indice_municipios, diretorio=diretorio))
+        except Exception as e:
+            futuro.set_exception(e)
+    threading.Thread(target=criar, name="fila-lotes", daemon=True).start()
+    return futuro
+
+# Fila pronta para uso, ou None com o erro na página se a criação falhou. O Future com
+# erro sai do cache: a próxima execução tenta criar a fila de novo.
+def obter_fila_lotes_ou_erro():
+    try:
+        return obter_fila_lotes(ROTEAMENTO_BACKEND, persistir_cache).result()
+    except Exception as e:
+        logger.exception("falha ao criar a fila de lotes")
+        obter_fila_lotes.clear()
+        st.error(f"Fila de lotes indisponível: {e}")
+        return None
+
+# Os ids dos lotes da sessão também ficam na URL (?lote=...): recarregar a página ou
+# reabrir o link depois de uma queda da conexão volta a acompanhar os mesmos jobs.
+if 'lotes' not in st.session_state:
+    st.session_state.lotes = st.query_params.get_all("lote")
+
+if lote_button:
+    from cotacao_lote import ler_planilha
+
+    if arquivo_lote is None:
+        st.error("Selecione uma planilha para a cotação em lote.")
+    else:
+        try:
+            df_lote = ler_planilha(arquivo_lote, arquivo_lote.name)
+        except ValueError as e:
+            st.error(f"Planilha inválida: {e}")
+            df_lote = None
+        fila_lotes = obter_fila_lotes_ou_erro() if df_lote is not None else None
+        if fila_lotes is not None:
+            id_lote = fila_lotes.enviar(df_lote, arquivo_lote.name, formato_saida_lote)
+            st.session_state.lotes = [id_lote] + st.session_state.lotes
+            st.query_params["lote"] = st.session_state.lotes
+
+fila_lotes = obter_fila_lotes_ou_erro() if st.session_state.lotes and ORS_CLIENT_VALID else None
+if fila_lotes is not None:
+    from fila_lotes import SITUACAO_CONCLUIDO, SITUACAO_ERRO, SITUACOES_ENCERRADAS
+
+    ROTULOS_SITUACAO_LOTE = {'na_fila': "⏳ na fila", 'processando': "⚙️ processando", 'concluido': "✅ concluído",
+                             'erro': "❌ erro", 'cancelado': "🚫 cancelado"}
+    lotes_ativos = [id_lote for id_lote in st.session_state.lotes
+                    if (fila_lotes.estado(id_lote) or {}).get('situacao') not in (None, *SITUACOES_ENCERRADAS)]
+
+    # Leituras do disco compartilhadas entre sessões, refeitas só quando um bloco fica pronto:
+    # enquanto o job roda, só o último bloco; concluído, a planilha inteira e o arquivo de
+    # download que a fila gerou ao concluir.
+    @st.cache_resource(max_entries=16, show_spinner=False)
+    def carregar_resultado_lote(_fila_lotes, id_lote, blocos_concluidos, concluido):
+        return _fila_lotes.resultado(id_lote) if concluido else _fila_lotes.ultimo_bloco(id_lote)
+
+    @st.cache_resource(max_entries=16, show_spinner=False)
+    def carregar_arquivo_resultado_lote(_fila_lotes, id_lote):
+        return _fila_lotes.arquivo_resultado(id_lote)
+
+    # Só o quadro dos lotes é redesenhado a cada INTERVALO_ATUALIZACAO_LOTES_S enquanto há
+    # job em andamento; quando o último termina, uma execução completa desliga a atualização.
+    @st.fragment(run_every=INTERVALO_ATUALIZACAO_LOTES_S if lotes_ativos else None)
+    def exibir_lotes():
+        for id_lote in st.session_state.lotes:
+            estado = fila_lotes.estado(id_lote)
+            if estado is None:
+                st.caption(f"Lote `{id_lote}` não encontrado (removido ou de outro servidor).")
+                continue
+            with st.container(border=True):
+                st.markdown(f"**Lote `{id_lote}`** · {estado['nome_arquivo']} · "
+                            f"{ROTULOS_SITUACAO_LOTE.get(estado['situacao'], estado['situacao'])}")
+                st.progress(estado['blocos_concluidos'] / estado['blocos'],
+                            text=f"{estado['linhas_concluidas']} de {estado['linhas']} linhas cotadas "
+                                 f"({estado['linhas_ok']} ok) · bloco {estado['blocos_concluidos']}/{estado['blocos']}")
+                if estado['erro']:
+                    st.error(f"Lote interrompido: {estado['erro']}")
+                concluido = estado['situacao'] == SITUACAO_CONCLUIDO
+                resultado_lote = carregar_resultado_lote(fila_lotes, id_lote, estado['blocos_concluidos'], concluido)
+                if resultado_lote is not None and not resultado_lote.empty:
+                    if not concluido:
+                        st.caption(f"Último bloco cotado ({estado['blocos_concluidos']} de {estado['blocos']}); "
+                                   "a planilha completa aparece ao concluir.")
+                    st.dataframe(resultado_lote, width="stretch", height=250)
+                acoes = st.columns(3)
+                if concluido:
+                    formato = estado['formato_saida']
+                    acoes[0].download_button(
+                        "Baixar resultado ⬇️",
+                        data=carregar_arquivo_resultado_lote(fila_lotes, id_lote),
+                        file_name=f"cotacao_lote_{id_lote}.{formato}",
+                        mime="text/csv" if formato == "csv" else
+                        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        key=f"baixar_lote_{id_lote}",
+                    )
+                elif estado['situacao'] == SITUACAO_ERRO:
+                    if acoes[0].button("Retomar 🔁", key=f"retomar_lote_{id_lote}"):
+                        fila_lotes.reenviar(id_lote)
+                        st.rerun()
+                elif estado['situacao'] not in SITUACOES_ENCERRADAS:
+                    if acoes[0].button("Cancelar ✖️", key=f"cancelar_lote_{id_lote}"):
+                        fila_lotes.cancelar(id_lote)
+                        st.rerun()
+        if lotes_ativos and all((fila_lotes.estado(id_lote) or {}).get('situacao') in SITUACOES_ENCERRADAS
+                                for id_lote in lotes_ativos):
+            gravar_arquivo_metricas()
+            st.rerun()
+
+    exibir_lotes()
+
+# ----- PRÉ-CARGA E TEMPO ATÉ A PRIMEIRA RENDERIZAÇÃO -----
+# Uma vez por processo, depois que a primeira sessão já viu o formulário: importa em segundo
+# plano os módulos da cotação, para que a primeira cotação também não pague por eles.
+@st.cache_resource
+def pre_carregar_modulos_cotacao():
+    def carregar():
+        import precificacao, geometria, cotacao_lote, multiparadas  # noqa: F401
+        importar_pydeck()
+    thread = threading.Thread(target=carregar, name="pre-carga-cotacao", daemon=True)
+    thread.start()
+    return thread
+
+@st.cache_resource
+def obter_contador_sessoes():
+    return itertools.count()
+
+pre_carregar_modulos_cotacao()
+
+# Da primeira linha do script até aqui, na primeira execução de cada sessão. Na primeira
+# sessão do processo ("frio") inclui importações e a criação dos recursos compartilhados.
+if 'primeira_execucao_ms' not in st.session_state:
+    duracao_primeira_execucao_s = time.perf_counter() - inicio_execucao
+    processo = "frio" if next(obter_contador_sessoes()) == 0 else "quente"
+    st.session_state.primeira_execucao_ms = round(duracao_primeira_execucao_s * 1000, 3)
+    METRICAS.observar("sessao_primeira_execucao_segundos", duracao_primeira_execucao_s, processo=processo)
+    logger.info("primeira execução da sessão", extra={'campos': {
+        'duracao_ms': st.session_state.primeira_execucao_ms, 'processo': processo}})
+
+# Cria a fila de lotes já na primeira sessão, sem esperar: retoma os jobs que um processo
+# anterior deixou pela metade mesmo que ninguém abra a seção de lotes.
+if ORS_CLIENT_VALID:
+    obter_fila_lotes(ROTEAMENTO_BACKEND, persistir_cache)
@@ -0,0 +1,429 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import requests
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+# ----- BENCHMARKS E TESTE DE CARGA -----
+# Mede a latência das partes quentes da cotação (busca do normativo ANTT, cálculo do frete
+# e rotas via ORS, simples e com múltiplas paradas, contra um servidor falso local) e sobe
+# o app num servidor Streamlit headless, com N sessões simultâneas (websocket) preenchendo
+# e enviando o formulário.
+# Compara com a linha de base gravada nesta máquina e sai com código 1 se alguma métrica
+# piorar além do limiar, ou 2 se não houver linha de base (ela depende da máquina e não é
+# versionada; use --sem-linha-base só para medir).
+#   python -m benchmarks.benchmark --gravar-linha-base
+#   python -m benchmarks.benchmark --sessoes 20 --latencia-ms 80 --taxa-429 0.05
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CAMINHO_LINHA_BASE = os.path.join(RAIZ, "benchmarks", "linha_base.json")
+LIMIAR_REGRESSAO = float(os.environ.get("BENCHMARK_LIMIAR_REGRESSAO", 0.25))
+# Diferenças de latência abaixo disto são ruído de medição, não regressão.
+FOLGA_ABSOLUTA_MS = 0.01
+CENARIOS = ("frete_vigente", "precificar_escalar", "precificar_vetorizado", "rota_ors_falso", "multiparadas",
+            "partida_a_frio", "carga_sessoes")
+
+# Caches e métricas em diretório temporário (o benchmark não pode aquecer nem sujar o cache
+# real) e limitador folgado para medir o app, não a cota do plano do ORS; tudo antes de
+# importar os módulos do app, que leem a configuração na importação.
+_DIRETORIO_TEMPORARIO = tempfile.mkdtemp(prefix="benchmark-fretes-")
+os.environ["CACHE_GEOCODIFICACAO_PATH"] = os.path.join(_DIRETORIO_TEMPORARIO, "geocodificacao.sqlite3")
+os.environ["CACHE_ROTAS_PATH"] = os.path.join(_DIRETORIO_TEMPORARIO, "rotas.sqlite3")
+os.environ["METRICAS_PATH"] = os.path.join(_DIRETORIO_TEMPORARIO, "metricas.prom")
+os.environ.setdefault("ORS_REQUISICOES_POR_MINUTO", "60000")
+os.environ.setdefault("ORS_RAJADA_MAXIMA", "50")
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+import pandas as pd  # noqa: E402
+
+from antt import repositorio_tarifas_antt, encontrar_frete_vigente  # noqa: E402
+from precificacao import precificar, precificar_cotacoes  # noqa: E402
+from roteamento import criar_backend  # noqa: E402
+from cache_geocodificacao import CacheGeocodificacao  # noqa: E402
+from cache_rotas import CacheRotas  # noqa: E402
+from multiparadas import planejar_paradas  # noqa: E402
+from benchmarks.servidor_ors_falso import ServidorORSFalso  # noqa: E402
+
+
+def rss_pico_mb():
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB; macOS, em bytes.
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+
+def resumir(latencias_s, itens, duracao_s, falhas=0):
+    latencias_ms = np.asarray(latencias_s) * 1000
+    p50, p95, p99 = np.percentile(latencias_ms, [50, 95, 99]) if len(latencias_ms) else (np.nan,) * 3
+    return {
+        'amostras': len(latencias_ms),
+        'p50_ms': round(float(p50), 4),
+        'p95_ms': round(float(p95), 4),
+        'p99_ms': round(float(p99), 4),
+        'vazao_por_s': round(itens / duracao_s, 2) if duracao_s > 0 else 0.0,
+        'falhas': falhas,
+    }
+
+
+def medir(funcao, repeticoes, itens_por_chamada=1):
+    latencias = []
+    inicio = time.perf_counter()
+    for i in range(repeticoes):
+        t0 = time.perf_counter()
+        funcao(i)
+        latencias.append(time.perf_counter() - t0)
+    return resumir(latencias, repeticoes * itens_por_chamada, time.perf_counter() - inicio)
+
+
+def datas_aleatorias(quantidade, semente=7):
+    aleatorio = np.random.default_rng(semente)
+    dias = aleatorio.integers(0, (date(2026, 12, 31) - date(2019, 1, 1)).days, quantidade)
+    return [(date(2019, 1, 1) + timedelta(days=int(d))).strftime('%d/%m/%Y') for d in dias]
+
+
+def bench_frete_vigente(args):
+    datas = datas_aleatorias(args.repeticoes * 10)
+    return medir(lambda i: encontrar_frete_vigente(repositorio_tarifas_antt, datas[i]), len(datas))
+
+
+def bench_precificar_escalar(args):
+    return medir(lambda i: precificar(1000.0 + i, 3.7931, 426.61, peso_kg=5000.0 + i,
+                                      adicional_km=0.1, dificuldade=50.0), args.repeticoes)
+
+
+def bench_precificar_vetorizado(args):
+    aleatorio = np.random.default_rng(11)
+    df = pd.DataFrame({
+        'data': datas_aleatorias(args.linhas_lote),
+        'distancia_km': aleatorio.uniform(10, 4000, args.linhas_lote),
+        'peso_kg': aleatorio.uniform(0, 30000, args.linhas_lote),
+        'adicional_km': 0.1,
+        'dificuldade': 0.0,
+    })
+    return medir(lambda i: precificar_cotacoes(df), max(args.repeticoes // 50, 5), itens_por_chamada=len(df))
+
+
+# Mesmo caminho de rede de `calcular_rota_e_distancia_ors` (origem e destino geocodificados
+# em paralelo, depois a rota), sem os caches, contra o servidor falso.
+def bench_rota_ors_falso(args, servidor):
+    backend = criar_backend("ors", ors_api_key="benchmark", ors_base_url=servidor.url)
+    falhas = 0
+
+    def cotar(i):
+        nonlocal falhas
+        try:
+            futuros = [backend.submeter(backend.geocodificar, f"Rua {i}, Fortaleza"),
+                       backend.submeter(backend.geocodificar, f"Avenida {i}, Recife")]
+            coords_origem, coords_destino = (f.result() for f in futuros)
+            backend.rota(coords_origem, coords_destino, "driving-car")
+        except Exception:
+            falhas += 1
+
+    try:
+        resultado = medir(cotar, args.rotas)
+    finally:
+        backend.encerrar()
+    resultado['falhas'] = falhas
+    resultado['retentativas_ors'] = backend.agendador.contadores()['retentativas']
+    return resultado
+
+
+# Pico de memória residente de outro processo (Linux; None onde /proc não existe).
+def rss_pico_processo_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as arquivo:
+            for linha in arquivo:
+                if linha.startswith("VmHWM:"):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Sobe o app de verdade (`streamlit run` headless) apontando para o ORS falso; as sessões
+# compartilham backend, caches e limitador (st.cache_resource) como em produção.
+def iniciar_servidor_streamlit(url_ors, timeout_s=60):
+    porta = porta_livre()
+    caminho_secrets = os.path.join(_DIRETORIO_TEMPORARIO, "secrets.toml")
+    with open(caminho_secrets, "w", encoding="utf-8") as arquivo:
+        arquivo.write(f'ORS_API_KEY = "benchmark"\nORS_BASE_URL = "{url_ors}"\n')
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", os.path.join(RAIZ, "app.py"),
+         "--server.headless", "true", "--server.port", str(porta), "--server.address", "127.0.0.1",
+         "--secrets.files", caminho_secrets, "--browser.gatherUsageStats", "false"],
+        cwd=_DIRETORIO_TEMPORARIO, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    limite = time.monotonic() + timeout_s
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f"Servidor Streamlit encerrou com código {processo.returncode}.")
+        try:
+            if requests.get(f"http://127.0.0.1:{porta}/_stcore/health", timeout=1).ok:
+                return processo, porta
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.2)
+    processo.kill()
+    raise RuntimeError(f"Servidor Streamlit não respondeu em {timeout_s:.0f}s.")
+
+
+# Uma execução do script na sessão; devolve os elementos renderizados [(tipo, proto)].
+async def _executar_script(conexao, estados_widgets=()):
+    mensagem = BackMsg()
+    mensagem.rerun_script.query_string = ""
+    mensagem.rerun_script.widget_states.widgets.extend(estados_widgets)
+    await conexao.send(mensagem.SerializeToString())
+    elementos = []
+    while True:
+        recebida = ForwardMsg()
+        recebida.ParseFromString(await conexao.recv())
+        tipo = recebida.WhichOneof("type")
+        if tipo == "delta" and recebida.delta.WhichOneof("type") == "new_element":
+            elemento = recebida.delta.new_element
+            tipo_elemento = elemento.WhichOneof("type")
+            elementos.append((tipo_elemento, getattr(elemento, tipo_elemento)))
+        elif tipo == "script_finished":
+            return elementos
+
+
+# Cada sessão é uma conexão websocket própria, como uma aba do navegador: abre o app,
+# preenche o formulário (endereços inéditos, para não cair nos caches) e envia.
+async def _sessao(url_websocket, numero, args, latencias):
+    async with websockets.connect(url_websocket, subprotocols=["streamlit"], max_size=None) as conexao:
+        elementos = await _executar_script(conexao)
+        ids = {widget.label: widget.id for _, widget in elementos if getattr(widget, "id", "")}
+        falhas = 0
+        for k in range(args.cotacoes_por_sessao):
+            estados = [
+                WidgetState(id=ids["Local de Origem:"], string_value=f"Rua {numero}-{k}, Fortaleza"),
+                WidgetState(id=ids["Local de Destino:"], string_value=f"Avenida {numero}-{k}, São Paulo"),
+                WidgetState(id=ids["Peso da Mercadoria (KG):"], double_value=1000.0 * (k + 1)),
+                WidgetState(id=ids["Calcular Frete e Distância ⚙️"], trigger_value=True),
+            ]
+            t0 = time.perf_counter()
+            elementos = await asyncio.wait_for(_executar_script(conexao, estados), args.timeout_s)
+            latencias.append(time.perf_counter() - t0)
+            ok = not any(tipo == "exception" for tipo, _ in elementos) and any(
+                tipo == "metric" and widget.label.startswith("Distância") for tipo, widget in elementos)
+            falhas += 0 if ok else 1
+        return falhas
+
+
+async def _primeira_execucao(url_websocket):
+    async with websockets.connect(url_websocket, subprotocols=["streamlit"], max_size=None) as conexao:
+        inicio = time.perf_counter()
+        await _executar_script(conexao)
+        return time.perf_counter() - inicio
+
+
+# Latência da primeira renderização de uma sessão logo após subir o servidor (processo frio:
+# importações e recursos compartilhados ainda por criar); informa também o tempo até o
+# servidor responder e a primeira renderização de uma segunda sessão (processo quente).
+def bench_partida_a_frio(args, servidor):
+    partidas, frias, quentes = [], [], []
+    for _ in range(args.partidas):
+        inicio = time.perf_counter()
+        processo, porta = iniciar_servidor_streamlit(servidor.url)
+        partidas.append(time.perf_counter() - inicio)
+        url_websocket = f"ws://127.0.0.1:{porta}/_stcore/stream"
+        try:
+            frias.append(asyncio.run(_primeira_execucao(url_websocket)))
+            # Deixa a pré-carga em segundo plano do app terminar antes da sessão "quente".
+            time.sleep(2)
+            quentes.append(asyncio.run(_primeira_execucao(url_websocket)))
+        finally:
+            processo.terminate()
+            processo.wait(timeout=10)
+    resultado = resumir(frias, len(frias), sum(frias))
+    resultado['partida_servidor_p50_ms'] = round(float(np.median(partidas)) * 1000, 1)
+    resultado['primeira_execucao_quente_p50_ms'] = round(float(np.median(quentes)) * 1000, 1)
+    return resultado
+
+
+def bench_carga_sessoes(args, servidor):
+    processo, porta = iniciar_servidor_streamlit(servidor.url)
+    url_websocket = f"ws://127.0.0.1:{porta}/_stcore/stream"
+    latencias = []
+
+    async def todas():
+        return await asyncio.gather(*(_sessao(url_websocket, n, args, latencias) for n in range(args.sessoes)),
+                                    return_exceptions=True)
+
+    try:
+        inicio = time.perf_counter()
+        resultados = asyncio.run(todas())
+        duracao = time.perf_counter() - inicio
+        rss_servidor = rss_pico_processo_mb(processo.pid)
+    finally:
+        processo.terminate()
+        processo.wait(timeout=10)
+    falhas = sum(r if isinstance(r, int) else args.cotacoes_por_sessao for r in resultados)
+    resultado = resumir(latencias, len(latencias), duracao, falhas)
+    if rss_servidor is not None:
+        resultado['rss_pico_servidor_mb'] = round(rss_servidor, 1)
+    return resultado
+
+
+# Rota de `args.paradas` paradas com caches vazios a cada cotação: geocodificação, uma matriz
+# N x N no ORS falso e a otimização da ordem (exata ou 2-opt, conforme o número de paradas).
+def bench_multiparadas(args, servidor):
+    backend = criar_backend("ors", ors_api_key="benchmark", ors_base_url=servidor.url)
+    falhas = 0
+
+    def cotar(i):
+        nonlocal falhas
+        nomes = [f"Parada {i}-{n}, CE" for n in range(args.paradas)]
+        try:
+            plano = planejar_paradas(nomes, backend, CacheGeocodificacao(":memory:"), CacheRotas(":memory:"),
+                                     "driving-car", retorno=True)
+            falhas += bool(plano['erro'])
+        except Exception:
+            falhas += 1
+
+    try:
+        resultado = medir(cotar, max(args.rotas // 3, 3))
+    finally:
+        backend.encerrar()
+    resultado['falhas'] = falhas
+    return resultado
+
+
+def executar(args):
+    resultados = {}
+    with ServidorORSFalso(args.latencia_ms, args.taxa_429) as servidor:
+        for cenario in args.cenarios:
+            print(f"• {cenario}...", flush=True)
+            if cenario == "frete_vigente":
+                resultados[cenario] = bench_frete_vigente(args)
+            elif cenario == "precificar_escalar":
+                resultados[cenario] = bench_precificar_escalar(args)
+            elif cenario == "precificar_vetorizado":
+                resultados[cenario] = bench_precificar_vetorizado(args)
+            elif cenario == "rota_ors_falso":
+                resultados[cenario] = bench_rota_ors_falso(args, servidor)
+            elif cenario == "multiparadas":
+                resultados[cenario] = bench_multiparadas(args, servidor)
+            elif cenario == "partida_a_frio":
+                resultados[cenario] = bench_partida_a_frio(args, servidor)
+            elif cenario == "carga_sessoes":
+                resultados[cenario] = bench_carga_sessoes(args, servidor)
+        requisicoes_servidor = dict(servidor.contadores)
+    return {
+        'parametros': {'latencia_ms': args.latencia_ms, 'taxa_429': args.taxa_429, 'sessoes': args.sessoes,
+                       'cotacoes_por_sessao': args.cotacoes_por_sessao},
+        'cenarios': resultados,
+        'servidor_ors_falso': requisicoes_servidor,
+        'rss_pico_mb': round(rss_pico_mb(), 1),
+    }
+
+
+# Lista de regressões: latência (p50/p95) ou memória (RSS de pico) acima de (1 + limiar) x
+# linha de base, vazão abaixo de (1 - limiar) x linha de base, ou falhas que não existiam.
+# O p99 só é informado: nos micro-benchmarks ele oscila demais entre execuções.
+def comparar(resultado, linha_base, limiar):
+    regressoes = []
+    for cenario, atual in resultado['cenarios'].items():
+        base = linha_base.get('cenarios', {}).get(cenario)
+        if not base:
+            continue
+        for metrica in ('p50_ms', 'p95_ms'):
+            if atual[metrica] > base[metrica] * (1 + limiar) + FOLGA_ABSOLUTA_MS:
+                regressoes.append(f"{cenario}.{metrica}: {atual[metrica]:.3f} (base {base[metrica]:.3f})")
+        if atual['vazao_por_s'] < base['vazao_por_s'] * (1 - limiar):
+            regressoes.append(f"{cenario}.vazao_por_s: {atual['vazao_por_s']:.2f} (base {base['vazao_por_s']:.2f})")
+        if atual['falhas'] > base['falhas']:
+            regressoes.append(f"{cenario}.falhas: {atual['falhas']} (base {base['falhas']})")
+        rss_base, rss_atual = base.get('rss_pico_servidor_mb'), atual.get('rss_pico_servidor_mb')
+        if rss_base and rss_atual and rss_atual > rss_base * (1 + limiar):
+            regressoes.append(f"{cenario}.rss_pico_servidor_mb: {rss_atual:.1f} (base {rss_base:.1f})")
+    if linha_base.get('rss_pico_mb') and resultado['rss_pico_mb'] > linha_base['rss_pico_mb'] * (1 + limiar):
+        regressoes.append(f"rss_pico_mb: {resultado['rss_pico_mb']:.1f} (base {linha_base['rss_pico_mb']:.1f})")
+    return regressoes
+
+
+def imprimir(resultado):
+    print(f"\n{'cenário':<24}{'amostras':>9}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'itens/s':>12}{'falhas':>8}")
+    for cenario, r in resultado['cenarios'].items():
+        print(f"{cenario:<24}{r['amostras']:>9}{r['p50_ms']:>11.3f}{r['p95_ms']:>11.3f}{r['p99_ms']:>11.3f}"
+              f"{r['vazao_por_s']:>12.1f}{r['falhas']:>8}")
+    if 'partida_a_frio' in resultado['cenarios']:
+        partida = resultado['cenarios']['partida_a_frio']
+        print(f"\nPartida a frio: servidor pronto em {partida['partida_servidor_p50_ms']:.0f} ms; primeira renderização "
+              f"{partida['p50_ms']:.0f} ms (frio) e {partida['primeira_execucao_quente_p50_ms']:.0f} ms (quente)")
+    if 'rss_pico_servidor_mb' in resultado['cenarios'].get('carga_sessoes', {}):
+        print(f"\nRSS de pico do servidor Streamlit: {resultado['cenarios']['carga_sessoes']['rss_pico_servidor_mb']:.1f} MB")
+    print(f"RSS de pico do benchmark: {resultado['rss_pico_mb']:.1f} MB | requisições ao ORS falso: {resultado['servidor_ors_falso']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks e teste de carga da calculadora de frete.")
+    parser.add_argument("--cenarios", nargs="+", choices=CENARIOS, default=list(CENARIOS))
+    parser.add_argument("--repeticoes", type=int, default=2000, help="Chamadas nos micro-benchmarks.")
+    parser.add_argument("--linhas-lote", type=int, default=10000, help="Linhas no cálculo vetorizado.")
+    parser.add_argument("--rotas", type=int, default=30, help="Cotações no cenário rota_ors_falso.")
+    parser.add_argument("--paradas", type=int, default=12, help="Paradas por rota no cenário multiparadas.")
+    parser.add_argument("--partidas", type=int, default=3, help="Servidores iniciados no cenário partida_a_frio.")
+    parser.add_argument("--sessoes", type=int, default=8, help="Sessões simultâneas no teste de carga.")
+    parser.add_argument("--cotacoes-por-sessao", type=int, default=3)
+    parser.add_argument("--latencia-ms", type=float, default=50.0, help="Latência do ORS falso.")
+    parser.add_argument("--taxa-429", type=float, default=0.0, help="Fração de respostas HTTP 429 do ORS falso.")
+    parser.add_argument("--timeout-s", type=float, default=120.0, help="Tempo máximo de cada cotação no teste de carga.")
+    parser.add_argument("--limiar", type=float, default=LIMIAR_REGRESSAO, help="Piora tolerada (0.25 = 25%%).")
+    parser.add_argument("--linha-base", default=CAMINHO_LINHA_BASE)
+    parser.add_argument("--gravar-linha-base", action="store_true")
+    parser.add_argument("--sem-linha-base", action="store_true", help="Só mede, sem comparar com a linha de base.")
+    parser.add_argument("--saida", help="Grava o resultado completo neste arquivo JSON.")
+    args = parser.parse_args(argv)
+    # Sem linha de base não há portão de regressão: falha já, antes de gastar minutos medindo.
+    if not (args.gravar_linha_base or args.sem_linha_base or os.path.exists(args.linha_base)):
+        print(f"❌ Sem linha de base em {args.linha_base}: rode com --gravar-linha-base para criar uma "
+              f"nesta máquina ou com --sem-linha-base para só medir.")
+        return 2
+
+    resultado = executar(args)
+    imprimir(resultado)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            json.dump(resultado, arquivo, indent=2, ensure_ascii=False)
+
+    if args.gravar_linha_base:
+        with open(args.linha_base, "w", encoding="utf-8") as arquivo:
+            json.dump(resultado, arquivo, indent=2, ensure_ascii=False)
+        print(f"Linha de base gravada em {args.linha_base}.")
+        return 0
+    if args.sem_linha_base:
+        return 0
+    with open(args.linha_base, encoding="utf-8") as arquivo:
+        linha_base = json.load(arquivo)
+    if linha_base.get('parametros') != resultado['parametros']:
+        print(f"⚠️ Parâmetros diferentes da linha de base ({linha_base.get('parametros')}); a comparação pode não ser justa.")
+    regressoes = comparar(resultado, linha_base, args.limiar)
+    if regressoes:
+        print(f"\n❌ Regressões acima de {args.limiar:.0%}:")
+        for regressao in regressoes:
+            print(f"  - {regressao}")
+        return 1
+    print(f"\n✅ Sem regressões acima de {args.limiar:.0%} em relação à linha de base.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
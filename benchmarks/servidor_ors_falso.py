@@ -0,0 +1,143 @@
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# ----- SERVIDOR ORS FALSO PARA BENCHMARKS -----
+# Responde aos endpoints usados pelo app (/geocode/search, /v2/directions e /v2/matrix)
+# com dados determinísticos, latência configurável e injeção de HTTP 429.
+
+
+def _coordenadas_para(texto):
+    resumo = hashlib.sha256(texto.strip().lower().encode("utf-8")).digest()
+    longitude = -73.0 + 38.0 * int.from_bytes(resumo[:4], "big") / 2 ** 32
+    latitude = -33.0 + 38.0 * int.from_bytes(resumo[4:8], "big") / 2 ** 32
+    return [round(longitude, 6), round(latitude, 6)]
+
+
+def _distancia_m(origem, destino):
+    lon1, lat1, lon2, lat2 = map(math.radians, (*origem, *destino))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371008.8 * math.asin(math.sqrt(a)) * 1.25
+
+
+class ServidorORSFalso:
+    def __init__(self, latencia_ms=50.0, taxa_429=0.0, vertices_rota=2000, porta=0, semente=42):
+        self.latencia_ms = latencia_ms
+        self.taxa_429 = taxa_429
+        self.vertices_rota = vertices_rota
+        self._aleatorio = random.Random(semente)
+        self._lock = threading.Lock()
+        self.contadores = {'geocode': 0, 'directions': 0, 'matrix': 0, '429': 0}
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", porta), self._criar_handler())
+        self._servidor.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._servidor.server_port}"
+
+    def _sortear_429(self):
+        with self._lock:
+            return self._aleatorio.random() < self.taxa_429
+
+    def _contar(self, nome):
+        with self._lock:
+            self.contadores[nome] += 1
+
+    def _criar_handler(self):
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _responder(self, status, corpo):
+                dados = json.dumps(corpo).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(dados)))
+                self.end_headers()
+                self.wfile.write(dados)
+
+            def _antes(self):
+                time.sleep(servidor.latencia_ms / 1000.0)
+                if servidor._sortear_429():
+                    servidor._contar('429')
+                    self._responder(429, {'error': "Rate limit exceeded"})
+                    return False
+                return True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != "/geocode/search":
+                    return self._responder(404, {'error': "not found"})
+                if not self._antes():
+                    return
+                servidor._contar('geocode')
+                texto = parse_qs(url.query).get('text', [""])[0]
+                self._responder(200, {'features': [{'geometry': {'coordinates': _coordenadas_para(texto)}}]})
+
+            def do_POST(self):
+                corpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self._antes():
+                    return
+                if self.path.startswith("/v2/directions/"):
+                    servidor._contar('directions')
+                    origem, destino = corpo['coordinates'][0], corpo['coordinates'][-1]
+                    n = servidor.vertices_rota
+                    geometria = [[origem[0] + (destino[0] - origem[0]) * i / n + 0.01 * math.sin(i / 7),
+                                  origem[1] + (destino[1] - origem[1]) * i / n] for i in range(n + 1)]
+                    return self._responder(200, {'features': [{
+                        'properties': {'segments': [{'distance': _distancia_m(origem, destino)}]},
+                        'geometry': {'coordinates': geometria},
+                    }]})
+                if self.path.startswith("/v2/matrix/"):
+                    servidor._contar('matrix')
+                    locais = corpo['locations']
+                    origens = corpo.get('sources') or list(range(len(locais)))
+                    destinos = corpo.get('destinations') or list(range(len(locais)))
+                    fator = 1000.0 if corpo.get('units') == "km" else 1.0
+                    return self._responder(200, {'distances': [
+                        [_distancia_m(locais[o], locais[d]) / fator for d in destinos] for o in origens
+                    ]})
+                self._responder(404, {'error': "not found"})
+
+        return Handler
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *args):
+        self.parar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor ORS falso para benchmarks.")
+    parser.add_argument("--porta", type=int, default=8089)
+    parser.add_argument("--latencia-ms", type=float, default=50.0)
+    parser.add_argument("--taxa-429", type=float, default=0.0)
+    args = parser.parse_args()
+    servidor = ServidorORSFalso(args.latencia_ms, args.taxa_429, porta=args.porta).iniciar()
+    print(f"Servidor ORS falso em {servidor.url} (Ctrl+C para encerrar)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.parar()
@@ -0,0 +1,170 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+
+# ----- CACHE PERSISTENTE DE GEOCODIFICAÇÃO (SQLite) -----
+# Compartilhado entre sessões do Streamlit e entre processos: cada processo abre
+# o mesmo arquivo SQLite (modo WAL), então uma localidade geocodificada por um
+# usuário fica disponível para todos os demais.
+DIRETORIO_CACHE_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+CAMINHO_CACHE_GEOCODIFICACAO = os.environ.get(
+    "CACHE_GEOCODIFICACAO_PATH", os.path.join(DIRETORIO_CACHE_PADRAO, "geocodificacao.sqlite3")
+)
+TTL_GEOCODIFICACAO_S = float(os.environ.get("CACHE_GEOCODIFICACAO_TTL_S", 30 * 24 * 3600))
+TTL_GEOCODIFICACAO_NEGATIVO_S = float(os.environ.get("CACHE_GEOCODIFICACAO_TTL_NEGATIVO_S", 24 * 3600))
+MAX_ENTRADAS_GEOCODIFICACAO = int(os.environ.get("CACHE_GEOCODIFICACAO_MAX_ENTRADAS", 50000))
+
+
+def normalizar_localidade(nome_lugar):
+    # "São Paulo ,SP,  Brasil" e "sao paulo, sp, brasil" devem cair na mesma chave.
+    texto = unicodedata.normalize("NFKD", nome_lugar or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).casefold()
+    partes = [" ".join(parte.split()) for parte in texto.split(",")]
+    return ", ".join(parte for parte in partes if parte)
+
+
+# Conexão em autocommit, compartilhável entre threads (o acesso é serializado por um lock
+# em cada cache) e em modo WAL para permitir leitores concorrentes de outros processos.
+def abrir_conexao_sqlite(caminho):
+    if caminho != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+    conexao = sqlite3.connect(caminho, timeout=30, check_same_thread=False, isolation_level=None)
+    if caminho != ":memory:":
+        conexao.execute("PRAGMA journal_mode=WAL")
+    conexao.execute("PRAGMA synchronous=NORMAL")
+    return conexao
+
+
+class CacheGeocodificacao:
+    def __init__(self, caminho=CAMINHO_CACHE_GEOCODIFICACAO, ttl_s=TTL_GEOCODIFICACAO_S,
+                 ttl_negativo_s=TTL_GEOCODIFICACAO_NEGATIVO_S, max_entradas=MAX_ENTRADAS_GEOCODIFICACAO):
+        self.caminho = caminho
+        self.ttl_s = ttl_s
+        self.ttl_negativo_s = ttl_negativo_s
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._contadores = {'acertos': 0, 'acertos_negativos': 0, 'falhas': 0, 'gravacoes': 0, 'remocoes': 0}
+
+        self._conexao = abrir_conexao_sqlite(caminho)
+        self._conexao.execute(
+            "CREATE TABLE IF NOT EXISTS geocodificacao ("
+            " chave TEXT PRIMARY KEY,"
+            " longitude REAL,"
+            " latitude REAL,"
+            " expira_em REAL NOT NULL,"
+            " acessado_em REAL NOT NULL)"
+        )
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS idx_geocodificacao_acessado ON geocodificacao (acessado_em)")
+
+    # Retorna (encontrado, coordenadas). Um resultado negativo em cache devolve (True, None).
+    def obter(self, nome_lugar):
+        chave = normalizar_localidade(nome_lugar)
+        agora = time.time()
+        with self._lock:
+            linha = self._conexao.execute(
+                "SELECT longitude, latitude, expira_em FROM geocodificacao WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha is None or linha[2] <= agora:
+                self._contadores['falhas'] += 1
+                return False, None
+            self._conexao.execute("UPDATE geocodificacao SET acessado_em = ? WHERE chave = ?", (agora, chave))
+            if linha[0] is None:
+                self._contadores['acertos_negativos'] += 1
+                return True, None
+            self._contadores['acertos'] += 1
+            return True, [linha[0], linha[1]]
+
+    def gravar(self, nome_lugar, coordenadas):
+        chave = normalizar_localidade(nome_lugar)
+        agora = time.time()
+        if coordenadas:
+            longitude, latitude = float(coordenadas[0]), float(coordenadas[1])
+            expira_em = agora + self.ttl_s
+        else:
+            longitude = latitude = None
+            expira_em = agora + self.ttl_negativo_s
+        with self._lock:
+            self._conexao.execute(
+                "INSERT OR REPLACE INTO geocodificacao (chave, longitude, latitude, expira_em, acessado_em)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (chave, longitude, latitude, expira_em, agora),
+            )
+            self._contadores['gravacoes'] += 1
+            self._aplicar_remocao(agora)
+
+    def _aplicar_remocao(self, agora):
+        removidas = self._conexao.execute("DELETE FROM geocodificacao WHERE expira_em <= ?", (agora,)).rowcount
+        total = self._conexao.execute("SELECT COUNT(*) FROM geocodificacao").fetchone()[0]
+        excesso = total - self.max_entradas
+        if excesso > 0:
+            # Remove as entradas usadas há mais tempo (LRU).
+            removidas += self._conexao.execute(
+                "DELETE FROM geocodificacao WHERE chave IN"
+                " (SELECT chave FROM geocodificacao ORDER BY acessado_em LIMIT ?)",
+                (excesso,),
+            ).rowcount
+        self._contadores['remocoes'] += max(removidas, 0)
+
+    # Geocodifica (via `geocodificador(nome) -> coordenadas | None`) as localidades ainda
+    # não presentes no cache. Exceções do geocodificador não são gravadas como negativas.
+    def pre_aquecer(self, localidades, geocodificador):
+        novas = 0
+        vistas = set()
+        for nome_lugar in localidades:
+            chave = normalizar_localidade(nome_lugar)
+            if not chave or chave in vistas:
+                continue
+            vistas.add(chave)
+            encontrado, _ = self.obter(nome_lugar)
+            if encontrado:
+                continue
+            try:
+                coordenadas = geocodificador(nome_lugar)
+            except Exception:
+                continue
+            self.gravar(nome_lugar, coordenadas)
+            novas += 1
+        return novas
+
+    def estatisticas(self):
+        with self._lock:
+            estatisticas = dict(self._contadores)
+            estatisticas['entradas'] = self._conexao.execute("SELECT COUNT(*) FROM geocodificacao").fetchone()[0]
+        consultas = estatisticas['acertos'] + estatisticas['acertos_negativos'] + estatisticas['falhas']
+        estatisticas['taxa_acerto'] = (
+            (estatisticas['acertos'] + estatisticas['acertos_negativos']) / consultas if consultas else 0.0
+        )
+        return estatisticas
+
+    def limpar(self):
+        with self._lock:
+            self._conexao.execute("DELETE FROM geocodificacao")
+
+
+# Pré-aquecimento pela linha de comando:
+#   ORS_API_KEY=... python cache_geocodificacao.py localidades.txt
+# (uma localidade por linha, ex.: "Fortaleza, CE, Brasil")
+if __name__ == "__main__":
+    import openrouteservice
+
+    if len(sys.argv) != 2:
+        print("Uso: python cache_geocodificacao.py <arquivo_de_localidades>")
+        sys.exit(1)
+
+    client = openrouteservice.Client(key=os.environ["ORS_API_KEY"])
+
+    def _geocodificar(nome_lugar):
+        resultado = client.pelias_search(text=nome_lugar, size=1)
+        if resultado and resultado.get('features'):
+            return resultado['features'][0]['geometry']['coordinates']
+        return None
+
+    with open(sys.argv[1], encoding="utf-8") as arquivo:
+        localidades = [linha.strip() for linha in arquivo if linha.strip()]
+
+    cache = CacheGeocodificacao()
+    novas = cache.pre_aquecer(localidades, _geocodificar)
+    print(f"{novas} localidades geocodificadas e gravadas no cache. Estatísticas: {cache.estatisticas()}")
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+import zlib
+
+from cache_geocodificacao import DIRETORIO_CACHE_PADRAO, abrir_conexao_sqlite
+
+# ----- CACHE PERSISTENTE DE ROTAS (SQLite) -----
+# A chave é (perfil, coordenadas arredondadas de origem e destino). A distância fica
+# numa tabela separada da geometria: quem só precisa dos km (ex.: cotação em lote)
+# nunca lê nem transfere a polilinha.
+CAMINHO_CACHE_ROTAS = os.environ.get("CACHE_ROTAS_PATH", os.path.join(DIRETORIO_CACHE_PADRAO, "rotas.sqlite3"))
+PRECISAO_COORDENADAS_ROTAS = int(os.environ.get("CACHE_ROTAS_PRECISAO", 4))  # 4 casas decimais ~ 11 m
+MAX_ROTAS = int(os.environ.get("CACHE_ROTAS_MAX_ENTRADAS", 20000))
+
+
+class CacheRotas:
+    def __init__(self, caminho=CAMINHO_CACHE_ROTAS, precisao=PRECISAO_COORDENADAS_ROTAS, max_entradas=MAX_ROTAS):
+        self.caminho = caminho
+        self.precisao = precisao
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._contadores = {'acertos': 0, 'falhas': 0, 'acertos_geometria': 0, 'falhas_geometria': 0,
+                            'gravacoes': 0, 'remocoes': 0}
+
+        self._conexao = abrir_conexao_sqlite(caminho)
+        self._conexao.execute(
+            "CREATE TABLE IF NOT EXISTS rotas ("
+            " chave TEXT PRIMARY KEY,"
+            " distancia_km REAL NOT NULL,"
+            " acessado_em REAL NOT NULL)"
+        )
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS idx_rotas_acessado ON rotas (acessado_em)")
+        self._conexao.execute(
+            "CREATE TABLE IF NOT EXISTS geometrias ("
+            " chave TEXT PRIMARY KEY,"
+            " geometria BLOB NOT NULL)"
+        )
+
+    def chave(self, coords_origem, coords_destino, perfil):
+        p = self.precisao
+        return (f"{perfil}:{round(float(coords_origem[0]), p):.{p}f},{round(float(coords_origem[1]), p):.{p}f}"
+                f";{round(float(coords_destino[0]), p):.{p}f},{round(float(coords_destino[1]), p):.{p}f}")
+
+    def obter_distancia(self, coords_origem, coords_destino, perfil):
+        chave = self.chave(coords_origem, coords_destino, perfil)
+        with self._lock:
+            linha = self._conexao.execute("SELECT distancia_km FROM rotas WHERE chave = ?", (chave,)).fetchone()
+            if linha is None:
+                self._contadores['falhas'] += 1
+                return None
+            self._conexao.execute("UPDATE rotas SET acessado_em = ? WHERE chave = ?", (time.time(), chave))
+            self._contadores['acertos'] += 1
+            return linha[0]
+
+    # Consulta em lote: devolve {(coords_origem, coords_destino): distancia_km} apenas para os pares em cache.
+    def obter_distancias(self, pares, perfil):
+        chaves = {self.chave(o, d, perfil): (tuple(o), tuple(d)) for o, d in pares}
+        encontradas = {}
+        lista_chaves = list(chaves)
+        with self._lock:
+            for inicio in range(0, len(lista_chaves), 500):
+                bloco = lista_chaves[inicio:inicio + 500]
+                marcadores = ",".join("?" * len(bloco))
+                for chave, distancia_km in self._conexao.execute(
+                        f"SELECT chave, distancia_km FROM rotas WHERE chave IN ({marcadores})", bloco):
+                    encontradas[chaves[chave]] = distancia_km
+                self._conexao.execute(
+                    f"UPDATE rotas SET acessado_em = ? WHERE chave IN ({marcadores})", [time.time(), *bloco]
+                )
+            self._contadores['acertos'] += len(encontradas)
+            self._contadores['falhas'] += len(chaves) - len(encontradas)
+        return encontradas
+
+    def obter_geometria(self, coords_origem, coords_destino, perfil):
+        chave = self.chave(coords_origem, coords_destino, perfil)
+        with self._lock:
+            linha = self._conexao.execute("SELECT geometria FROM geometrias WHERE chave = ?", (chave,)).fetchone()
+            if linha is None:
+                self._contadores['falhas_geometria'] += 1
+                return None
+            # A geometria sai junto com a rota na remoção LRU: ler a geometria também conta como uso.
+            self._conexao.execute("UPDATE rotas SET acessado_em = ? WHERE chave = ?", (time.time(), chave))
+            self._contadores['acertos_geometria'] += 1
+        return json.loads(zlib.decompress(linha[0]))
+
+    # `geometria=None` grava só a distância e preserva uma geometria já existente.
+    def gravar(self, coords_origem, coords_destino, perfil, distancia_km, geometria=None):
+        self.gravar_varias([(coords_origem, coords_destino, distancia_km, geometria)], perfil)
+
+    def gravar_varias(self, rotas, perfil):
+        agora = time.time()
+        with self._lock:
+            self._conexao.execute("BEGIN")
+            try:
+                for coords_origem, coords_destino, distancia_km, geometria in rotas:
+                    chave = self.chave(coords_origem, coords_destino, perfil)
+                    self._conexao.execute(
+                        "INSERT OR REPLACE INTO rotas (chave, distancia_km, acessado_em) VALUES (?, ?, ?)",
+                        (chave, float(distancia_km), agora),
+                    )
+                    if geometria is not None:
+                        blob = zlib.compress(json.dumps(geometria, separators=(",", ":")).encode("utf-8"))
+                        self._conexao.execute(
+                            "INSERT OR REPLACE INTO geometrias (chave, geometria) VALUES (?, ?)", (chave, blob)
+                        )
+                    self._contadores['gravacoes'] += 1
+                self._aplicar_remocao()
+                self._conexao.execute("COMMIT")
+            except Exception:
+                self._conexao.execute("ROLLBACK")
+                raise
+
+    def _aplicar_remocao(self):
+        total = self._conexao.execute("SELECT COUNT(*) FROM rotas").fetchone()[0]
+        excesso = total - self.max_entradas
+        if excesso <= 0:
+            return
+        # LRU: descarta as rotas acessadas há mais tempo, junto com suas geometrias.
+        chaves = [linha[0] for linha in self._conexao.execute(
+            "SELECT chave FROM rotas ORDER BY acessado_em LIMIT ?", (excesso,))]
+        self._conexao.executemany("DELETE FROM rotas WHERE chave = ?", [(c,) for c in chaves])
+        self._conexao.executemany("DELETE FROM geometrias WHERE chave = ?", [(c,) for c in chaves])
+        self._contadores['remocoes'] += len(chaves)
+
+    def estatisticas(self):
+        with self._lock:
+            estatisticas = dict(self._contadores)
+            estatisticas['entradas'] = self._conexao.execute("SELECT COUNT(*) FROM rotas").fetchone()[0]
+            estatisticas['geometrias'] = self._conexao.execute("SELECT COUNT(*) FROM geometrias").fetchone()[0]
+        consultas = estatisticas['acertos'] + estatisticas['falhas']
+        estatisticas['taxa_acerto'] = estatisticas['acertos'] / consultas if consultas else 0.0
+        return estatisticas
+
+    def limpar(self):
+        with self._lock:
+            self._conexao.execute("DELETE FROM rotas")
+            self._conexao.execute("DELETE FROM geometrias")
@@ -0,0 +1,246 @@
+import io
+import os
+import unicodedata
+
+import numpy as np
+import pandas as pd
+from openrouteservice import exceptions as ors_exceptions
+
+from cache_geocodificacao import normalizar_localidade
+from metricas import METRICAS, cronometrar, logger
+from precificacao import precificar_cotacoes
+from roteamento import ErroRoteamento, ServicoRoteamentoIndisponivel
+
+# ----- COTAÇÃO EM LOTE (CSV/XLSX) -----
+# Cada localidade única é geocodificada uma vez e as distâncias que não estão no cache
+# de rotas saem de poucas chamadas ao endpoint de matriz do ORS, em vez de uma chamada
+# de `directions` por linha.
+COLUNAS_OBRIGATORIAS = ['data', 'origem', 'destino']
+COLUNAS_OPCIONAIS = {'peso_kg': 0.0, 'adicional_km': 0.0, 'dificuldade': 0.0}
+# Limite de elementos (origens x destinos) por requisição de matriz do plano público do ORS.
+MAX_ELEMENTOS_MATRIZ_ORS = int(os.environ.get("ORS_MAX_ELEMENTOS_MATRIZ", 3500))
+
+
+def _normalizar_nome_coluna(nome):
+    texto = unicodedata.normalize("NFKD", str(nome))
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).strip().lower()
+    return "_".join(texto.replace("(", " ").replace(")", " ").replace("/", " ").split())
+
+
+# Um formato por coluna: com vírgula em algum valor, a coluna está no formato brasileiro
+# ("1.234,5": ponto de milhar, vírgula decimal); com algum valor como "1234.5" ou "12.50",
+# ponto decimal. Uma coluna em que os únicos valores com ponto são como "1.234" (1234 ou
+# 1,234?) é recusada (ValueError), assim como uma coluna que mistura os dois formatos ou
+# que tem um valor não numérico. Células em branco ficam NaN.
+_MILHAR_SEM_DECIMAL = r"[-+]?\d{1,3}(?:\.\d{3})+"
+
+
+def _converter_numeros(serie, coluna=""):
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype(float)
+    eh_texto = serie.map(lambda valor: isinstance(valor, str))
+    texto = serie[eh_texto].str.strip()
+    virgula = texto.str.contains(",", regex=False)
+    milhar = ~virgula & texto.str.fullmatch(_MILHAR_SEM_DECIMAL)
+    ponto_decimal = ~virgula & ~milhar & texto.str.contains(".", regex=False)
+    if virgula.any() and ponto_decimal.any():
+        raise ValueError(f"A coluna '{coluna}' mistura vírgula ('{texto[virgula].iloc[0]}') e ponto "
+                         f"('{texto[ponto_decimal].iloc[0]}') como separador decimal.")
+    if virgula.any():
+        texto = texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    elif milhar.any() and not ponto_decimal.any():
+        raise ValueError(f"A coluna '{coluna}' tem valores ambíguos como '{texto[milhar].iloc[0]}'; use vírgula "
+                         f"decimal ('1.234,0') ou números sem separador de milhar ('1234').")
+    valores = serie.astype(object).copy()
+    valores[eh_texto] = texto.mask(texto == "")
+    numeros = pd.to_numeric(valores, errors="coerce")
+    invalidos = numeros.isna() & valores.notna()
+    if invalidos.any():
+        # Linha da planilha: o cabeçalho é a linha 1.
+        indice = invalidos.idxmax()
+        raise ValueError(f"A coluna '{coluna}' tem um valor não numérico na linha {indice + 2}: "
+                         f"'{serie[indice]}'.")
+    return numeros
+
+
+def ler_planilha(arquivo, nome_arquivo):
+    if nome_arquivo.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(arquivo, dtype={'origem': str, 'destino': str})
+    else:
+        # Tudo como texto: o formato dos números é decidido por coluna em _converter_numeros.
+        df = pd.read_csv(arquivo, sep=None, engine="python", encoding="utf-8-sig", dtype=str)
+    df.columns = [_normalizar_nome_coluna(c) for c in df.columns]
+
+    faltando = [c for c in COLUNAS_OBRIGATORIAS if c not in df.columns]
+    if faltando:
+        raise ValueError(f"Colunas obrigatórias ausentes na planilha: {', '.join(faltando)}.")
+    for coluna, padrao in COLUNAS_OPCIONAIS.items():
+        if coluna not in df.columns:
+            df[coluna] = padrao
+        df[coluna] = _converter_numeros(df[coluna], coluna).fillna(padrao)
+    # tipo_carga/eixos, se presentes, escolhem a tabela ANTT da linha (em branco: tabela genérica).
+    if 'tipo_carga' in df.columns:
+        df['tipo_carga'] = df['tipo_carga'].fillna("").astype(str)
+    if 'eixos' in df.columns:
+        df['eixos'] = _converter_numeros(df['eixos'], 'eixos')
+    df['origem'] = df['origem'].fillna("").astype(str)
+    df['destino'] = df['destino'].fillna("").astype(str)
+    return df
+
+
+# Cada nome normalizado é consultado uma única vez: primeiro no gazetteer de municípios,
+# depois no cache; o que sobra é geocodificado em paralelo, dentro do limite de
+# concorrência do `backend`. Localidades cuja consulta falhou ficam sem coordenadas e, se
+# `erros` for um dicionário, com a mensagem em `erros[chave]`.
+def geocodificar_localidades(nomes, backend, cache_geocodificacao, indice_municipios=None, erros=None):
+    coordenadas = {}
+    faltando = {}
+    for nome_lugar in nomes:
+        chave = normalizar_localidade(nome_lugar)
+        if not chave or chave in coordenadas or chave in faltando:
+            continue
+        if indice_municipios is not None:
+            coords = indice_municipios.geocodificar(nome_lugar)
+            if coords:
+                METRICAS.incrementar("geocodificacao_total", fonte="municipio")
+                coordenadas[chave] = coords
+                continue
+        encontrado, coords = cache_geocodificacao.obter(nome_lugar)
+        if encontrado:
+            METRICAS.incrementar("geocodificacao_total", fonte="cache")
+            coordenadas[chave] = coords
+        else:
+            faltando[chave] = nome_lugar
+    if faltando:
+        METRICAS.incrementar("geocodificacao_total", len(faltando), fonte="backend")
+
+    futuros = backend.executar_em_paralelo(backend.geocodificar, faltando.values())
+    for (chave, nome_lugar), futuro in zip(faltando.items(), futuros):
+        try:
+            coords = futuro.result()
+        except ServicoRoteamentoIndisponivel:
+            raise
+        except Exception as e:
+            # Erro desta localidade (resposta de erro da API, HTTP, corpo inválido): fica sem
+            # coordenadas, mas não é gravada como negativa. Indisponibilidade do serviço propaga.
+            logger.warning(f"geocodificação de '{nome_lugar}' falhou: {type(e).__name__}: {e}")
+            coordenadas[chave] = None
+            if erros is not None:
+                erros[chave] = _mensagem_erro(e)
+            continue
+        cache_geocodificacao.gravar(nome_lugar, coords)
+        coordenadas[chave] = coords
+    return coordenadas
+
+
+def _mensagem_erro(erro):
+    if isinstance(erro, (ors_exceptions.ApiError, ErroRoteamento)):
+        return str(erro)
+    return f"{type(erro).__name__}: {erro}"
+
+
+def _blocos(itens, tamanho):
+    for inicio in range(0, len(itens), tamanho):
+        yield itens[inicio:inicio + tamanho]
+
+
+# Devolve {(coords_origem, coords_destino): distancia_km} para os pares pedidos. Pares sem
+# cache são agrupados em matrizes origens x destinos respeitando MAX_ELEMENTOS_MATRIZ_ORS,
+# e as matrizes são pedidas em paralelo. Uma matriz que falha deixa só os pares dela sem
+# distância (com a mensagem em `erros[par]`, se informado); as demais seguem.
+def calcular_distancias(pares, backend, cache_rotas, perfil, max_elementos=MAX_ELEMENTOS_MATRIZ_ORS, erros=None):
+    pares = {(tuple(o), tuple(d)) for o, d in pares}
+    distancias = cache_rotas.obter_distancias(pares, perfil)
+    faltando = {par for par in pares if par not in distancias}
+    if not faltando:
+        return distancias
+
+    origens = sorted({o for o, _ in faltando})
+    destinos = sorted({d for _, d in faltando})
+    tamanho_bloco_destinos = min(len(destinos), max_elementos)
+    blocos = []
+    for bloco_destinos in _blocos(destinos, tamanho_bloco_destinos):
+        tamanho_bloco_origens = max(1, max_elementos // len(bloco_destinos))
+        for bloco_origens in _blocos(origens, tamanho_bloco_origens):
+            # Só pede a matriz se algum par do bloco realmente estiver faltando.
+            if any((o, d) in faltando for o in bloco_origens for d in bloco_destinos):
+                blocos.append((bloco_origens, bloco_destinos))
+
+    futuros = backend.executar_em_paralelo(
+        lambda bloco: backend.matriz_distancias(bloco[0], bloco[1], perfil), blocos
+    )
+    novas = []
+    for (bloco_origens, bloco_destinos), futuro in zip(blocos, futuros):
+        try:
+            matriz = futuro.result()
+            linhas = [[matriz[i][j] for j in range(len(bloco_destinos))] for i in range(len(bloco_origens))]
+        except ServicoRoteamentoIndisponivel:
+            raise
+        except Exception as e:
+            logger.warning(f"matriz de distâncias {len(bloco_origens)}x{len(bloco_destinos)} falhou: "
+                           f"{type(e).__name__}: {e}")
+            if erros is not None:
+                mensagem = _mensagem_erro(e)
+                erros.update({(o, d): mensagem for o in bloco_origens for d in bloco_destinos
+                              if (o, d) in faltando})
+            continue
+        for i, o in enumerate(bloco_origens):
+            for j, d in enumerate(bloco_destinos):
+                distancia_km = linhas[i][j]
+                if distancia_km is None:
+                    continue
+                distancias[(o, d)] = distancia_km
+                novas.append((o, d, distancia_km, None))
+    if novas:
+        cache_rotas.gravar_varias(novas, perfil)
+    return distancias
+
+
+def cotar_lote(df, backend, cache_geocodificacao, cache_rotas, perfil, indice_municipios=None):
+    erros_geocodificacao, erros_distancia = {}, {}
+    with cronometrar("lote_geocodificacao", linhas=len(df)):
+        coordenadas = geocodificar_localidades(
+            pd.unique(pd.concat([df['origem'], df['destino']], ignore_index=True)), backend, cache_geocodificacao,
+            indice_municipios, erros_geocodificacao,
+        )
+    chaves_origem = df['origem'].map(normalizar_localidade)
+    chaves_destino = df['destino'].map(normalizar_localidade)
+    coords_origem = chaves_origem.map(lambda c: coordenadas.get(c))
+    coords_destino = chaves_destino.map(lambda c: coordenadas.get(c))
+
+    pares = {(tuple(o), tuple(d)) for o, d in zip(coords_origem, coords_destino) if o and d}
+    with cronometrar("lote_distancias", pares=len(pares)):
+        distancias = calcular_distancias(pares, backend, cache_rotas, perfil, erros=erros_distancia) if pares else {}
+
+    resultado = df.copy()
+    resultado['longitude_origem'] = coords_origem.map(lambda c: c[0] if c else np.nan)
+    resultado['latitude_origem'] = coords_origem.map(lambda c: c[1] if c else np.nan)
+    resultado['longitude_destino'] = coords_destino.map(lambda c: c[0] if c else np.nan)
+    resultado['latitude_destino'] = coords_destino.map(lambda c: c[1] if c else np.nan)
+    resultado['distancia_km'] = [
+        distancias.get((tuple(o), tuple(d)), np.nan) if o and d else np.nan
+        for o, d in zip(coords_origem, coords_destino)
+    ]
+    with cronometrar("lote_precificacao", linhas=len(resultado)):
+        resultado = precificar_cotacoes(resultado)
+    sem_coordenadas = coords_origem.isna().to_numpy() | coords_destino.isna().to_numpy()
+    resultado.loc[sem_coordenadas & (resultado['status'] == "distância não calculada"), 'status'] = \
+        "localidade não geocodificada"
+    # Falhas de consulta (e não "não encontrado") aparecem com a mensagem na própria linha.
+    erro_linha = pd.Series([
+        erros_geocodificacao.get(o) or erros_geocodificacao.get(d)
+        or (erros_distancia.get((tuple(co), tuple(cd))) if co and cd else None)
+        for o, d, co, cd in zip(chaves_origem, chaves_destino, coords_origem, coords_destino)
+    ], index=resultado.index, dtype=object)
+    com_erro = erro_linha.notna() & resultado['status'].isin(["localidade não geocodificada", "distância não calculada"])
+    resultado.loc[com_erro, 'status'] = "erro na consulta: " + erro_linha[com_erro]
+    return resultado
+
+
+def gerar_arquivo_resultado(df, formato):
+    buffer = io.BytesIO()
+    if formato == "xlsx":
+        df.to_excel(buffer, index=False)
+    else:
+        buffer.write(df.to_csv(index=False, sep=";", decimal=",").encode("utf-8-sig"))
+    return buffer.getvalue()
@@ -0,0 +1,413 @@
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+import pandas as pd
+from openrouteservice import exceptions as ors_exceptions
+
+from cache_geocodificacao import DIRETORIO_CACHE_PADRAO
+from cotacao_lote import cotar_lote, gerar_arquivo_resultado
+from metricas import METRICAS, cronometrar, logger
+from roteamento import ErroRoteamento, ServicoRoteamentoIndisponivel, prioridade_lote
+
+# ----- FILA DE LOTES EM SEGUNDO PLANO -----
+# Cada lote enviado vira um job com id próprio, processado por um pool de threads fora da
+# sessão do Streamlit, em blocos de LOTE_TAMANHO_BLOCO linhas. Cada bloco pronto é gravado
+# em disco antes de passar ao próximo: a sessão pode fechar, e um reinício do processo
+# retoma os jobs inacabados do primeiro bloco que falta. As chamadas ao ORS passam pelo
+# executor de lote e pelo agendador do backend com prioridade de lote: a concorrência e o
+# limite por minuto configurados valem para todos os jobs juntos, qualquer que seja
+# LOTE_TRABALHADORES, e cotações interativas não esperam atrás deles.
+# O diretório é compartilhado entre processos (como os caches): cada job é de quem detém a
+# trava (flock) do arquivo `trava` no diretório dele, do envio ou da retomada até encerrar.
+# O sistema libera a trava quando o processo dono morre; os outros processos só acompanham
+# o job pelo estado.json e o assumem quando a trava fica livre com o job inacabado.
+DIRETORIO_LOTES = os.environ.get("LOTES_PATH", os.path.join(DIRETORIO_CACHE_PADRAO, "lotes"))
+TAMANHO_BLOCO_LOTE = int(os.environ.get("LOTE_TAMANHO_BLOCO", 200))
+TRABALHADORES_LOTE = int(os.environ.get("LOTE_TRABALHADORES", 2))
+MAX_TENTATIVAS_BLOCO = int(os.environ.get("LOTE_MAX_TENTATIVAS", 3))
+# Jobs encerrados há mais que isso são apagados do disco na criação da fila.
+RETENCAO_LOTES_H = float(os.environ.get("LOTE_RETENCAO_H", 24))
+
+SITUACAO_NA_FILA = "na_fila"
+SITUACAO_PROCESSANDO = "processando"
+SITUACAO_CONCLUIDO = "concluido"
+SITUACAO_ERRO = "erro"
+SITUACAO_CANCELADO = "cancelado"
+SITUACOES_ENCERRADAS = (SITUACAO_CONCLUIDO, SITUACAO_ERRO, SITUACAO_CANCELADO)
+# Campos sem os quais um estado.json (gravado por uma versão antiga ou corrompido) é ignorado.
+CAMPOS_ESTADO = ('id', 'situacao', 'linhas', 'tamanho_bloco', 'blocos', 'blocos_concluidos',
+                 'linhas_concluidas', 'linhas_ok', 'formato_saida', 'criado_em')
+
+
+def _gravar_atomico(caminho, gravar):
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    gravar(temporario)
+    os.replace(temporario, caminho)
+
+
+class FilaLotes:
+    def __init__(self, backend, cache_geocodificacao, cache_rotas, perfil, indice_municipios=None,
+                 diretorio=DIRETORIO_LOTES, trabalhadores=TRABALHADORES_LOTE, tamanho_bloco=TAMANHO_BLOCO_LOTE):
+        self.backend = backend
+        self.cache_geocodificacao = cache_geocodificacao
+        self.cache_rotas = cache_rotas
+        self.perfil = perfil
+        self.indice_municipios = indice_municipios
+        self.diretorio = diretorio
+        self.tamanho_bloco = tamanho_bloco
+        self._lock = threading.Lock()
+        # id -> estado do job (o mesmo dicionário gravado em estado.json)
+        self._jobs = {}
+        # id -> arquivo de trava aberto, dos jobs deste processo
+        self._travas = {}
+        # ids de jobs inacabados que outro processo detém: o estado vem do disco
+        self._alheios = set()
+        # Threads daemon: ao encerrar o processo, o job em andamento fica como "processando"
+        # no disco, com os blocos já gravados, e é retomado pelo próximo processo.
+        self._pendentes = queue.Queue()
+        self._trabalhadores = [threading.Thread(target=self._trabalhar, name=f"lote-{i}", daemon=True)
+                               for i in range(trabalhadores)]
+        for trabalhador in self._trabalhadores:
+            trabalhador.start()
+        os.makedirs(diretorio, exist_ok=True)
+        METRICAS.registrar_coletor("fila_lotes", self._metricas)
+        self._retomar()
+
+    def _caminho(self, id_job, nome=""):
+        return os.path.join(self.diretorio, id_job, nome)
+
+    # Trava do job para este processo (True se já era dele). Sem bloquear: outro dono, False.
+    def _travar(self, id_job):
+        with self._lock:
+            if id_job in self._travas:
+                return True
+        if fcntl is None:
+            with self._lock:
+                self._travas[id_job] = None
+            return True
+        arquivo = open(self._caminho(id_job, "trava"), "a+")
+        try:
+            fcntl.flock(arquivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            arquivo.close()
+            return False
+        arquivo.truncate(0)
+        arquivo.write(str(os.getpid()))
+        arquivo.flush()
+        with self._lock:
+            self._travas[id_job] = arquivo
+        return True
+
+    def _destravar(self, id_job):
+        with self._lock:
+            arquivo = self._travas.pop(id_job, None)
+        if arquivo is not None:
+            arquivo.close()
+
+    def _caminho_bloco(self, id_job, numero):
+        return self._caminho(id_job, f"bloco_{numero:05d}.pkl")
+
+    def _gravar_estado(self, estado):
+        with self._lock:
+            dados = json.dumps(estado, ensure_ascii=False)
+        def gravar(temporario):
+            with open(temporario, "w", encoding="utf-8") as arquivo:
+                arquivo.write(dados)
+        _gravar_atomico(self._caminho(estado['id'], "estado.json"), gravar)
+
+    def _atualizar(self, id_job, **campos):
+        self._atualizar_se(id_job, lambda estado: True, **campos)
+
+    # Verifica `condicao(estado)` e atualiza no mesmo bloco do lock: de duas sessões que
+    # tentam a mesma mudança (ex.: dois cliques em "Retomar"), só uma consegue.
+    def _atualizar_se(self, id_job, condicao, **campos):
+        with self._lock:
+            estado = self._jobs.get(id_job)
+            if estado is None or not condicao(estado):
+                return False
+            estado.update(campos, atualizado_em=datetime.now().isoformat(timespec="seconds"))
+        self._gravar_estado(estado)
+        return True
+
+    def _metricas(self):
+        with self._lock:
+            estados = [estado['situacao'] for estado in self._jobs.values()]
+        return [("lotes", "gauge", {'situacao': situacao}, estados.count(situacao))
+                for situacao in (SITUACAO_NA_FILA, SITUACAO_PROCESSANDO)]
+
+    # Recoloca na fila os jobs que o processo anterior não terminou e apaga os antigos. Um
+    # diretório com estado ilegível é ignorado (e fica no disco para inspeção): não pode
+    # impedir a criação da fila nem a retomada dos outros jobs.
+    def _retomar(self):
+        limite_retencao = time.time() - RETENCAO_LOTES_H * 3600
+        for id_job in sorted(os.listdir(self.diretorio)):
+            caminho_estado = self._caminho(id_job, "estado.json")
+            try:
+                with open(caminho_estado, encoding="utf-8") as arquivo:
+                    estado = json.load(arquivo)
+            except (OSError, ValueError) as e:
+                if os.path.isdir(self._caminho(id_job)):
+                    logger.warning(f"lote {id_job} ignorado: estado ilegível ({e})")
+                continue
+            if not isinstance(estado, dict) or any(campo not in estado for campo in CAMPOS_ESTADO):
+                logger.warning(f"lote {id_job} ignorado: estado.json incompleto")
+                continue
+            if estado['situacao'] in SITUACOES_ENCERRADAS:
+                if os.path.getmtime(caminho_estado) < limite_retencao:
+                    shutil.rmtree(self._caminho(id_job), ignore_errors=True)
+                    continue
+                with self._lock:
+                    self._jobs[id_job] = estado
+                continue
+            with self._lock:
+                self._jobs[id_job] = estado
+            self._assumir(id_job)
+
+    # Assume um job inacabado se a trava estiver livre; senão, só o acompanha pelo disco.
+    def _assumir(self, id_job):
+        if not self._travar(id_job):
+            with self._lock:
+                novo = id_job not in self._alheios
+                self._alheios.add(id_job)
+            if novo:
+                logger.info(f"lote {id_job} em andamento em outro processo")
+            return False
+        with self._lock:
+            self._alheios.discard(id_job)
+            estado = self._jobs[id_job]
+        # O progresso vem dos blocos em disco: o processo pode ter parado entre gravar um
+        # bloco e atualizar o estado.
+        blocos = [self._ler_bloco(id_job, numero) for numero in range(estado['blocos'])]
+        prontos = [bloco for bloco in blocos if bloco is not None]
+        logger.info("lote retomado", extra={'campos': {
+            'lote_id': id_job, 'blocos_concluidos': len(prontos), 'blocos': estado['blocos']}})
+        self._atualizar(id_job, situacao=SITUACAO_NA_FILA, blocos_concluidos=len(prontos),
+                        linhas_concluidas=sum(len(bloco) for bloco in prontos),
+                        linhas_ok=sum(int((bloco['status'] == "ok").sum()) for bloco in prontos))
+        self._pendentes.put(id_job)
+        return True
+
+    # Job de outro processo: relê o estado.json e, se o dono morreu antes de terminar, assume.
+    def _acompanhar_alheio(self, id_job):
+        try:
+            with open(self._caminho(id_job, "estado.json"), encoding="utf-8") as arquivo:
+                estado = json.load(arquivo)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self._jobs[id_job] = estado
+            if estado['situacao'] in SITUACOES_ENCERRADAS:
+                self._alheios.discard(id_job)
+                return
+        self._assumir(id_job)
+
+    # Bloco gravado de um job em retomada; um arquivo ilegível (ex.: disco cheio na gravação)
+    # é apagado e o bloco volta a ser cotado.
+    def _ler_bloco(self, id_job, numero):
+        caminho = self._caminho_bloco(id_job, numero)
+        if not os.path.exists(caminho):
+            return None
+        try:
+            return pd.read_pickle(caminho)
+        except Exception as e:
+            logger.warning(f"lote {id_job}: bloco {numero} ilegível ({type(e).__name__}); será cotado de novo")
+            os.remove(caminho)
+            return None
+
+    # Grava a planilha já validada (ler_planilha) e devolve o id do job.
+    def enviar(self, df, nome_arquivo="", formato_saida="csv"):
+        id_job = uuid.uuid4().hex[:12]
+        os.makedirs(self._caminho(id_job))
+        self._travar(id_job)
+        _gravar_atomico(self._caminho(id_job, "entrada.pkl"), df.to_pickle)
+        agora = datetime.now().isoformat(timespec="seconds")
+        estado = {
+            'id': id_job, 'nome_arquivo': nome_arquivo, 'formato_saida': formato_saida,
+            'situacao': SITUACAO_NA_FILA, 'linhas': len(df), 'tamanho_bloco': self.tamanho_bloco,
+            'blocos': max(1, -(-len(df) // self.tamanho_bloco)), 'blocos_concluidos': 0,
+            'linhas_concluidas': 0, 'linhas_ok': 0, 'erro': None, 'criado_em': agora, 'atualizado_em': agora,
+        }
+        with self._lock:
+            self._jobs[id_job] = estado
+        self._gravar_estado(estado)
+        METRICAS.incrementar("lotes_total", situacao="enviado")
+        self._pendentes.put(id_job)
+        return id_job
+
+    def _trabalhar(self):
+        while True:
+            id_job = self._pendentes.get()
+            if id_job is None:
+                return
+            try:
+                self._processar(id_job)
+            except Exception:
+                logger.exception(f"falha ao processar o lote {id_job}")
+            finally:
+                with self._lock:
+                    encerrado = self._jobs[id_job]['situacao'] in SITUACOES_ENCERRADAS
+                if encerrado:
+                    self._destravar(id_job)
+
+    def _processar(self, id_job):
+        with self._lock:
+            estado = dict(self._jobs[id_job])
+        if estado['situacao'] in SITUACOES_ENCERRADAS:
+            return
+        self._atualizar(id_job, situacao=SITUACAO_PROCESSANDO)
+        df = pd.read_pickle(self._caminho(id_job, "entrada.pkl"))
+        tamanho_bloco = estado['tamanho_bloco']
+        for numero in range(estado['blocos']):
+            with self._lock:
+                if self._jobs[id_job]['situacao'] == SITUACAO_CANCELADO:
+                    return
+            if os.path.exists(self._caminho_bloco(id_job, numero)):
+                continue
+            bloco = df.iloc[numero * tamanho_bloco:(numero + 1) * tamanho_bloco]
+            try:
+                resultado = self._cotar_bloco(id_job, numero, bloco)
+            except (ServicoRoteamentoIndisponivel, ors_exceptions.ApiError, ErroRoteamento) as e:
+                logger.error(f"lote {id_job} interrompido no bloco {numero}: {e}")
+                METRICAS.incrementar("lotes_total", situacao=SITUACAO_ERRO)
+                self._atualizar(id_job, situacao=SITUACAO_ERRO, erro=f"Serviço de roteamento: {e}")
+                return
+            except Exception as e:
+                # Processo encerrando (o executor do backend já não aceita tarefas): o job fica
+                # como está para ser retomado.
+                if not threading.main_thread().is_alive():
+                    return
+                logger.exception(f"lote {id_job} interrompido no bloco {numero}")
+                METRICAS.incrementar("lotes_total", situacao=SITUACAO_ERRO)
+                self._atualizar(id_job, situacao=SITUACAO_ERRO, erro=f"{type(e).__name__}: {e}")
+                return
+            _gravar_atomico(self._caminho_bloco(id_job, numero), resultado.to_pickle)
+            linhas_ok = int((resultado['status'] == "ok").sum())
+            METRICAS.incrementar("cotacoes_lote_linhas_total", linhas_ok, status="ok")
+            METRICAS.incrementar("cotacoes_lote_linhas_total", len(resultado) - linhas_ok, status="erro")
+            with self._lock:
+                atual = self._jobs[id_job]
+                progresso = {'blocos_concluidos': atual['blocos_concluidos'] + 1,
+                             'linhas_concluidas': atual['linhas_concluidas'] + len(resultado),
+                             'linhas_ok': atual['linhas_ok'] + linhas_ok}
+            self._atualizar(id_job, **progresso)
+        with self._lock:
+            if self._jobs[id_job]['situacao'] == SITUACAO_CANCELADO:
+                return
+        try:
+            self._gravar_arquivo_resultado(id_job, estado['formato_saida'])
+        except Exception as e:
+            logger.exception(f"lote {id_job}: falha ao gerar a planilha de resultado")
+            METRICAS.incrementar("lotes_total", situacao=SITUACAO_ERRO)
+            self._atualizar(id_job, situacao=SITUACAO_ERRO, erro=f"Planilha de resultado: {type(e).__name__}: {e}")
+            return
+        METRICAS.incrementar("lotes_total", situacao=SITUACAO_CONCLUIDO)
+        self._atualizar(id_job, situacao=SITUACAO_CONCLUIDO)
+        logger.info("lote concluído", extra={'campos': {'lote_id': id_job, 'linhas': estado['linhas']}})
+
+    # Serviço indisponível (429 persistente, disjuntor aberto) não derruba o job de imediato:
+    # espera o backend se recuperar e tenta o mesmo bloco de novo, até MAX_TENTATIVAS_BLOCO vezes.
+    def _cotar_bloco(self, id_job, numero, bloco):
+        for tentativa in range(1, MAX_TENTATIVAS_BLOCO + 1):
+            try:
+                with cronometrar("lote_bloco", lote_id=id_job, bloco=numero, linhas=len(bloco)), prioridade_lote():
+                    return cotar_lote(bloco, self.backend, self.cache_geocodificacao, self.cache_rotas,
+                                      self.perfil, self.indice_municipios)
+            except ServicoRoteamentoIndisponivel as e:
+                if tentativa == MAX_TENTATIVAS_BLOCO:
+                    raise
+                espera_s = max(self.backend.segundos_para_recuperacao(), 5.0)
+                logger.warning(f"lote {id_job}, bloco {numero}: {e}; nova tentativa em {espera_s:.0f}s")
+                time.sleep(espera_s)
+
+    # Job que parou por erro volta para a fila, a partir do primeiro bloco sem checkpoint.
+    def reenviar(self, id_job):
+        em_erro = lambda estado: estado['situacao'] == SITUACAO_ERRO
+        with self._lock:
+            estado = self._jobs.get(id_job)
+            if estado is None or not em_erro(estado):
+                return False
+        if not self._travar(id_job) or not self._atualizar_se(id_job, em_erro, situacao=SITUACAO_NA_FILA, erro=None):
+            return False
+        self._pendentes.put(id_job)
+        return True
+
+    def cancelar(self, id_job):
+        # Job de outro processo só pode ser cancelado pelo dono.
+        if not self._atualizar_se(id_job, lambda estado: estado['situacao'] not in SITUACOES_ENCERRADAS
+                                  and id_job not in self._alheios, situacao=SITUACAO_CANCELADO):
+            return False
+        METRICAS.incrementar("lotes_total", situacao=SITUACAO_CANCELADO)
+        return True
+
+    # Cópia do estado do job (None se o id não existe).
+    def estado(self, id_job):
+        with self._lock:
+            alheio = id_job in self._alheios
+        if alheio:
+            self._acompanhar_alheio(id_job)
+        with self._lock:
+            estado = self._jobs.get(id_job)
+            return dict(estado) if estado else None
+
+    def listar(self):
+        with self._lock:
+            return sorted((dict(estado) for estado in self._jobs.values()),
+                          key=lambda estado: estado['criado_em'], reverse=True)
+
+    # Linhas já cotadas, na ordem da planilha; enquanto o job roda, só os blocos prontos.
+    def resultado(self, id_job):
+        estado = self.estado(id_job)
+        if estado is None:
+            return None
+        blocos = [pd.read_pickle(self._caminho_bloco(id_job, numero)) for numero in range(estado['blocos'])
+                  if os.path.exists(self._caminho_bloco(id_job, numero))]
+        return pd.concat(blocos) if blocos else pd.DataFrame()
+
+    # Último bloco gravado (None se ainda não há nenhum): o que a página mostra enquanto o job
+    # roda, sem reler os blocos anteriores a cada atualização.
+    def ultimo_bloco(self, id_job):
+        estado = self.estado(id_job)
+        if estado is None:
+            return None
+        for numero in reversed(range(estado['blocos'])):
+            if os.path.exists(self._caminho_bloco(id_job, numero)):
+                return pd.read_pickle(self._caminho_bloco(id_job, numero))
+        return None
+
+    def _caminho_arquivo_resultado(self, id_job, formato):
+        return self._caminho(id_job, f"resultado.{formato}")
+
+    # A planilha de resultado é gerada uma vez, ao concluir o job, ao lado do estado.json.
+    def _gravar_arquivo_resultado(self, id_job, formato):
+        dados = gerar_arquivo_resultado(self.resultado(id_job), formato)
+        def gravar(temporario):
+            with open(temporario, "wb") as arquivo:
+                arquivo.write(dados)
+        _gravar_atomico(self._caminho_arquivo_resultado(id_job, formato), gravar)
+
+    # Conteúdo da planilha de resultado de um job concluído (None nos demais). Jobs concluídos
+    # antes de o arquivo existir o geram na primeira leitura.
+    def arquivo_resultado(self, id_job):
+        estado = self.estado(id_job)
+        if estado is None or estado['situacao'] != SITUACAO_CONCLUIDO:
+            return None
+        caminho = self._caminho_arquivo_resultado(id_job, estado['formato_saida'])
+        if not os.path.exists(caminho):
+            self._gravar_arquivo_resultado(id_job, estado['formato_saida'])
+        with open(caminho, "rb") as arquivo:
+            return arquivo.read()
+
+    def encerrar(self):
+        for _ in self._trabalhadores:
+            self._pendentes.put(None)
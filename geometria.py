@@ -0,0 +1,101 @@
+import math
+
+import numpy as np
+
+# ----- SIMPLIFICAÇÃO E CODIFICAÇÃO DA GEOMETRIA DA ROTA -----
+# A rota completa do ORS tem milhares de vértices; para o mapa basta a versão simplificada
+# (Douglas-Peucker) com tolerância de ~1 pixel no zoom em que ela será exibida, guardada
+# como polilinha codificada (formato do Google) na sessão. A geometria completa continua
+# só no cache de rotas em disco.
+PIXELS_TOLERANCIA = 1.0
+# Margem de níveis de zoom para o usuário poder aproximar o mapa sem ver a rota "quebrada".
+MARGEM_ZOOM = 2
+PRECISAO_POLILINHA = 5
+
+
+# Mesma regra usada pelo mapa para escolher o zoom inicial.
+def zoom_inicial_mapa(quantidade_pontos, distancia_km):
+    if quantidade_pontos == 2 and distancia_km and distancia_km > 500:
+        return 3
+    return 10 if quantidade_pontos == 1 else 5
+
+
+# Tolerância em graus equivalente a `pixels` no zoom informado (tiles de 256 px).
+def tolerancia_para_zoom(zoom, pixels=PIXELS_TOLERANCIA):
+    return pixels * 360.0 / (256.0 * 2 ** zoom)
+
+
+def simplificar_douglas_peucker(coordenadas, tolerancia):
+    pontos = np.asarray(coordenadas, dtype=float)
+    if len(pontos) < 3:
+        return pontos.tolist()
+    # Longitude escalada por cos(latitude média) para que a distância seja aproximadamente isotrópica.
+    escala = math.cos(math.radians(float(pontos[:, 1].mean())))
+    xy = pontos * np.array([escala, 1.0])
+
+    manter = np.zeros(len(pontos), dtype=bool)
+    manter[0] = manter[-1] = True
+    pilha = [(0, len(pontos) - 1)]
+    while pilha:
+        inicio, fim = pilha.pop()
+        if fim - inicio < 2:
+            continue
+        a, b = xy[inicio], xy[fim]
+        intermediarios = xy[inicio + 1:fim]
+        segmento = b - a
+        comprimento = math.hypot(segmento[0], segmento[1])
+        if comprimento == 0:
+            distancias = np.hypot(*(intermediarios - a).T)
+        else:
+            distancias = np.abs(segmento[0] * (intermediarios[:, 1] - a[1])
+                                - segmento[1] * (intermediarios[:, 0] - a[0])) / comprimento
+        indice_max = int(np.argmax(distancias))
+        if distancias[indice_max] > tolerancia:
+            meio = inicio + 1 + indice_max
+            manter[meio] = True
+            pilha.append((inicio, meio))
+            pilha.append((meio, fim))
+    return pontos[manter].tolist()
+
+
+def simplificar_para_zoom(coordenadas, zoom):
+    return simplificar_douglas_peucker(coordenadas, tolerancia_para_zoom(zoom + MARGEM_ZOOM))
+
+
+# Polilinha codificada (algoritmo do Google) a partir de [[lon, lat], ...].
+def codificar_polilinha(coordenadas, precisao=PRECISAO_POLILINHA):
+    fator = 10 ** precisao
+    partes = []
+    lat_anterior = lon_anterior = 0
+    for longitude, latitude in coordenadas:
+        lat, lon = round(latitude * fator), round(longitude * fator)
+        for delta in (lat - lat_anterior, lon - lon_anterior):
+            valor = ~(delta << 1) if delta < 0 else delta << 1
+            while valor >= 0x20:
+                partes.append(chr((0x20 | (valor & 0x1f)) + 63))
+                valor >>= 5
+            partes.append(chr(valor + 63))
+        lat_anterior, lon_anterior = lat, lon
+    return "".join(partes)
+
+
+def decodificar_polilinha(polilinha, precisao=PRECISAO_POLILINHA):
+    fator = 10 ** precisao
+    coordenadas = []
+    indice = lat = lon = 0
+    while indice < len(polilinha):
+        deltas = []
+        for _ in range(2):
+            resultado = deslocamento = 0
+            while True:
+                byte = ord(polilinha[indice]) - 63
+                indice += 1
+                resultado |= (byte & 0x1f) << deslocamento
+                deslocamento += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(resultado >> 1) if resultado & 1 else resultado >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coordenadas.append([lon / fator, lat / fator])
+    return coordenadas
@@ -0,0 +1,199 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from openrouteservice import exceptions as ors_exceptions
+
+from roteamento import ServicoRoteamentoIndisponivel, em_lote
+
+# ----- LIMITE DE TAXA, RETENTATIVAS E DISJUNTOR PARA O ORS -----
+# Um único agendador por processo (dentro do AcessoORS em cache): todas as sessões
+# disputam o mesmo balde de tokens, dimensionado para o plano contratado no ORS.
+ORS_REQUISICOES_POR_MINUTO = float(os.environ.get("ORS_REQUISICOES_POR_MINUTO", 40))
+ORS_RAJADA_MAXIMA = int(os.environ.get("ORS_RAJADA_MAXIMA", 5))
+ORS_ESPERA_MAXIMA_FILA_S = float(os.environ.get("ORS_ESPERA_MAXIMA_FILA_S", 30))
+ORS_MAX_TENTATIVAS = int(os.environ.get("ORS_MAX_TENTATIVAS", 4))
+ORS_BACKOFF_BASE_S = float(os.environ.get("ORS_BACKOFF_BASE_S", 1.0))
+ORS_BACKOFF_MAXIMO_S = float(os.environ.get("ORS_BACKOFF_MAXIMO_S", 30.0))
+ORS_DISJUNTOR_FALHAS = int(os.environ.get("ORS_DISJUNTOR_FALHAS", 5))
+ORS_DISJUNTOR_RECUPERACAO_S = float(os.environ.get("ORS_DISJUNTOR_RECUPERACAO_S", 60))
+# Tokens do balde que chamadas de lote (roteamento.prioridade_lote) deixam para as interativas.
+ORS_RESERVA_INTERATIVA = int(os.environ.get("ORS_RESERVA_INTERATIVA", 1))
+
+
+# Levantada quando o ORS não pôde ser usado: disjuntor aberto, fila do limitador esgotada
+# ou erros transitórios (429/5xx/timeout) em todas as tentativas.
+class ServicoORSIndisponivel(ServicoRoteamentoIndisponivel):
+    pass
+
+
+def erro_transitorio(erro):
+    if isinstance(erro, ors_exceptions.ApiError):
+        return erro.status == 429 or (isinstance(erro.status, int) and erro.status >= 500)
+    if isinstance(erro, ors_exceptions.HTTPError):
+        return erro.status_code >= 500
+    return isinstance(erro, (ors_exceptions.Timeout, requests.exceptions.ConnectionError,
+                             requests.exceptions.Timeout))
+
+
+class LimitadorTaxa:
+    # Balde de tokens: `capacidade` requisições em rajada, reabastecido a `taxa_por_s`.
+    def __init__(self, taxa_por_s, capacidade):
+        self.taxa_por_s = taxa_por_s
+        self.capacidade = capacidade
+        self._tokens = float(capacidade)
+        self._atualizado_em = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reabastecer(self, agora):
+        self._tokens = min(self.capacidade, self._tokens + (agora - self._atualizado_em) * self.taxa_por_s)
+        self._atualizado_em = agora
+
+    # Bloqueia (enfileira) até haver um token ou até `espera_maxima_s`; devolve se conseguiu.
+    # Com `reserva`, só consome se ainda sobrarem `reserva` tokens para outras chamadas.
+    def adquirir(self, espera_maxima_s=ORS_ESPERA_MAXIMA_FILA_S, reserva=0):
+        necessario = 1 + min(reserva, max(self.capacidade - 1, 0))
+        limite = time.monotonic() + espera_maxima_s
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._reabastecer(agora)
+                if self._tokens >= necessario:
+                    self._tokens -= 1
+                    return True
+                espera = (necessario - self._tokens) / self.taxa_por_s
+            if agora + espera > limite:
+                return False
+            time.sleep(espera)
+
+    def tokens_disponiveis(self):
+        with self._lock:
+            self._reabastecer(time.monotonic())
+            return self._tokens
+
+
+class DisjuntorCircuito:
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    MEIO_ABERTO = "meio_aberto"
+
+    # Abre após `limite_falhas` requisições seguidas que falharam mesmo com retentativas e
+    # volta a testar o serviço (uma requisição por vez) depois de `recuperacao_s`.
+    def __init__(self, limite_falhas=ORS_DISJUNTOR_FALHAS, recuperacao_s=ORS_DISJUNTOR_RECUPERACAO_S):
+        self.limite_falhas = limite_falhas
+        self.recuperacao_s = recuperacao_s
+        self._estado = self.FECHADO
+        self._falhas_seguidas = 0
+        self._aberto_em = 0.0
+        self._teste_em_andamento = False
+        self._lock = threading.Lock()
+
+    def estado(self):
+        with self._lock:
+            if self._estado == self.ABERTO and time.monotonic() - self._aberto_em >= self.recuperacao_s:
+                return self.MEIO_ABERTO
+            return self._estado
+
+    def segundos_para_recuperacao(self):
+        with self._lock:
+            if self._estado != self.ABERTO:
+                return 0.0
+            return max(0.0, self.recuperacao_s - (time.monotonic() - self._aberto_em))
+
+    def permitir(self):
+        with self._lock:
+            if self._estado == self.FECHADO:
+                return True
+            if self._estado == self.ABERTO and time.monotonic() - self._aberto_em >= self.recuperacao_s:
+                self._estado = self.MEIO_ABERTO
+            if self._estado == self.MEIO_ABERTO and not self._teste_em_andamento:
+                self._teste_em_andamento = True
+                return True
+            return False
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self._estado = self.FECHADO
+            self._falhas_seguidas = 0
+            self._teste_em_andamento = False
+
+    def liberar_teste(self):
+        with self._lock:
+            self._teste_em_andamento = False
+
+    def registrar_falha(self):
+        with self._lock:
+            self._falhas_seguidas += 1
+            self._teste_em_andamento = False
+            if self._estado == self.MEIO_ABERTO or self._falhas_seguidas >= self.limite_falhas:
+                self._estado = self.ABERTO
+                self._aberto_em = time.monotonic()
+
+
+class AgendadorORS:
+    def __init__(self, limitador=None, disjuntor=None, max_tentativas=ORS_MAX_TENTATIVAS,
+                 backoff_base_s=ORS_BACKOFF_BASE_S, backoff_maximo_s=ORS_BACKOFF_MAXIMO_S,
+                 espera_maxima_fila_s=ORS_ESPERA_MAXIMA_FILA_S, reserva_interativa=ORS_RESERVA_INTERATIVA):
+        self.limitador = limitador or LimitadorTaxa(ORS_REQUISICOES_POR_MINUTO / 60.0, ORS_RAJADA_MAXIMA)
+        self.reserva_interativa = reserva_interativa
+        self.disjuntor = disjuntor or DisjuntorCircuito()
+        self.max_tentativas = max_tentativas
+        self.backoff_base_s = backoff_base_s
+        self.backoff_maximo_s = backoff_maximo_s
+        self.espera_maxima_fila_s = espera_maxima_fila_s
+        self._contadores = {'requisicoes': 0, 'retentativas': 0, 'limites_excedidos': 0, 'rejeitadas': 0}
+        self._lock = threading.Lock()
+
+    def _contar(self, nome):
+        with self._lock:
+            self._contadores[nome] += 1
+
+    def contadores(self):
+        with self._lock:
+            return dict(self._contadores)
+
+    # Backoff exponencial com jitter "completo": espera aleatória entre 0 e base * 2^tentativa.
+    def _espera_backoff(self, tentativa):
+        return random.uniform(0, min(self.backoff_maximo_s, self.backoff_base_s * (2 ** tentativa)))
+
+    def executar(self, funcao, *args, **kwargs):
+        if not self.disjuntor.permitir():
+            self._contar('rejeitadas')
+            raise ServicoORSIndisponivel(
+                f"muitas falhas seguidas; nova tentativa em {self.disjuntor.segundos_para_recuperacao():.0f}s"
+            )
+        ultimo_erro = None
+        reserva = self.reserva_interativa if em_lote() else 0
+        for tentativa in range(self.max_tentativas):
+            if not self.limitador.adquirir(self.espera_maxima_fila_s, reserva):
+                self._contar('rejeitadas')
+                if ultimo_erro is None:
+                    # Fila cheia não indica falha do ORS: só libera um eventual teste do disjuntor.
+                    self.disjuntor.liberar_teste()
+                else:
+                    self.disjuntor.registrar_falha()
+                raise ServicoORSIndisponivel("fila de requisições ao ORS excedeu o tempo máximo de espera")
+            self._contar('requisicoes')
+            try:
+                resultado = funcao(*args, **kwargs)
+            except Exception as e:
+                if not erro_transitorio(e):
+                    # Erro definitivo (ex.: 400/404): o serviço respondeu, então conta como saudável.
+                    self.disjuntor.registrar_sucesso()
+                    raise
+                ultimo_erro = e
+                if isinstance(e, ors_exceptions.ApiError) and e.status == 429:
+                    self._contar('limites_excedidos')
+                if tentativa + 1 < self.max_tentativas:
+                    self._contar('retentativas')
+                    time.sleep(self._espera_backoff(tentativa))
+                continue
+            self.disjuntor.registrar_sucesso()
+            return resultado
+
+        self.disjuntor.registrar_falha()
+        raise ServicoORSIndisponivel(
+            f"falha após {self.max_tentativas} tentativas: {ultimo_erro}"
+        ) from ultimo_erro
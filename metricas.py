@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cache_geocodificacao import DIRETORIO_CACHE_PADRAO
+
+# ----- MÉTRICAS, TEMPOS POR ETAPA E LOG ESTRUTURADO -----
+# Contadores e histogramas do processo no formato texto do Prometheus, gravados em arquivo
+# (para o textfile collector do node_exporter) e, se METRICAS_PORTA for informada,
+# servidos em http://<host>:<porta>/metrics. Cada evento e cada etapa também saem como
+# uma linha JSON no log, com o id da cotação para juntar as etapas de uma mesma consulta.
+METRICAS_PATH = os.environ.get("METRICAS_PATH", os.path.join(DIRETORIO_CACHE_PADRAO, "metricas.prom"))
+METRICAS_PORTA = int(os.environ.get("METRICAS_PORTA", 0))
+LOG_NIVEL = os.environ.get("LOG_NIVEL", "INFO")
+# Vazio: log JSON no stderr.
+LOG_JSON_PATH = os.environ.get("LOG_JSON_PATH")
+PREFIXO_METRICAS = "fretes_"
+LIMITES_HISTOGRAMA_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+NIVEL_SUCESSO = "sucesso"
+NIVEL_INFO = "info"
+NIVEL_AVISO = "aviso"
+NIVEL_ERRO = "erro"
+_NIVEIS_LOGGING = {NIVEL_SUCESSO: logging.INFO, NIVEL_INFO: logging.INFO,
+                   NIVEL_AVISO: logging.WARNING, NIVEL_ERRO: logging.ERROR}
+
+logger = logging.getLogger("fretes")
+
+
+def _rotulos(rotulos):
+    return tuple(sorted((chave, str(valor)) for chave, valor in rotulos.items()))
+
+
+def _formatar_rotulos(rotulos):
+    if not rotulos:
+        return ""
+    escapar = lambda v: v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")  # noqa: E731
+    return "{" + ",".join(f'{chave}="{escapar(valor)}"' for chave, valor in rotulos) + "}"
+
+
+class RegistroMetricas:
+    def __init__(self, prefixo=PREFIXO_METRICAS, limites_histograma=LIMITES_HISTOGRAMA_S):
+        self.prefixo = prefixo
+        self.limites_histograma = limites_histograma
+        self._lock = threading.Lock()
+        self._contadores = {}
+        # (nome, rótulos) -> [contagem por faixa..., soma, total]
+        self._histogramas = {}
+        self._coletores = {}
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        chave = (nome, _rotulos(rotulos))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def observar(self, nome, valor, **rotulos):
+        chave = (nome, _rotulos(rotulos))
+        with self._lock:
+            serie = self._histogramas.setdefault(chave, [0] * len(self.limites_histograma) + [0.0, 0])
+            for i, limite in enumerate(self.limites_histograma):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    # `funcao()` devolve [(nome, tipo, rotulos, valor)] com valores já mantidos em outro lugar
+    # (estatísticas dos caches, contadores do agendador do ORS), lidos só na exportação.
+    # Registrar de novo com o mesmo `nome_coletor` substitui o anterior.
+    def registrar_coletor(self, nome_coletor, funcao):
+        with self._lock:
+            self._coletores[nome_coletor] = funcao
+
+    def exportar(self):
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = {chave: list(serie) for chave, serie in self._histogramas.items()}
+            coletores = list(self._coletores.values())
+
+        series = {}
+        for (nome, rotulos), valor in contadores.items():
+            series.setdefault((nome, "counter"), []).append((rotulos, valor))
+        for funcao in coletores:
+            try:
+                for nome, tipo, rotulos, valor in funcao():
+                    series.setdefault((nome, tipo), []).append((_rotulos(rotulos), valor))
+            except Exception:
+                logger.exception("falha ao coletar métricas")
+
+        linhas = []
+        for (nome, tipo), valores in sorted(series.items()):
+            linhas.append(f"# TYPE {self.prefixo}{nome} {tipo}")
+            for rotulos, valor in sorted(valores):
+                linhas.append(f"{self.prefixo}{nome}{_formatar_rotulos(rotulos)} {valor}")
+        for nome in sorted({nome for nome, _ in histogramas}):
+            linhas.append(f"# TYPE {self.prefixo}{nome} histogram")
+            for (nome_serie, rotulos), serie in sorted(histogramas.items()):
+                if nome_serie != nome:
+                    continue
+                for limite, contagem in zip(self.limites_histograma, serie):
+                    faixa = rotulos + (("le", repr(float(limite))),)
+                    linhas.append(f"{self.prefixo}{nome}_bucket{_formatar_rotulos(faixa)} {contagem}")
+                linhas.append(f"{self.prefixo}{nome}_bucket{_formatar_rotulos(rotulos + (('le', '+Inf'),))} {serie[-1]}")
+                linhas.append(f"{self.prefixo}{nome}_sum{_formatar_rotulos(rotulos)} {serie[-2]:.6f}")
+                linhas.append(f"{self.prefixo}{nome}_count{_formatar_rotulos(rotulos)} {serie[-1]}")
+        return "\n".join(linhas) + "\n"
+
+    # Escrita atômica: o coletor nunca lê um arquivo pela metade.
+    def gravar_arquivo(self, caminho=METRICAS_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            arquivo.write(self.exportar())
+        os.replace(temporario, caminho)
+
+
+# Registro único do processo, compartilhado por app, lote e backends.
+METRICAS = RegistroMetricas()
+
+
+def metricas_de_cache(nome_cache, estatisticas):
+    return [
+        ("cache_acertos_total", "counter", {'cache': nome_cache},
+         estatisticas['acertos'] + estatisticas.get('acertos_negativos', 0)),
+        ("cache_falhas_total", "counter", {'cache': nome_cache}, estatisticas['falhas']),
+        ("cache_entradas", "gauge", {'cache': nome_cache}, estatisticas['entradas']),
+    ]
+
+
+def iniciar_servidor_metricas(porta=METRICAS_PORTA, registro=METRICAS, endereco="0.0.0.0"):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            corpo = registro.exportar().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+    servidor = ThreadingHTTPServer((endereco, porta), Handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+    return servidor
+
+
+# ----- LOG ESTRUTURADO (JSON, UMA LINHA POR REGISTRO) -----
+class FormatadorJSON(logging.Formatter):
+    def format(self, record):
+        dados = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            'nivel': record.levelname.lower(),
+            'logger': record.name,
+            'mensagem': record.getMessage(),
+        }
+        dados.update(getattr(record, 'campos', {}))
+        if record.exc_info:
+            dados['excecao'] = self.formatException(record.exc_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+def configurar_log_json(caminho=LOG_JSON_PATH, nivel=LOG_NIVEL):
+    if not any(isinstance(handler.formatter, FormatadorJSON) for handler in logger.handlers):
+        handler = logging.FileHandler(caminho, encoding="utf-8") if caminho else logging.StreamHandler(sys.stderr)
+        handler.setFormatter(FormatadorJSON())
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(nivel)
+    return logger
+
+
+# Mede o bloco, alimenta o histograma `etapa_duracao_segundos{etapa=...}` e registra no log.
+# O dicionário entregue ao bloco recebe `duracao_ms` e `ok` ao final.
+@contextmanager
+def cronometrar(etapa, **campos):
+    medicao = {'etapa': etapa, 'ok': True}
+    inicio = time.perf_counter()
+    try:
+        yield medicao
+    except BaseException:
+        medicao['ok'] = False
+        raise
+    finally:
+        duracao_s = time.perf_counter() - inicio
+        medicao['duracao_ms'] = round(duracao_s * 1000, 3)
+        METRICAS.observar("etapa_duracao_segundos", duracao_s, etapa=etapa)
+        logger.info(f"etapa {etapa}", extra={'campos': {**campos, **medicao}})
+
+
+# Eventos e tempos por etapa de uma cotação. É o que o expander de log do app exibe e o que
+# vai para o log JSON; pode receber eventos das threads de geocodificação ao mesmo tempo.
+class RegistroCotacao:
+    def __init__(self, **contexto):
+        self.id = uuid.uuid4().hex[:12]
+        self.contexto = contexto
+        self.eventos = []
+        self.etapas = []
+        self._lock = threading.Lock()
+
+    def evento(self, nivel, mensagem, **campos):
+        with self._lock:
+            self.eventos.append({'nivel': nivel, 'mensagem': mensagem, **campos})
+        logger.log(_NIVEIS_LOGGING[nivel], mensagem,
+                   extra={'campos': {'cotacao_id': self.id, 'tipo': nivel, **campos}})
+
+    @contextmanager
+    def etapa(self, nome, **campos):
+        medicao = None
+        try:
+            with cronometrar(nome, cotacao_id=self.id, **campos) as medicao:
+                yield medicao
+        finally:
+            if medicao is not None:
+                with self._lock:
+                    self.etapas.append({**campos, **medicao})
+
+    # Linha-resumo da cotação no log JSON, com o tempo de cada etapa.
+    def concluir(self, **campos):
+        with self._lock:
+            tempos = {etapa['etapa']: etapa['duracao_ms'] for etapa in self.etapas}
+        logger.info("cotação concluída",
+                    extra={'campos': {'cotacao_id': self.id, **self.contexto, **campos, 'etapas_ms': tempos}})
@@ -0,0 +1,144 @@
+import os
+
+from cache_geocodificacao import normalizar_localidade
+from cotacao_lote import calcular_distancias, geocodificar_localidades
+from metricas import cronometrar
+
+# ----- ROTA COM MÚLTIPLAS PARADAS -----
+# As distâncias entre todas as paradas saem do cache de rotas e, para os pares que faltam,
+# de uma única matriz N x N do backend (calcular_distancias, a mesma da cotação em lote).
+# A ordem de visita é exata (programação dinâmica de Held-Karp) até MAX_PARADAS_EXATO
+# paradas e, acima disso, vizinho mais próximo seguido de 2-opt. As distâncias de estrada
+# não são simétricas, então o custo de cada troca é recalculado no sentido percorrido.
+MAX_PARADAS_EXATO = int(os.environ.get("MULTIPARADAS_MAX_EXATO", 12))
+# Uma matriz N x N do plano público do ORS (3.500 elementos) comporta até 59 paradas.
+MAX_PARADAS = int(os.environ.get("MULTIPARADAS_MAX_PARADAS", 50))
+
+METODO_EXATO = "exato"
+METODO_2OPT = "2-opt"
+
+
+# Custo de percorrer `ordem` (índices da matriz); com `retorno`, volta da última à primeira.
+def custo_ordem(matriz, ordem, retorno=False):
+    custo = sum(matriz[a][b] for a, b in zip(ordem, ordem[1:]))
+    if retorno and len(ordem) > 1:
+        custo += matriz[ordem[-1]][ordem[0]]
+    return custo
+
+
+# Menor caminho que sai da parada 0, visita todas e termina em `fim` (None: em qualquer uma;
+# com `retorno`, volta à parada 0). Estados (conjunto visitado, última parada): O(2^n · n²).
+def _ordem_exata(matriz, fim, retorno):
+    intermediarias = [i for i in range(1, len(matriz)) if i != fim]
+    bits = {parada: 1 << i for i, parada in enumerate(intermediarias)}
+    # (conjunto, última) -> (custo, penúltima)
+    custos = {(bits[p], p): (matriz[0][p], 0) for p in intermediarias}
+    for tamanho in range(2, len(intermediarias) + 1):
+        for (conjunto, ultima), (custo, _) in [item for item in custos.items()
+                                              if bin(item[0][0]).count("1") == tamanho - 1]:
+            for proxima in intermediarias:
+                if conjunto & bits[proxima]:
+                    continue
+                chave = (conjunto | bits[proxima], proxima)
+                novo_custo = custo + matriz[ultima][proxima]
+                if chave not in custos or novo_custo < custos[chave][0]:
+                    custos[chave] = (novo_custo, ultima)
+
+    todas = (1 << len(intermediarias)) - 1
+    def custo_final(ultima):
+        custo = custos[(todas, ultima)][0]
+        if fim is not None:
+            return custo + matriz[ultima][fim] + (matriz[fim][0] if retorno else 0.0)
+        return custo + (matriz[ultima][0] if retorno else 0.0)
+    ultima = min(intermediarias, key=custo_final)
+    ordem, conjunto = [], todas
+    while ultima != 0:
+        ordem.append(ultima)
+        ultima, conjunto = custos[(conjunto, ultima)][1], conjunto & ~bits[ultima]
+    return [0, *reversed(ordem)] + ([fim] if fim is not None else [])
+
+
+def _ordem_2opt(matriz, fim, retorno):
+    n = len(matriz)
+    ordem, restantes = [0], set(range(1, n)) - {fim}
+    while restantes:
+        proxima = min(restantes, key=lambda parada: matriz[ordem[-1]][parada])
+        ordem.append(proxima)
+        restantes.remove(proxima)
+    if fim is not None:
+        ordem.append(fim)
+
+    # Inverte o trecho ordem[i..j] enquanto alguma inversão encurtar o percurso; a primeira
+    # parada (e a última, se fixada) não se move.
+    ultima_movel = n - 2 if fim is not None else n - 1
+    melhor_custo = custo_ordem(matriz, ordem, retorno)
+    melhorou = True
+    while melhorou:
+        melhorou = False
+        for i in range(1, ultima_movel):
+            for j in range(i + 1, ultima_movel + 1):
+                candidata = ordem[:i] + ordem[i:j + 1][::-1] + ordem[j + 1:]
+                custo = custo_ordem(matriz, candidata, retorno)
+                if custo < melhor_custo - 1e-9:
+                    ordem, melhor_custo, melhorou = candidata, custo, True
+    return ordem
+
+
+# `matriz[i][j]`: km da parada i à j (None/inf = sem rota). A parada 0 é sempre o início;
+# `fixar_fim` mantém a última parada informada como destino final. Devolve (ordem, método).
+def otimizar_ordem(matriz, fixar_fim=False, retorno=False, max_exato=MAX_PARADAS_EXATO):
+    n = len(matriz)
+    matriz = [[float("inf") if d is None else d for d in linha] for linha in matriz]
+    if n <= 2:
+        return list(range(n)), METODO_EXATO
+    fim = n - 1 if fixar_fim else None
+    if n <= max_exato:
+        return _ordem_exata(matriz, fim, retorno), METODO_EXATO
+    return _ordem_2opt(matriz, fim, retorno), METODO_2OPT
+
+
+# Geocodifica as paradas, monta a matriz e escolhe a ordem. Devolve um dicionário com as
+# paradas na ordem de visita (nome, coordenadas, km do trecho até ela), a distância total,
+# a da ordem informada e o método usado; `erro` explica quando a rota não pôde ser montada.
+def planejar_paradas(nomes, backend, cache_geocodificacao, cache_rotas, perfil, indice_municipios=None,
+                     fixar_fim=False, retorno=False):
+    nomes = [nome.strip() for nome in nomes if nome.strip()]
+    if len(nomes) < 2:
+        return {'erro': "Informe ao menos duas paradas."}
+    if len(nomes) > MAX_PARADAS:
+        return {'erro': f"No máximo {MAX_PARADAS} paradas por rota."}
+    erros = {}
+    with cronometrar("multiparadas_geocodificacao", paradas=len(nomes)):
+        coordenadas = geocodificar_localidades(nomes, backend, cache_geocodificacao, indice_municipios, erros)
+    coords = [coordenadas.get(normalizar_localidade(nome)) for nome in nomes]
+    nao_encontradas = [nome for nome, c in zip(nomes, coords) if not c]
+    if nao_encontradas:
+        detalhe = f" ({next(iter(erros.values()))})" if erros else ""
+        return {'erro': f"Paradas não geocodificadas: {', '.join(nao_encontradas)}{detalhe}."}
+
+    coords = [tuple(c) for c in coords]
+    pares = {(o, d) for o in coords for d in coords if o != d}
+    with cronometrar("multiparadas_matriz", paradas=len(nomes)):
+        distancias = calcular_distancias(pares, backend, cache_rotas, perfil, erros=erros)
+    if erros:
+        return {'erro': f"Erro ao calcular a matriz de distâncias: {next(iter(erros.values()))}"}
+    matriz = [[0.0 if o == d else distancias.get((o, d)) for d in coords] for o in coords]
+
+    with cronometrar("multiparadas_ordem", paradas=len(nomes)) as medicao:
+        ordem, metodo = otimizar_ordem(matriz, fixar_fim, retorno)
+        medicao['metodo'] = metodo
+    visita = ordem + [ordem[0]] if retorno else ordem
+    trechos = [matriz[a][b] for a, b in zip(visita, visita[1:])]
+    if any(km is None for km in trechos):
+        return {'erro': "Sem rota rodoviária entre algumas das paradas."}
+    informada = list(range(len(nomes))) + ([0] if retorno else [])
+    trechos_informada = [matriz[a][b] for a, b in zip(informada, informada[1:])]
+    return {
+        'paradas': [{'ordem': posicao + 1, 'parada': nomes[i], 'longitude': coords[i][0], 'latitude': coords[i][1],
+                     'trecho_km': 0.0 if posicao == 0 else trechos[posicao - 1]}
+                    for posicao, i in enumerate(visita)],
+        'distancia_total_km': sum(trechos),
+        'distancia_ordem_informada_km': (sum(trechos_informada) if None not in trechos_informada else None),
+        'metodo': metodo,
+        'erro': None,
+    }
@@ -0,0 +1,151 @@
+import csv
+import difflib
+import io
+import os
+import re
+import sys
+import unicodedata
+
+from cache_geocodificacao import normalizar_localidade
+
+# ----- GAZETTEER OFFLINE DE MUNICÍPIOS BRASILEIROS -----
+# Entradas do tipo "Cidade, UF, Brasil" são resolvidas em memória (sem acento, sem
+# diferenciar maiúsculas e tolerando pequenos erros de digitação); só endereços livres
+# ("Praça do Ferreira, Fortaleza") seguem para o geocodificador do backend.
+CAMINHO_MUNICIPIOS = os.environ.get(
+    "MUNICIPIOS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dados", "municipios.csv")
+)
+# Fonte da lista completa (código IBGE, nome, coordenadas e código da UF) usada por `--atualizar`.
+URL_MUNICIPIOS = os.environ.get(
+    "MUNICIPIOS_URL", "https://raw.githubusercontent.com/kelvins/municipios-brasileiros/main/csv/municipios.csv"
+)
+SIMILARIDADE_MINIMA = float(os.environ.get("MUNICIPIOS_SIMILARIDADE_MINIMA", 0.85))
+# Nome sem UF só é aceito com a lista (quase) completa de municípios carregada: com uma lista
+# parcial (só as capitais, por exemplo), "Palmas" viraria Palmas/TO mesmo existindo
+# Palmas/PR. Abaixo disso, entradas sem UF seguem para o geocodificador do backend.
+MIN_MUNICIPIOS_BUSCA_SEM_UF = int(os.environ.get("MUNICIPIOS_MIN_BUSCA_SEM_UF", 5000))
+
+UF_POR_CODIGO = {
+    11: 'RO', 12: 'AC', 13: 'AM', 14: 'RR', 15: 'PA', 16: 'AP', 17: 'TO',
+    21: 'MA', 22: 'PI', 23: 'CE', 24: 'RN', 25: 'PB', 26: 'PE', 27: 'AL', 28: 'SE', 29: 'BA',
+    31: 'MG', 32: 'ES', 33: 'RJ', 35: 'SP',
+    41: 'PR', 42: 'SC', 43: 'RS',
+    50: 'MS', 51: 'MT', 52: 'GO', 53: 'DF',
+}
+NOMES_UF = {
+    'rondonia': 'RO', 'acre': 'AC', 'amazonas': 'AM', 'roraima': 'RR', 'para': 'PA', 'amapa': 'AP',
+    'tocantins': 'TO', 'maranhao': 'MA', 'piaui': 'PI', 'ceara': 'CE', 'rio grande do norte': 'RN',
+    'paraiba': 'PB', 'pernambuco': 'PE', 'alagoas': 'AL', 'sergipe': 'SE', 'bahia': 'BA',
+    'minas gerais': 'MG', 'espirito santo': 'ES', 'rio de janeiro': 'RJ', 'sao paulo': 'SP',
+    'parana': 'PR', 'santa catarina': 'SC', 'rio grande do sul': 'RS', 'mato grosso do sul': 'MS',
+    'mato grosso': 'MT', 'goias': 'GO', 'distrito federal': 'DF',
+}
+SIGLAS_UF = set(UF_POR_CODIGO.values())
+NOMES_PAIS = {'brasil', 'brazil', 'br'}
+_CIDADE_HIFEN_UF = re.compile(r"^(.+?)\s*[-/]\s*([a-z]{2})$")
+
+
+def _sem_acento(texto):
+    texto = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in texto if not unicodedata.combining(c)).casefold()
+
+
+class IndiceMunicipios:
+    # `busca_sem_uf`: None decide pelo tamanho da lista (MIN_MUNICIPIOS_BUSCA_SEM_UF).
+    def __init__(self, municipios, busca_sem_uf=None):
+        # municipios: iterável de (codigo_ibge, nome, uf, latitude, longitude)
+        self._por_nome_uf = {}
+        self._por_nome = {}
+        self._nomes_por_uf = {}
+        for codigo_ibge, nome, uf, latitude, longitude in municipios:
+            registro = (int(codigo_ibge), nome, uf, float(longitude), float(latitude))
+            chave = " ".join(_sem_acento(nome).replace("-", " ").replace("'", " ").split())
+            self._por_nome_uf[(chave, uf)] = registro
+            self._por_nome.setdefault(chave, []).append(registro)
+            self._nomes_por_uf.setdefault(uf, []).append(chave)
+        self.busca_sem_uf = len(self) >= MIN_MUNICIPIOS_BUSCA_SEM_UF if busca_sem_uf is None else busca_sem_uf
+
+    def __len__(self):
+        return len(self._por_nome_uf)
+
+    @staticmethod
+    def _separar(nome_lugar):
+        partes = normalizar_localidade(nome_lugar).split(", ")
+        if partes and partes[-1] in NOMES_PAIS:
+            partes = partes[:-1]
+        uf = None
+        if len(partes) >= 2:
+            ultima = partes[-1]
+            if ultima.upper() in SIGLAS_UF:
+                uf, partes = ultima.upper(), partes[:-1]
+            elif ultima in NOMES_UF:
+                uf, partes = NOMES_UF[ultima], partes[:-1]
+        if len(partes) != 1:
+            return None, None
+        cidade = partes[0]
+        if uf is None:
+            casamento = _CIDADE_HIFEN_UF.match(cidade)
+            if casamento and casamento.group(2).upper() in SIGLAS_UF:
+                cidade, uf = casamento.group(1), casamento.group(2).upper()
+        return " ".join(cidade.replace("-", " ").replace("'", " ").split()), uf
+
+    # Registro (codigo_ibge, nome, uf, longitude, latitude) ou None se a entrada não é um
+    # município reconhecível (endereço livre, nome sem UF com a lista incompleta, nome
+    # ambíguo sem UF ou sem correspondência).
+    def buscar(self, nome_lugar):
+        cidade, uf = self._separar(nome_lugar)
+        if not cidade:
+            return None
+        if uf is not None:
+            registro = self._por_nome_uf.get((cidade, uf))
+            if registro is None:
+                parecidos = difflib.get_close_matches(cidade, self._nomes_por_uf.get(uf, []), n=1,
+                                                      cutoff=SIMILARIDADE_MINIMA)
+                registro = self._por_nome_uf.get((parecidos[0], uf)) if parecidos else None
+            return registro
+        if not self.busca_sem_uf:
+            return None
+        candidatos = self._por_nome.get(cidade)
+        if candidatos is None:
+            parecidos = difflib.get_close_matches(cidade, self._por_nome.keys(), n=1, cutoff=SIMILARIDADE_MINIMA)
+            candidatos = self._por_nome.get(parecidos[0]) if parecidos else None
+        # Sem UF, só aceita nomes que existem em um único estado.
+        return candidatos[0] if candidatos and len(candidatos) == 1 else None
+
+    def geocodificar(self, nome_lugar):
+        registro = self.buscar(nome_lugar)
+        return [registro[3], registro[4]] if registro else None
+
+
+def carregar_indice_municipios(caminho=CAMINHO_MUNICIPIOS):
+    if not os.path.exists(caminho):
+        return IndiceMunicipios([])
+    with open(caminho, encoding="utf-8", newline="") as arquivo:
+        leitor = csv.DictReader(arquivo)
+        return IndiceMunicipios(
+            (linha['codigo_ibge'], linha['nome'], linha['uf'], linha['latitude'], linha['longitude'])
+            for linha in leitor
+        )
+
+
+# Baixa a lista completa de municípios e grava no formato de `dados/municipios.csv`:
+#   python municipios.py --atualizar
+if __name__ == "__main__":
+    if sys.argv[1:] != ["--atualizar"]:
+        print("Uso: python municipios.py --atualizar")
+        sys.exit(1)
+
+    import requests
+
+    resposta = requests.get(URL_MUNICIPIOS, timeout=60)
+    resposta.raise_for_status()
+    origem = csv.DictReader(io.StringIO(resposta.content.decode("utf-8-sig")))
+    with open(CAMINHO_MUNICIPIOS, "w", encoding="utf-8", newline="") as arquivo:
+        escritor = csv.writer(arquivo, lineterminator="\n")
+        escritor.writerow(['codigo_ibge', 'nome', 'uf', 'latitude', 'longitude'])
+        total = 0
+        for linha in origem:
+            escritor.writerow([linha['codigo_ibge'], linha['nome'], UF_POR_CODIGO[int(linha['codigo_uf'])],
+                               linha['latitude'], linha['longitude']])
+            total += 1
+    print(f"{total} municípios gravados em {CAMINHO_MUNICIPIOS}.")
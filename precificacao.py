@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+from antt import normalizar_eixos, normalizar_tipo_carga, obter_versao_tarifas, repositorio_tarifas_antt
+
+# ----- MOTOR DE PRECIFICAÇÃO DO FRETE -----
+# Funções puras (sem Streamlit): recebem escalares, arrays ou colunas de um DataFrame e
+# calculam todas as linhas de uma só vez. O formulário do app e a cotação em lote usam
+# as mesmas regras daqui.
+
+# IMPORTANTÍSSIMO: Ajuste este valor para a capacidade total do caminhão que você está usando como base!
+CAPACIDADE_TOTAL_CAMINHAO_KG = 20000.00
+
+# Qual das regras de cálculo foi aplicada em cada linha.
+SITUACAO_PROPORCIONAL = "proporcional"        # peso abaixo da capacidade: frete proporcional ao peso
+SITUACAO_CAPACIDADE_TOTAL = "capacidade_total"  # peso igual ou acima da capacidade: frete cheio
+SITUACAO_SEM_PESO = "sem_peso"                # peso 0: apenas custos fixos
+SITUACAO_SEM_CAPACIDADE = "sem_capacidade"    # capacidade não definida: frete cheio
+SITUACAO_DISTANCIA_ZERO = "distancia_zero"    # distância 0: apenas custos fixos
+SITUACAO_SEM_DISTANCIA = "sem_distancia"      # distância não calculada: sem valor total
+
+
+def converter_datas(serie):
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.dt.normalize()
+    return pd.to_datetime(serie.astype(str).str.strip(), format="%d/%m/%Y", errors="coerce")
+
+
+def precificar(distancia_km, coef_desloc_antt, valor_fixo_cd_antt, peso_kg=0.0, adicional_km=0.0,
+               dificuldade=0.0, capacidade_kg=CAPACIDADE_TOTAL_CAMINHAO_KG):
+    entradas = [distancia_km, coef_desloc_antt, valor_fixo_cd_antt, peso_kg, adicional_km, dificuldade]
+    indice = next((x.index for x in entradas if isinstance(x, pd.Series)), None)
+    distancia, coef, fixo, peso, adicional, dificuldade = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(x, dtype=float)) for x in entradas)
+    )
+
+    com_distancia = distancia > 0
+    distancia_zero = distancia == 0
+    custo_deslocamento = np.where(com_distancia, coef * distancia, np.nan)
+    custo_adicional = np.where(com_distancia, adicional * distancia, np.nan)
+    frete_cheio = custo_deslocamento + fixo + custo_adicional + dificuldade
+
+    com_capacidade = (peso > 0) & (capacidade_kg > 0)
+    proporcional = com_capacidade & (peso < capacidade_kg)
+    proporcao_peso = np.where(proporcional, peso / (capacidade_kg if capacidade_kg > 0 else 1.0), np.nan)
+    situacao = np.select(
+        [distancia_zero, ~com_distancia, proporcional, com_capacidade, peso == 0],
+        [SITUACAO_DISTANCIA_ZERO, SITUACAO_SEM_DISTANCIA, SITUACAO_PROPORCIONAL, SITUACAO_CAPACIDADE_TOTAL,
+         SITUACAO_SEM_PESO],
+        default=SITUACAO_SEM_CAPACIDADE,
+    )
+    frete_total = np.select(
+        [distancia_zero, ~com_distancia, proporcional, peso == 0],
+        [fixo + dificuldade, np.nan, frete_cheio * proporcao_peso, fixo + dificuldade],
+        default=frete_cheio,
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frete_real_por_km = np.where(com_distancia, frete_total / distancia, np.nan)
+        delta_vs_base = frete_real_por_km - coef
+        percent_vs_base = np.where(coef > 0, delta_vs_base / coef * 100, 0.0)
+
+    return pd.DataFrame({
+        'custo_deslocamento_antt': custo_deslocamento,
+        'custo_adicional_desloc': custo_adicional,
+        'frete_total_cheio': frete_cheio,
+        'proporcao_peso': proporcao_peso,
+        'frete_total_calculado': frete_total,
+        'frete_real_por_km': frete_real_por_km,
+        'delta_vs_base_antt': delta_vs_base,
+        'percent_vs_base_antt': np.where(com_distancia & ~np.isnan(coef), percent_vs_base, np.nan),
+        'peso_transportado_kg': np.where((peso > 0) & com_distancia, peso, 0.0),
+        'situacao': situacao,
+    }, index=indice)
+
+
+# Normativo ANTT de cada linha, com uma única versão das tarifas para o DataFrame inteiro.
+# Com as colunas opcionais tipo_carga/eixos, cada combinação busca na tabela correspondente.
+def _buscar_tarifas(df, datas_calculo, versao):
+    if df.empty or ('tipo_carga' not in df.columns and 'eixos' not in df.columns):
+        return versao.buscar_vetorizado(datas_calculo)
+    tipos = df['tipo_carga'].map(normalizar_tipo_carga) if 'tipo_carga' in df.columns else ""
+    eixos = df['eixos'].map(normalizar_eixos) if 'eixos' in df.columns else None
+    chaves = pd.DataFrame({'tipo_carga': tipos, 'eixos': eixos}, index=df.index)
+    partes = [versao.buscar_vetorizado(datas_calculo.loc[grupo.index], tipo_carga, eixos)
+              for (tipo_carga, eixos), grupo in chaves.groupby(['tipo_carga', 'eixos'], dropna=False)]
+    return pd.concat(partes).reindex(df.index)
+
+
+# `df` com as colunas data, distancia_km, peso_kg, adicional_km e dificuldade (e, opcionalmente,
+# tipo_carga e eixos). Resolve o normativo ANTT de cada data e devolve o DataFrame acrescido
+# das colunas do cálculo.
+def precificar_cotacoes(df, tabela=repositorio_tarifas_antt, capacidade_kg=CAPACIDADE_TOTAL_CAMINHAO_KG):
+    datas_calculo = converter_datas(df['data'])
+    resultado = df.join(_buscar_tarifas(df, datas_calculo, obter_versao_tarifas(tabela)))
+    resultado = resultado.join(precificar(
+        resultado['distancia_km'], resultado['coef_desloc_antt'], resultado['valor_fixo_cd_antt'],
+        resultado['peso_kg'], resultado['adicional_km'], resultado['dificuldade'], capacidade_kg,
+    ))
+    resultado['status'] = np.select(
+        [datas_calculo.isna(), resultado['normativo'].isna(), resultado['distancia_km'].isna()],
+        ["data inválida", "sem normativo ANTT para a data", "distância não calculada"],
+        default="ok",
+    )
+    return resultado
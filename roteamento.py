@@ -0,0 +1,233 @@
+import hashlib
+import math
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache_geocodificacao import normalizar_localidade
+from metricas import METRICAS
+
+# ----- BACKENDS DE ROTEAMENTO -----
+# O app só conversa com esta interface; qual serviço responde (ORS hospedado, OSRM local
+# ou o stub determinístico para testes) é escolhido por configuração (ROTEAMENTO_BACKEND).
+ROTEAMENTO_BACKEND = os.environ.get("ROTEAMENTO_BACKEND", "ors")
+ORS_BASE_URL = os.environ.get("ORS_BASE_URL", "https://api.openrouteservice.org")
+OSRM_URL = os.environ.get("OSRM_URL", "http://localhost:5000")
+OSRM_TIMEOUT_S = float(os.environ.get("OSRM_TIMEOUT_S", 10))
+MAX_CONCORRENCIA_ROTEAMENTO = int(os.environ.get("ROTEAMENTO_MAX_CONCORRENCIA", 4))
+# Trabalho em lote (fila de lotes) tem executor próprio, com esta concorrência: uma cotação
+# interativa nunca entra na fila atrás dos blocos de um lote.
+MAX_CONCORRENCIA_ROTEAMENTO_LOTE = int(os.environ.get("ROTEAMENTO_MAX_CONCORRENCIA_LOTE", 2))
+
+_prioridade = threading.local()
+
+
+# Marca o trabalho feito dentro do bloco (e nas threads do executor de lote) como de baixa
+# prioridade: vai para o executor de lote e cede os tokens do limitador às consultas interativas.
+@contextmanager
+def prioridade_lote():
+    anterior = getattr(_prioridade, 'lote', False)
+    _prioridade.lote = True
+    try:
+        yield
+    finally:
+        _prioridade.lote = anterior
+
+
+def em_lote():
+    return getattr(_prioridade, 'lote', False)
+
+
+def _marcar_thread_lote():
+    _prioridade.lote = True
+
+
+# Serviço de roteamento fora do ar ou sobrecarregado; vale tentar de novo mais tarde.
+class ServicoRoteamentoIndisponivel(Exception):
+    pass
+
+
+# Resposta definitiva de erro do serviço de roteamento (equivalente ao ApiError do ORS).
+class ErroRoteamento(Exception):
+    pass
+
+
+class BackendRoteamento(ABC):
+    nome = None
+    # Backends de teste não gravam nos caches persistentes compartilhados.
+    persistir_cache = True
+
+    def __init__(self, max_concorrencia=MAX_CONCORRENCIA_ROTEAMENTO, max_concorrencia_lote=MAX_CONCORRENCIA_ROTEAMENTO_LOTE):
+        self.max_concorrencia = max_concorrencia
+        self.max_concorrencia_lote = max_concorrencia_lote
+        self._executor = ThreadPoolExecutor(max_workers=max_concorrencia, thread_name_prefix=f"rota-{self.nome}")
+        self._executor_lote = ThreadPoolExecutor(max_workers=max_concorrencia_lote,
+                                                 thread_name_prefix=f"rota-{self.nome}-lote",
+                                                 initializer=_marcar_thread_lote)
+
+    # Coordenadas [lon, lat] do lugar ou None se não encontrado.
+    @abstractmethod
+    def geocodificar(self, nome_lugar):
+        pass
+
+    # (distancia_km, geometria [[lon, lat], ...]) ou None se não há rota.
+    @abstractmethod
+    def rota(self, coords_origem, coords_destino, perfil):
+        pass
+
+    # Distâncias em km de cada origem para cada destino (None quando não há rota).
+    @abstractmethod
+    def matriz_distancias(self, origens, destinos, perfil):
+        pass
+
+    def segundos_para_recuperacao(self):
+        return 0.0
+
+    # Executor de quem chama: o de lote dentro de `prioridade_lote()`, o interativo fora dele.
+    def _executor_atual(self):
+        return self._executor_lote if em_lote() else self._executor
+
+    def submeter(self, funcao, *args, **kwargs):
+        return self._executor_atual().submit(funcao, *args, **kwargs)
+
+    # Dispara `funcao(item)` para todos os itens, no máximo `max_concorrencia` (ou
+    # `max_concorrencia_lote`) por vez, e devolve os futures na mesma ordem dos itens.
+    def executar_em_paralelo(self, funcao, itens):
+        executor = self._executor_atual()
+        return [executor.submit(funcao, item) for item in itens]
+
+    def encerrar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor_lote.shutdown(wait=False, cancel_futures=True)
+
+
+class BackendOSRM(BackendRoteamento):
+    # Serviço OSRM (ou compatível) rodando na infraestrutura própria, ex.: com o grafo
+    # rodoviário do Brasil pré-processado. OSRM não geocodifica: os nomes são resolvidos
+    # por `geocodificador` (outro backend), quando informado.
+    nome = "osrm"
+
+    def __init__(self, url=OSRM_URL, geocodificador=None, timeout_s=OSRM_TIMEOUT_S,
+                 max_concorrencia=MAX_CONCORRENCIA_ROTEAMENTO, max_concorrencia_lote=MAX_CONCORRENCIA_ROTEAMENTO_LOTE):
+        super().__init__(max_concorrencia, max_concorrencia_lote)
+        self.url = url.rstrip("/")
+        self.geocodificador = geocodificador
+        self.timeout_s = timeout_s
+        self._sessao = requests.Session()
+        # Uma conexão por thread dos dois executores: o lote não segura conexões das interativas.
+        conexoes = max_concorrencia + max_concorrencia_lote
+        adaptador = HTTPAdapter(pool_connections=conexoes, pool_maxsize=conexoes, pool_block=True)
+        self._sessao.mount("http://", adaptador)
+        self._sessao.mount("https://", adaptador)
+
+    def _perfil_osrm(self, perfil):
+        return "driving" if perfil.startswith("driving") else perfil
+
+    def _get(self, operacao, caminho, params):
+        METRICAS.incrementar("api_chamadas_total", backend=self.nome, operacao=operacao)
+        try:
+            resposta = self._sessao.get(f"{self.url}{caminho}", params=params, timeout=self.timeout_s)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            raise ServicoRoteamentoIndisponivel(f"OSRM inacessível em {self.url}: {e}") from e
+        if resposta.status_code >= 500 or resposta.status_code == 429:
+            raise ServicoRoteamentoIndisponivel(f"OSRM respondeu HTTP {resposta.status_code}")
+        # Página de erro de proxy, HTML com status 200 etc.: resposta definitiva, não um traceback.
+        try:
+            corpo = resposta.json()
+        except ValueError as e:
+            raise ErroRoteamento(f"OSRM respondeu HTTP {resposta.status_code} sem JSON válido: "
+                                 f"{resposta.text[:200]!r}") from e
+        if not isinstance(corpo, dict):
+            raise ErroRoteamento(f"OSRM respondeu HTTP {resposta.status_code} com JSON inesperado.")
+        if corpo.get('code') not in ("Ok", "NoRoute"):
+            raise ErroRoteamento(f"OSRM: {corpo.get('code')} - {corpo.get('message')}")
+        return corpo
+
+    # Sem geocodificador, "não sei geocodificar" não é "lugar não encontrado": levanta erro para
+    # que o resultado não seja gravado como negativo no cache de geocodificação compartilhado.
+    def geocodificar(self, nome_lugar):
+        if self.geocodificador is None:
+            raise ErroRoteamento("OSRM não geocodifica e nenhum geocodificador foi configurado (ORS_API_KEY).")
+        return self.geocodificador.geocodificar(nome_lugar)
+
+    def rota(self, coords_origem, coords_destino, perfil):
+        pontos = f"{coords_origem[0]},{coords_origem[1]};{coords_destino[0]},{coords_destino[1]}"
+        corpo = self._get("rota", f"/route/v1/{self._perfil_osrm(perfil)}/{pontos}",
+                          {'overview': "full", 'geometries': "geojson"})
+        if not corpo.get('routes'):
+            return None
+        rota = corpo['routes'][0]
+        return rota['distance'] / 1000, rota['geometry']['coordinates']
+
+    def matriz_distancias(self, origens, destinos, perfil):
+        locais = list(origens) + list(destinos)
+        pontos = ";".join(f"{lon},{lat}" for lon, lat in locais)
+        corpo = self._get("matriz", f"/table/v1/{self._perfil_osrm(perfil)}/{pontos}", {
+            'annotations': "distance",
+            'sources': ";".join(str(i) for i in range(len(origens))),
+            'destinations': ";".join(str(i) for i in range(len(origens), len(locais))),
+        })
+        return [[d / 1000 if d is not None else None for d in linha] for linha in corpo['distances']]
+
+
+def distancia_haversine_km(coords_origem, coords_destino):
+    lon1, lat1, lon2, lat2 = map(math.radians, (*coords_origem, *coords_destino))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * math.asin(math.sqrt(a))
+
+
+class BackendStub(BackendRoteamento):
+    # Backend em processo e determinístico, para testes e benchmarks: localidades conhecidas
+    # usam as coordenadas informadas; as demais recebem um ponto fixo (derivado do hash do
+    # nome) dentro do território brasileiro. Distância = haversine x fator de sinuosidade.
+    nome = "stub"
+    persistir_cache = False
+    FATOR_SINUOSIDADE = 1.25
+
+    def __init__(self, coordenadas=None, pontos_geometria=50, max_concorrencia=MAX_CONCORRENCIA_ROTEAMENTO,
+                 max_concorrencia_lote=MAX_CONCORRENCIA_ROTEAMENTO_LOTE):
+        super().__init__(max_concorrencia, max_concorrencia_lote)
+        self.coordenadas = {normalizar_localidade(nome): coords for nome, coords in (coordenadas or {}).items()}
+        self.pontos_geometria = pontos_geometria
+
+    def geocodificar(self, nome_lugar):
+        chave = normalizar_localidade(nome_lugar)
+        if not chave:
+            return None
+        if chave in self.coordenadas:
+            return list(self.coordenadas[chave])
+        resumo = hashlib.sha256(chave.encode("utf-8")).digest()
+        longitude = -73.0 + 38.0 * int.from_bytes(resumo[:4], "big") / 2 ** 32
+        latitude = -33.0 + 38.0 * int.from_bytes(resumo[4:8], "big") / 2 ** 32
+        return [round(longitude, 6), round(latitude, 6)]
+
+    def rota(self, coords_origem, coords_destino, perfil):
+        distancia_km = distancia_haversine_km(coords_origem, coords_destino) * self.FATOR_SINUOSIDADE
+        n = self.pontos_geometria
+        geometria = [[coords_origem[0] + (coords_destino[0] - coords_origem[0]) * i / n,
+                      coords_origem[1] + (coords_destino[1] - coords_origem[1]) * i / n] for i in range(n + 1)]
+        return distancia_km, geometria
+
+    def matriz_distancias(self, origens, destinos, perfil):
+        return [[distancia_haversine_km(o, d) * self.FATOR_SINUOSIDADE for d in destinos] for o in origens]
+
+
+# `config`: ors_api_key e ors_base_url (backend "ors"), osrm_url e geocodificador (backend "osrm").
+def criar_backend(nome=ROTEAMENTO_BACKEND, **config):
+    if nome == "ors":
+        import openrouteservice
+        from acesso_ors import AcessoORS
+        # Retentativas de 429 e 5xx ficam a cargo do AgendadorORS (com backoff e disjuntor), não do
+        # cliente: ver acesso_ors._recusar_retentativa_do_cliente.
+        return AcessoORS(openrouteservice.Client(key=config['ors_api_key'], base_url=config.get('ors_base_url') or ORS_BASE_URL,
+                                                 retry_over_query_limit=False))
+    if nome == "osrm":
+        return BackendOSRM(config.get('osrm_url') or OSRM_URL, geocodificador=config.get('geocodificador'))
+    if nome == "stub":
+        return BackendStub(config.get('coordenadas'))
+    raise ValueError(f"Backend de roteamento desconhecido: '{nome}'. Use 'ors', 'osrm' ou 'stub'.")
@@ -0,0 +1,44 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import openrouteservice
+import pytest
+
+from acesso_ors import AcessoORS
+from limitador_ors import AgendadorORS, DisjuntorCircuito, LimitadorTaxa, ServicoORSIndisponivel
+
+
+@pytest.fixture
+def servidor_503():
+    chamadas = []
+
+    class Tratador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            chamadas.append(self.path)
+            self.send_response(503)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": "fora do ar"}')
+
+        def log_message(self, *args):
+            pass
+
+    servidor = HTTPServer(("127.0.0.1", 0), Tratador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{servidor.server_port}", chamadas
+    servidor.shutdown()
+
+
+def test_503_so_e_repetido_pelo_agendador(servidor_503):
+    url, chamadas = servidor_503
+    client = openrouteservice.Client(key="x", base_url=url, retry_over_query_limit=False)
+    agendador = AgendadorORS(LimitadorTaxa(100.0, 100), DisjuntorCircuito(limite_falhas=1), max_tentativas=2,
+                             backoff_base_s=0.0)
+    acesso = AcessoORS(client, agendador=agendador)
+    try:
+        with pytest.raises(ServicoORSIndisponivel):
+            acesso.geocodificar("Fortaleza, CE")
+    finally:
+        acesso.encerrar()
+    assert len(chamadas) == 2
+    assert agendador.disjuntor.estado() == DisjuntorCircuito.ABERTO
@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from antt import IndiceANTT, RepositorioTarifasANTT, VersaoTarifasANTT, encontrar_frete_vigente, ler_tarifas
+
+TABELA = {
+    "RESOLUÇÃO Nº 6.034": [7.413, 664.97, "18/01/2024"],
+    "RESOLUÇÃO Nº 6.046": [7.486, 675.05, "11/07/2024"],
+    "PORTARIA Nº 3": [7.639, 623.07, "07/02/2025"],
+}
+
+
+@pytest.mark.parametrize("data, normativo", [
+    ("17/01/2024", None),
+    ("18/01/2024", "RESOLUÇÃO Nº 6.034"),
+    ("10/07/2024", "RESOLUÇÃO Nº 6.034"),
+    ("11/07/2024", "RESOLUÇÃO Nº 6.046"),
+    ("06/02/2025", "RESOLUÇÃO Nº 6.046"),
+    ("07/02/2025", "PORTARIA Nº 3"),
+    ("31/12/2030", "PORTARIA Nº 3"),
+])
+def test_encontrar_frete_vigente_nas_fronteiras(data, normativo):
+    encontrado, frete, data_obj = encontrar_frete_vigente(TABELA, data)
+    assert data_obj == datetime.strptime(data, "%d/%m/%Y")
+    assert encontrado == normativo
+    assert frete == (TABELA[normativo][:2] if normativo else None)
+
+
+def test_encontrar_frete_vigente_data_invalida():
+    assert encontrar_frete_vigente(TABELA, "2024-01-18") == (None, None, None)
+
+
+def test_busca_vetorizada_igual_a_busca_por_data():
+    indice = IndiceANTT(TABELA)
+    datas = pd.Series(pd.to_datetime(["2024-01-17", "2024-01-18", "2024-07-10", "2025-02-07", None]))
+    resultado = indice.buscar_vetorizado(datas)
+    for data, (_, linha) in zip(datas, resultado.iterrows()):
+        normativo, frete = indice.buscar(data.to_pydatetime()) if not pd.isna(data) else (None, None)
+        if normativo is None:
+            assert pd.isna(linha['normativo'])
+        else:
+            assert linha['normativo'] == normativo
+            assert [linha['coef_desloc_antt'], linha['valor_fixo_cd_antt']] == frete
+
+
+def test_tabela_especifica_com_reserva_na_geral():
+    versao = VersaoTarifasANTT([
+        ("01/01/2024", "geral", "", None, 7.0, 600.0),
+        ("01/01/2024", "granel 5 eixos", "Granel sólido", 5, 6.0, 500.0),
+    ])
+    assert versao.indice("granel solido", 5).buscar(datetime(2024, 3, 1))[0] == "granel 5 eixos"
+    assert versao.indice("Granel sólido", 9).buscar(datetime(2024, 3, 1))[0] == "geral"
+    assert versao.tipos_carga() == ["Granel sólido"]
+    assert versao.eixos() == [5]
+
+
+def test_tabela_especifica_ainda_nao_vigente_usa_a_geral():
+    versao = VersaoTarifasANTT([
+        ("01/01/2024", "geral", "", None, 7.0, 600.0),
+        ("01/07/2024", "granel 5 eixos", "Granel sólido", 5, 6.0, 500.0),
+    ])
+    assert versao.buscar(datetime(2024, 3, 1), "Granel sólido", 5)[0] == "geral"
+    assert versao.buscar(datetime(2024, 8, 1), "Granel sólido", 5)[0] == "granel 5 eixos"
+    assert versao.buscar(datetime(2023, 12, 1), "Granel sólido", 5) == (None, None)
+    assert encontrar_frete_vigente(versao, "01/03/2024", "Granel sólido", 5)[0] == "geral"
+
+    datas = pd.Series(pd.to_datetime(["2024-03-01", "2024-08-01", "2023-12-01"]), index=[7, 8, 9])
+    resultado = versao.buscar_vetorizado(datas, "Granel sólido", 5)
+    assert resultado['normativo'].tolist()[:2] == ["geral", "granel 5 eixos"]
+    assert resultado['coef_desloc_antt'].tolist()[:2] == [7.0, 6.0]
+    assert pd.isna(resultado['normativo'].loc[9]) and pd.isna(resultado['coef_desloc_antt'].loc[9])
+
+
+def test_arquivo_invalido_mantem_versao_anterior(tmp_path):
+    caminho = tmp_path / "tarifas.csv"
+    caminho.write_text("vigencia,normativo,tipo_carga,eixos,coef_desloc_antt,valor_fixo_cd_antt\n"
+                       "01/01/2024,N1,,,7.0,600.0\n", encoding="utf-8")
+    repositorio = RepositorioTarifasANTT(str(caminho), intervalo_verificacao_s=3600)
+    versao = repositorio.versao()
+    assert len(versao) == 1
+
+    caminho.write_text("vigencia,normativo,tipo_carga,eixos,coef_desloc_antt,valor_fixo_cd_antt\n"
+                       "01/01/2024,N1,,,7.0,600.0\n31/02/2024,N2,,,8.0,700.0\n", encoding="utf-8")
+    with pytest.raises(ValueError):
+        ler_tarifas(str(caminho))
+    assert repositorio.recarregar() is False
+    assert repositorio.versao() is versao
@@ -0,0 +1,87 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from cache_geocodificacao import CacheGeocodificacao
+from cotacao_lote import geocodificar_localidades
+from roteamento import BackendOSRM, BackendStub, ErroRoteamento
+
+
+@pytest.fixture
+def servidor_osrm():
+    respostas = {}
+
+    class Tratador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, tipo, corpo = respostas.get(self.path.split("?")[0].split("/")[1],
+                                                (404, "text/plain", "nao encontrado"))
+            self.send_response(status)
+            self.send_header("Content-Type", tipo)
+            self.end_headers()
+            self.wfile.write(corpo.encode("utf-8"))
+
+        def log_message(self, *args):
+            pass
+
+    servidor = HTTPServer(("127.0.0.1", 0), Tratador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{servidor.server_port}", respostas
+    servidor.shutdown()
+
+
+def test_sem_geocodificador_nao_grava_negativo_no_cache(servidor_osrm):
+    url, _ = servidor_osrm
+    backend = BackendOSRM(url)
+    cache = CacheGeocodificacao(":memory:")
+    try:
+        with pytest.raises(ErroRoteamento):
+            backend.geocodificar("Fortaleza, CE")
+        erros = {}
+        assert geocodificar_localidades(["Fortaleza, CE"], backend, cache, erros=erros) == {'fortaleza, ce': None}
+        assert erros
+        assert cache.obter("Fortaleza, CE") == (False, None)
+    finally:
+        backend.encerrar()
+
+
+def test_geocodificador_configurado_e_usado(servidor_osrm):
+    url, _ = servidor_osrm
+    geocodificador = BackendStub({"Fortaleza, CE": [-38.5267, -3.71839]})
+    backend = BackendOSRM(url, geocodificador=geocodificador)
+    try:
+        assert backend.geocodificar("Fortaleza, CE") == [-38.5267, -3.71839]
+    finally:
+        backend.encerrar()
+        geocodificador.encerrar()
+
+
+def test_rota_e_matriz(servidor_osrm):
+    url, respostas = servidor_osrm
+    respostas['route'] = (200, "application/json", json.dumps({
+        'code': "Ok", 'routes': [{'distance': 12345.0, 'geometry': {'coordinates': [[0, 0], [1, 1]]}}]}))
+    respostas['table'] = (200, "application/json", json.dumps({'code': "Ok", 'distances': [[1000.0, None]]}))
+    backend = BackendOSRM(url)
+    try:
+        assert backend.rota([0, 0], [1, 1], "driving-car") == (12.345, [[0, 0], [1, 1]])
+        assert backend.matriz_distancias([[0, 0]], [[1, 1], [2, 2]], "driving-car") == [[1.0, None]]
+    finally:
+        backend.encerrar()
+
+
+@pytest.mark.parametrize("status, tipo, corpo", [
+    (200, "text/html", "<html>Bad gateway</html>"),
+    (404, "text/html", "<html>não encontrado</html>"),
+    (200, "application/json", "[1, 2]"),
+    (400, "application/json", '{"code": "InvalidQuery", "message": "x"}'),
+])
+def test_resposta_invalida_vira_erro_roteamento(servidor_osrm, status, tipo, corpo):
+    url, respostas = servidor_osrm
+    respostas['route'] = (status, tipo, corpo)
+    backend = BackendOSRM(url)
+    try:
+        with pytest.raises(ErroRoteamento):
+            backend.rota([0, 0], [1, 1], "driving-car")
+    finally:
+        backend.encerrar()
@@ -0,0 +1,70 @@
+from cache_geocodificacao import CacheGeocodificacao, normalizar_localidade
+
+
+class RelogioFalso:
+    def __init__(self, agora=1_000_000.0):
+        self.agora = agora
+
+    def time(self):
+        return self.agora
+
+
+def criar_cache(monkeypatch, **parametros):
+    relogio = RelogioFalso()
+    monkeypatch.setattr("cache_geocodificacao.time", relogio)
+    return CacheGeocodificacao(":memory:", **parametros), relogio
+
+
+def test_normalizar_localidade():
+    assert normalizar_localidade("São Paulo ,SP,  Brasil") == normalizar_localidade("sao paulo, sp, brasil")
+    assert normalizar_localidade("  ") == ""
+
+
+def test_ttl_positivo_e_negativo(monkeypatch):
+    cache, relogio = criar_cache(monkeypatch, ttl_s=100, ttl_negativo_s=10)
+    cache.gravar("Fortaleza, CE", [-38.5267, -3.71839])
+    cache.gravar("Lugar Nenhum", None)
+    assert cache.obter("fortaleza, ce") == (True, [-38.5267, -3.71839])
+    assert cache.obter("Lugar Nenhum") == (True, None)
+
+    relogio.agora += 10
+    assert cache.obter("Lugar Nenhum") == (False, None)
+    assert cache.obter("Fortaleza, CE")[0] is True
+
+    relogio.agora += 90
+    assert cache.obter("Fortaleza, CE") == (False, None)
+    estatisticas = cache.estatisticas()
+    assert (estatisticas['acertos'], estatisticas['acertos_negativos'], estatisticas['falhas']) == (2, 1, 2)
+
+
+def test_remocao_lru_e_de_expiradas(monkeypatch):
+    cache, relogio = criar_cache(monkeypatch, ttl_s=1000, ttl_negativo_s=5, max_entradas=2)
+    cache.gravar("a", [1, 1])
+    relogio.agora += 1
+    cache.gravar("b", [2, 2])
+    relogio.agora += 1
+    cache.obter("a")  # "b" passa a ser a menos usada
+    relogio.agora += 1
+    cache.gravar("c", [3, 3])
+    assert cache.obter("b") == (False, None)
+    assert cache.obter("a")[0] and cache.obter("c")[0]
+
+    relogio.agora += 1
+    cache.gravar("d", None)
+    relogio.agora += 10
+    cache.gravar("e", [5, 5])  # a negativa "d" já expirou e é apagada antes da LRU
+    assert cache.estatisticas()['entradas'] == 2
+    assert cache.obter("c")[0] and cache.obter("e")[0]
+
+
+def test_pre_aquecer_nao_grava_excecoes():
+    cache = CacheGeocodificacao(":memory:")
+
+    def geocodificador(nome):
+        if nome == "erro":
+            raise RuntimeError("falha")
+        return None if nome == "nada" else [0.0, 0.0]
+
+    assert cache.pre_aquecer(["x", "X ", "nada", "erro"], geocodificador) == 2
+    assert cache.obter("nada") == (True, None)
+    assert cache.obter("erro") == (False, None)
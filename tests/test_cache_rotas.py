@@ -0,0 +1,47 @@
+from cache_rotas import CacheRotas
+
+FORTALEZA, RECIFE, NATAL = (-38.52670, -3.71839), (-34.8771, -8.04666), (-35.2110, -5.79357)
+
+
+class RelogioFalso:
+    def __init__(self, agora=1_000_000.0):
+        self.agora = agora
+
+    def time(self):
+        return self.agora
+
+
+def test_chave_arredonda_coordenadas():
+    cache = CacheRotas(":memory:", precisao=4)
+    cache.gravar(FORTALEZA, RECIFE, "driving-car", 800.0, [list(FORTALEZA), list(RECIFE)])
+    assert cache.obter_distancia((-38.526701, -3.718388), RECIFE, "driving-car") == 800.0
+    assert cache.obter_distancia(FORTALEZA, RECIFE, "driving-hgv") is None
+    assert cache.obter_distancia(RECIFE, FORTALEZA, "driving-car") is None
+
+
+def test_gravar_so_distancia_preserva_geometria():
+    cache = CacheRotas(":memory:")
+    cache.gravar(FORTALEZA, RECIFE, "driving-car", 800.0, [list(FORTALEZA), list(RECIFE)])
+    cache.gravar(FORTALEZA, RECIFE, "driving-car", 801.0)
+    assert cache.obter_distancias([(FORTALEZA, RECIFE), (FORTALEZA, NATAL)], "driving-car") == {
+        (FORTALEZA, RECIFE): 801.0}
+    assert cache.obter_geometria(FORTALEZA, RECIFE, "driving-car") == [list(FORTALEZA), list(RECIFE)]
+
+
+def test_remocao_lru_considera_leitura_da_geometria(monkeypatch):
+    relogio = RelogioFalso()
+    monkeypatch.setattr("cache_rotas.time", relogio)
+    cache = CacheRotas(":memory:", max_entradas=2)
+    cache.gravar(FORTALEZA, RECIFE, "driving-car", 800.0, [list(FORTALEZA), list(RECIFE)])
+    relogio.agora += 1
+    cache.gravar(FORTALEZA, NATAL, "driving-car", 530.0, [list(FORTALEZA), list(NATAL)])
+    relogio.agora += 1
+    assert cache.obter_geometria(FORTALEZA, RECIFE, "driving-car") is not None
+    relogio.agora += 1
+    cache.gravar(RECIFE, NATAL, "driving-car", 290.0)
+
+    assert cache.obter_distancia(FORTALEZA, NATAL, "driving-car") is None
+    assert cache.obter_geometria(FORTALEZA, NATAL, "driving-car") is None
+    assert cache.obter_geometria(FORTALEZA, RECIFE, "driving-car") is not None
+    estatisticas = cache.estatisticas()
+    assert (estatisticas['entradas'], estatisticas['geometrias'], estatisticas['remocoes']) == (2, 1, 1)
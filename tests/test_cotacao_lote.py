@@ -0,0 +1,120 @@
+import io
+
+import pandas as pd
+import pytest
+
+from cache_geocodificacao import CacheGeocodificacao
+from cache_rotas import CacheRotas
+from cotacao_lote import calcular_distancias, cotar_lote, ler_planilha
+from roteamento import BackendStub, ErroRoteamento
+
+PERFIL = "driving-car"
+
+
+def ler_csv(texto):
+    return ler_planilha(io.BytesIO(texto.encode("utf-8")), "lote.csv")
+
+
+def planilha_com_peso(*pesos):
+    return "data;origem;destino;peso_kg\n" + "".join(f"01/03/2025;Fortaleza, CE;Recife, PE;{peso}\n"
+                                                     for peso in pesos)
+
+
+class BackendControlado(BackendStub):
+    # Registra cada matriz pedida; localidades em `falhar` dão erro de consulta, e matrizes
+    # com origem em `falhar_matriz_de`, erro de roteamento.
+    def __init__(self, falhar=(), falhar_matriz_de=()):
+        super().__init__()
+        self.falhar = set(falhar)
+        self.falhar_matriz_de = {tuple(coords) for coords in falhar_matriz_de}
+        self.matrizes = []
+
+    def geocodificar(self, nome_lugar):
+        if nome_lugar in self.falhar:
+            raise ErroRoteamento("HTTP 500")
+        return super().geocodificar(nome_lugar)
+
+    def matriz_distancias(self, origens, destinos, perfil):
+        self.matrizes.append((len(origens), len(destinos)))
+        if self.falhar_matriz_de & {tuple(o) for o in origens}:
+            raise ErroRoteamento("matriz recusada")
+        return super().matriz_distancias(origens, destinos, perfil)
+
+
+@pytest.fixture
+def backend():
+    backend = BackendControlado()
+    yield backend
+    backend.encerrar()
+
+
+@pytest.mark.parametrize("pesos, esperado", [
+    (["1.234,5", "10", "0,5"], [1234.5, 10.0, 0.5]),
+    (["1234.5", "10", "0.25"], [1234.5, 10.0, 0.25]),
+    (["1.234", "12.50"], [1.234, 12.5]),
+    (["1.234.567,0", "2.000"], [1234567.0, 2000.0]),
+    (["", "7"], [0.0, 7.0]),
+])
+def test_formato_numerico_decidido_por_coluna(pesos, esperado):
+    assert ler_csv(planilha_com_peso(*pesos))['peso_kg'].tolist() == esperado
+
+
+def test_milhar_sem_decimal_e_ambiguo():
+    with pytest.raises(ValueError, match="ambíguos como '1.234'"):
+        ler_csv(planilha_com_peso("1.234", "10"))
+
+
+def test_coluna_com_formatos_misturados_e_recusada():
+    with pytest.raises(ValueError, match="mistura vírgula"):
+        ler_csv(planilha_com_peso("1,5", "2.5"))
+
+
+def test_valor_nao_numerico_recusa_a_planilha_com_a_linha():
+    with pytest.raises(ValueError, match="'peso_kg' tem um valor não numérico na linha 3: 'abc'"):
+        ler_csv(planilha_com_peso("100", "abc"))
+
+
+def test_colunas_opcionais_e_obrigatorias():
+    df = ler_csv("Data;Origem;Destino;Eixos\n01/03/2025;Natal, RN;Recife, PE;\n")
+    assert df[['peso_kg', 'adicional_km', 'dificuldade']].iloc[0].tolist() == [0.0, 0.0, 0.0]
+    assert pd.isna(df['eixos'].iloc[0])
+    with pytest.raises(ValueError, match="ausentes na planilha: destino"):
+        ler_csv("data;origem\n01/03/2025;Natal, RN\n")
+
+
+def test_matriz_dividida_em_blocos_de_ate_max_elementos(backend):
+    origens = [(-38.0 - i, -4.0) for i in range(5)]
+    destinos = [(-35.0, -6.0 - i) for i in range(3)]
+    pares = {(o, d) for o in origens for d in destinos}
+    cache_rotas = CacheRotas(":memory:")
+    distancias = calcular_distancias(pares, backend, cache_rotas, PERFIL, max_elementos=6)
+    assert set(distancias) == pares
+    assert all(o * d <= 6 for o, d in backend.matrizes)
+    assert sum(o * d for o, d in backend.matrizes) == len(pares)
+
+    # Os pares já no cache de rotas não voltam ao backend.
+    backend.matrizes.clear()
+    assert calcular_distancias(pares, backend, cache_rotas, PERFIL, max_elementos=6) == distancias
+    assert backend.matrizes == []
+
+
+def test_falha_de_consulta_vira_status_da_linha():
+    backend = BackendControlado(falhar={"Lugar Quebrado"})
+    fortaleza, recife, natal = (backend.geocodificar(nome) for nome in ("Fortaleza, CE", "Recife, PE", "Natal, RN"))
+    backend.falhar_matriz_de = {tuple(recife)}
+    # Fortaleza -> Natal já está no cache: a única matriz pedida (Recife -> Natal) falha.
+    cache_rotas = CacheRotas(":memory:")
+    cache_rotas.gravar(fortaleza, natal, PERFIL, 530.0)
+    try:
+        df = ler_csv("data;origem;destino;peso_kg\n"
+                     "01/03/2025;Fortaleza, CE;Natal, RN;100\n"
+                     "01/03/2025;Lugar Quebrado;Natal, RN;100\n"
+                     "01/03/2025;Recife, PE;Natal, RN;100\n")
+        resultado = cotar_lote(df, backend, CacheGeocodificacao(":memory:"), cache_rotas, PERFIL)
+    finally:
+        backend.encerrar()
+    assert backend.matrizes == [(1, 1)]
+    assert resultado['status'].tolist() == [
+        "ok", "erro na consulta: HTTP 500", "erro na consulta: matriz recusada"]
+    assert resultado['distancia_km'].iloc[0] == 530.0
+    assert resultado['distancia_km'].iloc[1:].isna().all()
@@ -0,0 +1,271 @@
+import io
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from cache_geocodificacao import CacheGeocodificacao
+from cache_rotas import CacheRotas
+from cotacao_lote import cotar_lote, gerar_arquivo_resultado, ler_planilha
+from fila_lotes import (SITUACAO_CANCELADO, SITUACAO_CONCLUIDO, SITUACAO_ERRO, SITUACAO_NA_FILA,
+                        SITUACOES_ENCERRADAS, FilaLotes)
+from roteamento import BackendStub, ErroRoteamento
+
+PERFIL = "driving-car"
+CIDADES = ["Fortaleza, CE", "Recife, PE", "Natal, RN", "Teresina, PI", "Salvador, BA", "Maceió, AL"]
+
+
+class FilaControlada(FilaLotes):
+    # Fila com ganchos no início de cada bloco: `pausar_no_bloco` espera `liberar`;
+    # `morrer_no_bloco` faz o mesmo e então encerra a thread sem gravar nada, como um
+    # processo derrubado entre dois blocos; `falhar_no_bloco` simula o roteamento fora do ar.
+    def __init__(self, *args, pausar_no_bloco=None, morrer_no_bloco=None, falhar_no_bloco=None, **kwargs):
+        self.pausar_no_bloco = pausar_no_bloco
+        self.morrer_no_bloco = morrer_no_bloco
+        self.falhar_no_bloco = falhar_no_bloco
+        self.pausou = threading.Event()
+        self.liberar = threading.Event()
+        self.cotados = []
+        super().__init__(*args, **kwargs)
+
+    def _cotar_bloco(self, id_job, numero, bloco):
+        if numero in (self.pausar_no_bloco, self.morrer_no_bloco):
+            self.pausou.set()
+            self.liberar.wait(10)
+            if numero == self.morrer_no_bloco:
+                raise SystemExit
+        if numero == self.falhar_no_bloco:
+            self.falhar_no_bloco = None
+            raise ErroRoteamento("serviço fora do ar")
+        self.cotados.append(numero)
+        return super()._cotar_bloco(id_job, numero, bloco)
+
+
+@pytest.fixture
+def backend():
+    backend = BackendStub()
+    yield backend
+    backend.encerrar()
+
+
+@pytest.fixture
+def planilha():
+    linhas = ["data;origem;destino;peso_kg"] + [
+        f"01/03/2025;{origem};{CIDADES[(i + 1) % len(CIDADES)]};{i * 1000}" for i, origem in enumerate(CIDADES)]
+    return ler_planilha(io.BytesIO("\n".join(linhas).encode("utf-8")), "lote.csv")
+
+
+def criar_fila(backend, diretorio, classe=FilaLotes, **kwargs):
+    return classe(backend, CacheGeocodificacao(":memory:"), CacheRotas(":memory:"), PERFIL,
+                  diretorio=str(diretorio), tamanho_bloco=2, **kwargs)
+
+
+def esperar(fila, id_job, situacoes=SITUACOES_ENCERRADAS, timeout_s=10):
+    limite = time.monotonic() + timeout_s
+    while fila.estado(id_job)['situacao'] not in situacoes:
+        assert time.monotonic() < limite, fila.estado(id_job)
+        time.sleep(0.02)
+    return fila.estado(id_job)
+
+
+# O sistema libera as travas de um processo que morre; aqui, fechando os arquivos de trava.
+def simular_fim_do_processo(fila):
+    for id_job in list(fila._travas):
+        fila._destravar(id_job)
+
+
+def cotar_direto(df, backend):
+    return cotar_lote(df, backend, CacheGeocodificacao(":memory:"), CacheRotas(":memory:"), PERFIL)
+
+
+def test_lote_em_blocos_com_checkpoint(backend, planilha, tmp_path):
+    fila = criar_fila(backend, tmp_path)
+    try:
+        id_job = fila.enviar(planilha, "lote.csv", "csv")
+        estado = esperar(fila, id_job)
+        assert estado['situacao'] == SITUACAO_CONCLUIDO
+        assert (estado['blocos'], estado['blocos_concluidos']) == (3, 3)
+        assert estado['linhas_concluidas'] == estado['linhas_ok'] == 6
+
+        arquivos = sorted(os.listdir(tmp_path / id_job))
+        assert arquivos == ["bloco_00000.pkl", "bloco_00001.pkl", "bloco_00002.pkl", "entrada.pkl",
+                            "estado.json", "resultado.csv", "trava"]
+        with open(tmp_path / id_job / "estado.json", encoding="utf-8") as arquivo:
+            assert json.load(arquivo) == estado
+
+        resultado = fila.resultado(id_job)
+        pd.testing.assert_frame_equal(resultado, cotar_direto(planilha, backend))
+        pd.testing.assert_frame_equal(fila.ultimo_bloco(id_job), resultado.iloc[4:])
+        assert fila.arquivo_resultado(id_job) == gerar_arquivo_resultado(resultado, "csv")
+    finally:
+        fila.encerrar()
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_retomada_recalcula_progresso_pelos_blocos(backend, planilha, tmp_path):
+    fila = criar_fila(backend, tmp_path, FilaControlada, morrer_no_bloco=2)
+    try:
+        id_job = fila.enviar(planilha, "lote.csv")
+        assert fila.pausou.wait(10)
+        # Processo derrubado depois de gravar os blocos 0 e 1, mas antes de atualizar o estado.
+        caminho_estado = tmp_path / id_job / "estado.json"
+        estado = json.loads(caminho_estado.read_text(encoding="utf-8"))
+        estado.update(blocos_concluidos=0, linhas_concluidas=0, linhas_ok=0)
+        caminho_estado.write_text(json.dumps(estado), encoding="utf-8")
+    finally:
+        fila.encerrar()
+        simular_fim_do_processo(fila)
+
+    # Sem trabalhadores: só a retomada, com o progresso contado a partir dos arquivos de bloco.
+    retomada = criar_fila(backend, tmp_path, trabalhadores=0)
+    estado = retomada.estado(id_job)
+    assert estado['situacao'] == SITUACAO_NA_FILA
+    assert (estado['blocos_concluidos'], estado['linhas_concluidas'], estado['linhas_ok']) == (2, 4, 4)
+    simular_fim_do_processo(retomada)
+
+    nova = criar_fila(backend, tmp_path, FilaControlada)
+    try:
+        estado = esperar(nova, id_job)
+        assert estado['situacao'] == SITUACAO_CONCLUIDO
+        assert nova.cotados == [2]
+        assert (estado['blocos_concluidos'], estado['linhas_concluidas']) == (3, 6)
+        pd.testing.assert_frame_equal(nova.resultado(id_job), cotar_direto(planilha, backend))
+    finally:
+        nova.encerrar()
+        fila.liberar.set()
+        for trabalhador in fila._trabalhadores:
+            trabalhador.join(10)
+
+
+def test_job_travado_por_outro_processo_nao_e_retomado(backend, planilha, tmp_path):
+    dono = criar_fila(backend, tmp_path, FilaControlada, pausar_no_bloco=1)
+    try:
+        id_job = dono.enviar(planilha, "lote.csv")
+        assert dono.pausou.wait(10)
+        outro = criar_fila(backend, tmp_path, FilaControlada)
+        try:
+            # O outro processo só acompanha o job: não cota nem cancela.
+            assert outro.estado(id_job)['blocos_concluidos'] == 1
+            assert outro.cancelar(id_job) is False
+            dono.liberar.set()
+            assert esperar(outro, id_job)['situacao'] == SITUACAO_CONCLUIDO
+            assert dono.cotados == [0, 1, 2] and outro.cotados == []
+            assert outro.estado(id_job)['blocos_concluidos'] == 3
+        finally:
+            outro.encerrar()
+    finally:
+        dono.liberar.set()
+        dono.encerrar()
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_job_de_processo_morto_e_assumido_por_quem_acompanha(backend, planilha, tmp_path):
+    dono = criar_fila(backend, tmp_path, FilaControlada, morrer_no_bloco=1)
+    try:
+        id_job = dono.enviar(planilha, "lote.csv")
+        assert dono.pausou.wait(10)
+        outro = criar_fila(backend, tmp_path, FilaControlada)
+        try:
+            assert outro.estado(id_job)['situacao'] != SITUACAO_NA_FILA
+            assert outro.cotados == []
+            simular_fim_do_processo(dono)
+            assert esperar(outro, id_job)['situacao'] == SITUACAO_CONCLUIDO
+            assert outro.cotados == [1, 2]
+        finally:
+            outro.encerrar()
+    finally:
+        dono.encerrar()
+        dono.liberar.set()
+        for trabalhador in dono._trabalhadores:
+            trabalhador.join(10)
+
+
+def test_cancelar_interrompe_entre_blocos(backend, planilha, tmp_path):
+    fila = criar_fila(backend, tmp_path, FilaControlada, pausar_no_bloco=1)
+    try:
+        id_job = fila.enviar(planilha, "lote.csv")
+        assert fila.pausou.wait(10)
+        assert fila.cancelar(id_job) is True
+        fila.liberar.set()
+        limite = time.monotonic() + 10
+        while fila.estado(id_job)['blocos_concluidos'] < 2:
+            assert time.monotonic() < limite
+            time.sleep(0.02)
+        time.sleep(0.1)
+        assert fila.estado(id_job)['situacao'] == SITUACAO_CANCELADO
+        assert fila.cotados == [0, 1]
+        assert fila.cancelar(id_job) is False
+        assert fila.reenviar(id_job) is False
+        assert fila.arquivo_resultado(id_job) is None
+    finally:
+        fila.encerrar()
+
+
+def test_reenviar_retoma_do_bloco_que_falhou(backend, planilha, tmp_path):
+    fila = criar_fila(backend, tmp_path, FilaControlada, falhar_no_bloco=1)
+    try:
+        id_job = fila.enviar(planilha, "lote.csv")
+        estado = esperar(fila, id_job)
+        assert estado['situacao'] == SITUACAO_ERRO
+        assert "serviço fora do ar" in estado['erro']
+        assert estado['blocos_concluidos'] == 1
+        assert fila.reenviar(id_job) is True
+
+        estado = esperar(fila, id_job, (SITUACAO_CONCLUIDO,))
+        assert estado['erro'] is None
+        assert fila.cotados == [0, 1, 2]
+        pd.testing.assert_frame_equal(fila.resultado(id_job), cotar_direto(planilha, backend))
+        assert fila.reenviar(id_job) is False
+    finally:
+        fila.encerrar()
+
+
+def test_cliques_simultaneos_reenviam_e_cancelam_uma_vez(backend, planilha, tmp_path):
+    fila = criar_fila(backend, tmp_path, FilaControlada, falhar_no_bloco=0, pausar_no_bloco=1)
+    try:
+        id_job = fila.enviar(planilha, "lote.csv")
+        assert esperar(fila, id_job)['situacao'] == SITUACAO_ERRO
+
+        def ao_mesmo_tempo(acao):
+            largada = threading.Barrier(8)
+            resultados = []
+            def clicar():
+                largada.wait()
+                resultados.append(acao(id_job))
+            threads = [threading.Thread(target=clicar) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+            return resultados
+
+        assert sorted(ao_mesmo_tempo(fila.reenviar)) == [False] * 7 + [True]
+        assert fila.pausou.wait(10)
+        assert sorted(ao_mesmo_tempo(fila.cancelar)) == [False] * 7 + [True]
+        fila.liberar.set()
+        limite = time.monotonic() + 10
+        while fila.estado(id_job)['blocos_concluidos'] < 2:
+            assert time.monotonic() < limite
+            time.sleep(0.02)
+        assert fila.estado(id_job)['situacao'] == SITUACAO_CANCELADO
+        assert fila.cotados == [0, 1]
+    finally:
+        fila.liberar.set()
+        fila.encerrar()
+
+
+def test_retomada_ignora_diretorios_ilegiveis(backend, planilha, tmp_path):
+    (tmp_path / "sem_situacao").mkdir()
+    (tmp_path / "sem_situacao" / "estado.json").write_text('{"id": "sem_situacao"}', encoding="utf-8")
+    (tmp_path / "corrompido").mkdir()
+    (tmp_path / "corrompido" / "estado.json").write_text("{", encoding="utf-8")
+    fila = criar_fila(backend, tmp_path)
+    try:
+        assert fila.listar() == []
+        id_job = fila.enviar(planilha, "lote.csv")
+        assert esperar(fila, id_job)['situacao'] == SITUACAO_CONCLUIDO
+    finally:
+        fila.encerrar()
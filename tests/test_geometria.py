@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from geometria import (codificar_polilinha, decodificar_polilinha, simplificar_douglas_peucker,
+                       tolerancia_para_zoom)
+
+
+def test_polilinha_exemplo_da_especificacao():
+    # Exemplo da documentação do algoritmo (pontos em [lon, lat]).
+    pontos = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+    assert codificar_polilinha(pontos) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert decodificar_polilinha("_p~iF~ps|U_ulLnnqC_mqNvxq`@") == pontos
+
+
+def test_polilinha_ida_e_volta():
+    aleatorio = random.Random(7)
+    pontos = [[round(aleatorio.uniform(-74, -34), 5), round(aleatorio.uniform(-34, 5), 5)] for _ in range(500)]
+    decodificados = decodificar_polilinha(codificar_polilinha(pontos))
+    assert len(decodificados) == len(pontos)
+    for (lon, lat), (lon_d, lat_d) in zip(pontos, decodificados):
+        assert lon_d == pytest.approx(lon, abs=1e-5)
+        assert lat_d == pytest.approx(lat, abs=1e-5)
+
+
+def test_polilinha_vazia():
+    assert codificar_polilinha([]) == ""
+    assert decodificar_polilinha("") == []
+
+
+def test_douglas_peucker_mantem_extremos_e_descarta_pontos_colineares():
+    reta = [[-38.5 + i * 0.01, -3.7] for i in range(101)]
+    assert simplificar_douglas_peucker(reta, tolerancia_para_zoom(10)) == [reta[0], reta[-1]]
+
+    desvio = reta[:50] + [[-38.0, -3.0]] + reta[51:]
+    simplificada = simplificar_douglas_peucker(desvio, tolerancia_para_zoom(10))
+    assert simplificada[0] == reta[0] and simplificada[-1] == reta[-1]
+    assert [-38.0, -3.0] in simplificada
@@ -0,0 +1,137 @@
+import pytest
+from openrouteservice import exceptions as ors_exceptions
+
+from limitador_ors import AgendadorORS, DisjuntorCircuito, LimitadorTaxa, ServicoORSIndisponivel
+
+
+class RelogioFalso:
+    # monotonic() e sleep() sem espera real: dormir só avança o relógio.
+    def __init__(self):
+        self.agora = 100.0
+
+    def monotonic(self):
+        return self.agora
+
+    def sleep(self, segundos):
+        self.agora += segundos
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = RelogioFalso()
+    monkeypatch.setattr("limitador_ors.time", relogio)
+    return relogio
+
+
+def test_limitador_rajada_e_reabastecimento(relogio):
+    limitador = LimitadorTaxa(taxa_por_s=2.0, capacidade=3)
+    assert all(limitador.adquirir(espera_maxima_s=0) for _ in range(3))
+    assert limitador.adquirir(espera_maxima_s=0) is False
+    assert limitador.adquirir(espera_maxima_s=0.4) is False
+
+    # Com espera suficiente, enfileira até o próximo token (0,5 s a 2 tokens/s).
+    inicio = relogio.agora
+    assert limitador.adquirir(espera_maxima_s=1.0) is True
+    assert relogio.agora - inicio == pytest.approx(0.5)
+
+    relogio.agora += 60
+    assert limitador.tokens_disponiveis() == pytest.approx(3)
+
+
+def test_disjuntor_abre_testa_e_fecha(relogio):
+    disjuntor = DisjuntorCircuito(limite_falhas=3, recuperacao_s=30)
+    for _ in range(2):
+        assert disjuntor.permitir()
+        disjuntor.registrar_falha()
+    assert disjuntor.estado() == DisjuntorCircuito.FECHADO
+    disjuntor.registrar_falha()
+    assert disjuntor.estado() == DisjuntorCircuito.ABERTO
+    assert disjuntor.permitir() is False
+    assert disjuntor.segundos_para_recuperacao() == pytest.approx(30)
+
+    relogio.agora += 30
+    assert disjuntor.estado() == DisjuntorCircuito.MEIO_ABERTO
+    assert disjuntor.permitir() is True
+    assert disjuntor.permitir() is False  # só uma requisição de teste por vez
+    disjuntor.registrar_sucesso()
+    assert disjuntor.estado() == DisjuntorCircuito.FECHADO
+    assert disjuntor.permitir() is True
+
+
+def test_disjuntor_falha_no_teste_reabre(relogio):
+    disjuntor = DisjuntorCircuito(limite_falhas=1, recuperacao_s=10)
+    disjuntor.registrar_falha()
+    relogio.agora += 10
+    assert disjuntor.permitir() is True
+    disjuntor.registrar_falha()
+    assert disjuntor.estado() == DisjuntorCircuito.ABERTO
+    assert disjuntor.segundos_para_recuperacao() == pytest.approx(10)
+
+
+def test_disjuntor_liberar_teste_nao_conta_como_falha(relogio):
+    disjuntor = DisjuntorCircuito(limite_falhas=1, recuperacao_s=10)
+    disjuntor.registrar_falha()
+    relogio.agora += 10
+    assert disjuntor.permitir() is True
+    disjuntor.liberar_teste()
+    assert disjuntor.estado() == DisjuntorCircuito.MEIO_ABERTO
+    assert disjuntor.permitir() is True
+
+
+def erro_api(status):
+    return ors_exceptions.ApiError(status, {'error': "erro"})
+
+
+def test_agendador_repete_erros_transitorios_e_abre_o_disjuntor(relogio):
+    chamadas = []
+
+    def sempre_429():
+        chamadas.append(relogio.agora)
+        raise erro_api(429)
+
+    agendador = AgendadorORS(LimitadorTaxa(100.0, 100), DisjuntorCircuito(limite_falhas=2, recuperacao_s=60),
+                             max_tentativas=3, backoff_base_s=1.0)
+    for _ in range(2):
+        with pytest.raises(ServicoORSIndisponivel):
+            agendador.executar(sempre_429)
+    assert len(chamadas) == 6
+    assert agendador.contadores() == {'requisicoes': 6, 'retentativas': 4, 'limites_excedidos': 6, 'rejeitadas': 0}
+
+    with pytest.raises(ServicoORSIndisponivel):
+        agendador.executar(sempre_429)
+    assert len(chamadas) == 6
+    assert agendador.contadores()['rejeitadas'] == 1
+
+
+def test_agendador_erro_definitivo_propaga_sem_retentativa(relogio):
+    chamadas = []
+
+    def requisicao_invalida():
+        chamadas.append(1)
+        raise erro_api(400)
+
+    agendador = AgendadorORS(LimitadorTaxa(100.0, 100), DisjuntorCircuito(limite_falhas=1), max_tentativas=3)
+    with pytest.raises(ors_exceptions.ApiError):
+        agendador.executar(requisicao_invalida)
+    assert len(chamadas) == 1
+    assert agendador.disjuntor.estado() == DisjuntorCircuito.FECHADO
+
+
+def test_limitador_reserva_tokens_para_interativas(relogio):
+    limitador = LimitadorTaxa(taxa_por_s=1.0, capacidade=3)
+    assert limitador.adquirir(espera_maxima_s=0, reserva=1)
+    assert limitador.adquirir(espera_maxima_s=0, reserva=1)
+    assert limitador.adquirir(espera_maxima_s=0, reserva=1) is False
+    assert limitador.adquirir(espera_maxima_s=0) is True
+
+
+def test_agendador_em_lote_deixa_token_para_interativa(relogio):
+    from roteamento import prioridade_lote
+
+    agendador = AgendadorORS(LimitadorTaxa(1.0, 2), DisjuntorCircuito(), espera_maxima_fila_s=0,
+                             reserva_interativa=1)
+    with prioridade_lote():
+        assert agendador.executar(lambda: "lote") == "lote"
+        with pytest.raises(ServicoORSIndisponivel):
+            agendador.executar(lambda: "lote")
+    assert agendador.executar(lambda: "interativa") == "interativa"
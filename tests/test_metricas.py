@@ -0,0 +1,113 @@
+import logging
+
+import pytest
+
+from metricas import METRICAS, RegistroCotacao, RegistroMetricas, _formatar_rotulos, _rotulos, logger
+
+
+class CapturarLog(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.registros = []
+
+    def emit(self, record):
+        self.registros.append(record)
+
+
+@pytest.fixture
+def log():
+    handler = CapturarLog()
+    nivel = logger.level
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    yield handler.registros
+    logger.removeHandler(handler)
+    logger.setLevel(nivel)
+
+
+def linhas_da_serie(texto, prefixo):
+    return [linha for linha in texto.splitlines() if linha.startswith(prefixo)]
+
+
+def test_histograma_exporta_faixas_cumulativas_soma_e_total():
+    registro = RegistroMetricas(prefixo="t_", limites_histograma=(0.1, 1.0))
+    for valor in (0.05, 0.5, 0.5, 3.0):
+        registro.observar("espera_segundos", valor, fila="a")
+    registro.observar("espera_segundos", 0.2, fila="b")
+
+    texto = registro.exportar()
+    assert texto.count("# TYPE t_espera_segundos histogram") == 1
+    assert linhas_da_serie(texto, 't_espera_segundos_bucket{fila="a"') == [
+        't_espera_segundos_bucket{fila="a",le="0.1"} 1',
+        't_espera_segundos_bucket{fila="a",le="1.0"} 3',
+        't_espera_segundos_bucket{fila="a",le="+Inf"} 4',
+    ]
+    assert 't_espera_segundos_sum{fila="a"} 4.050000' in texto
+    assert 't_espera_segundos_count{fila="a"} 4' in texto
+    assert 't_espera_segundos_bucket{fila="b",le="0.1"} 0' in texto
+    assert 't_espera_segundos_bucket{fila="b",le="+Inf"} 1' in texto
+
+
+def test_contadores_sem_e_com_rotulos():
+    registro = RegistroMetricas(prefixo="t_")
+    registro.incrementar("consultas_total")
+    registro.incrementar("consultas_total", 2)
+    registro.incrementar("erros_total", servico="ors")
+    assert registro.exportar().splitlines() == [
+        "# TYPE t_consultas_total counter",
+        "t_consultas_total 3",
+        "# TYPE t_erros_total counter",
+        't_erros_total{servico="ors"} 1',
+    ]
+
+
+def test_rotulos_escapam_barra_aspas_e_quebra_de_linha():
+    rotulos = _rotulos({'origem': 'Rua "A"\nC:\\sede', 'b': 1})
+    assert _formatar_rotulos(rotulos) == '{b="1",origem="Rua \\"A\\"\\nC:\\\\sede"}'
+    assert _formatar_rotulos(()) == ""
+
+
+def test_coletor_com_falha_nao_derruba_a_exportacao(log):
+    registro = RegistroMetricas(prefixo="t_")
+    registro.incrementar("consultas_total")
+
+    def quebrado():
+        raise RuntimeError("cache fechado")
+
+    registro.registrar_coletor("quebrado", quebrado)
+    registro.registrar_coletor("cache", lambda: [("cache_entradas", "gauge", {'cache': "rotas"}, 7)])
+    texto = registro.exportar()
+    assert "t_consultas_total 1" in texto
+    assert 't_cache_entradas{cache="rotas"} 7' in texto
+    assert [r.getMessage() for r in log] == ["falha ao coletar métricas"]
+    assert log[0].exc_info[0] is RuntimeError
+
+    # Registrar de novo com o mesmo nome substitui o coletor.
+    registro.registrar_coletor("quebrado", lambda: [])
+    registro.exportar()
+    assert len(log) == 1
+
+
+def test_etapa_que_falha_tambem_e_registrada(log):
+    antes = METRICAS._histogramas.get(("etapa_duracao_segundos", (("etapa", "teste_falha"),)), [0])[-1]
+    cotacao = RegistroCotacao(rota="Fortaleza -> Natal")
+    with cotacao.etapa("teste_ok", pares=1):
+        pass
+    with pytest.raises(ValueError):
+        with cotacao.etapa("teste_falha"):
+            raise ValueError("sem rota")
+    cotacao.concluir(status="erro")
+
+    assert [(e['etapa'], e['ok']) for e in cotacao.etapas] == [("teste_ok", True), ("teste_falha", False)]
+    assert cotacao.etapas[0]['pares'] == 1
+    assert all(e['duracao_ms'] >= 0 for e in cotacao.etapas)
+    assert METRICAS._histogramas[("etapa_duracao_segundos", (("etapa", "teste_falha"),))][-1] == antes + 1
+
+    resumo = log[-1]
+    assert resumo.getMessage() == "cotação concluída"
+    assert resumo.campos['cotacao_id'] == cotacao.id
+    assert resumo.campos['rota'] == "Fortaleza -> Natal"
+    assert resumo.campos['status'] == "erro"
+    assert set(resumo.campos['etapas_ms']) == {"teste_ok", "teste_falha"}
+    etapa_com_falha = next(r for r in log if r.getMessage() == "etapa teste_falha")
+    assert etapa_com_falha.campos['ok'] is False
@@ -0,0 +1,104 @@
+import itertools
+import random
+
+import pytest
+
+from cache_geocodificacao import CacheGeocodificacao
+from cache_rotas import CacheRotas
+from multiparadas import METODO_2OPT, METODO_EXATO, custo_ordem, otimizar_ordem, planejar_paradas
+from roteamento import BackendStub
+
+PERFIL = "driving-car"
+# Paradas sobre o mesmo paralelo: a melhor ordem é a da longitude.
+COORDENADAS = {"Parada A": [-40.0, -5.0], "Parada B": [-39.0, -5.0], "Parada C": [-38.0, -5.0],
+               "Parada D": [-37.0, -5.0], "Ilha": [-32.4, -3.85]}
+
+
+class BackendComIlha(BackendStub):
+    # Sem rota rodoviária de nem para a "Ilha"; "Lugar Nenhum" não é geocodificado.
+    def geocodificar(self, nome_lugar):
+        return None if nome_lugar == "Lugar Nenhum" else super().geocodificar(nome_lugar)
+
+    def matriz_distancias(self, origens, destinos, perfil):
+        ilha = tuple(COORDENADAS["Ilha"])
+        return [[None if ilha in (tuple(o), tuple(d)) else km for d, km in zip(destinos, linha)]
+                for o, linha in zip(origens, super().matriz_distancias(origens, destinos, perfil))]
+
+
+def menor_custo_por_forca_bruta(matriz, fixar_fim, retorno):
+    n = len(matriz)
+    fim = [n - 1] if fixar_fim else []
+    intermediarias = [i for i in range(1, n) if i not in fim]
+    return min(custo_ordem(matriz, [0, *permutacao, *fim], retorno)
+               for permutacao in itertools.permutations(intermediarias))
+
+
+@pytest.mark.parametrize("fixar_fim, retorno", list(itertools.product([False, True], repeat=2)))
+@pytest.mark.parametrize("n", range(2, 9))
+def test_ordem_exata_igual_a_forca_bruta(n, fixar_fim, retorno):
+    sorteio = random.Random(n * 10 + 2 * fixar_fim + retorno)
+    for _ in range(5):
+        # Assimétrica, como as distâncias de estrada.
+        matriz = [[0.0 if i == j else sorteio.uniform(10, 1000) for j in range(n)] for i in range(n)]
+        ordem, metodo = otimizar_ordem(matriz, fixar_fim, retorno)
+        assert metodo == METODO_EXATO
+        assert sorted(ordem) == list(range(n)) and ordem[0] == 0
+        if fixar_fim:
+            assert ordem[-1] == n - 1
+        assert custo_ordem(matriz, ordem, retorno) == pytest.approx(
+            menor_custo_por_forca_bruta(matriz, fixar_fim, retorno))
+
+
+@pytest.mark.parametrize("fixar_fim, retorno", list(itertools.product([False, True], repeat=2)))
+def test_2opt_devolve_ordem_valida(fixar_fim, retorno):
+    sorteio = random.Random(7)
+    n = 8
+    matriz = [[0.0 if i == j else sorteio.uniform(10, 1000) for j in range(n)] for i in range(n)]
+    ordem, metodo = otimizar_ordem(matriz, fixar_fim, retorno, max_exato=0)
+    assert metodo == METODO_2OPT
+    assert sorted(ordem) == list(range(n)) and ordem[0] == 0
+    if fixar_fim:
+        assert ordem[-1] == n - 1
+    assert custo_ordem(matriz, ordem, retorno) >= menor_custo_por_forca_bruta(matriz, fixar_fim, retorno) - 1e-9
+
+
+@pytest.fixture
+def backend():
+    backend = BackendComIlha(COORDENADAS)
+    yield backend
+    backend.encerrar()
+
+
+def planejar(backend, nomes, **kwargs):
+    return planejar_paradas(nomes, backend, CacheGeocodificacao(":memory:"), CacheRotas(":memory:"), PERFIL,
+                            **kwargs)
+
+
+def test_planejar_paradas_reordena(backend):
+    plano = planejar(backend, ["Parada A", "Parada C", "Parada B", "Parada D"])
+    assert plano['erro'] is None
+    assert plano['metodo'] == METODO_EXATO
+    assert [parada['parada'] for parada in plano['paradas']] == ["Parada A", "Parada B", "Parada C", "Parada D"]
+    assert plano['paradas'][0]['trecho_km'] == 0.0
+    assert plano['distancia_total_km'] == pytest.approx(sum(parada['trecho_km'] for parada in plano['paradas']))
+    assert plano['distancia_total_km'] < plano['distancia_ordem_informada_km']
+
+
+def test_planejar_paradas_fim_fixo_e_retorno(backend):
+    plano = planejar(backend, ["Parada B", "Parada D", "Parada C", "Parada A"], fixar_fim=True)
+    assert [parada['parada'] for parada in plano['paradas']] == ["Parada B", "Parada C", "Parada D", "Parada A"]
+
+    plano = planejar(backend, ["Parada B", "Parada D", "Parada A"], retorno=True)
+    assert plano['paradas'][0]['parada'] == plano['paradas'][-1]['parada'] == "Parada B"
+    assert len(plano['paradas']) == 4
+
+
+def test_planejar_paradas_sem_rota(backend):
+    plano = planejar(backend, ["Parada A", "Ilha", "Parada B"])
+    assert plano == {'erro': "Sem rota rodoviária entre algumas das paradas."}
+
+
+def test_planejar_paradas_entradas_invalidas(backend):
+    assert planejar(backend, ["Parada A", "  "])['erro'] == "Informe ao menos duas paradas."
+    assert planejar(backend, ["Parada A", "Lugar Nenhum"])['erro'].startswith(
+        "Paradas não geocodificadas: Lugar Nenhum")
@@ -0,0 +1,89 @@
+import pytest
+
+from municipios import IndiceMunicipios, carregar_indice_municipios
+
+MUNICIPIOS = [
+    (2304400, "Fortaleza", "CE", -3.71839, -38.5267),
+    (3550308, "São Paulo", "SP", -23.5329, -46.6395),
+    (2408102, "Natal", "RN", -5.79357, -35.2110),
+    (1721000, "Palmas", "TO", -10.24, -48.3558),
+    (4117602, "Palmas", "PR", -26.4839, -51.9888),
+    (5300108, "Brasília", "DF", -15.7795, -47.9297),
+    (2507507, "João Pessoa", "PB", -7.11509, -34.8641),
+    (3304557, "Rio de Janeiro", "RJ", -22.9129, -43.2003),
+]
+
+
+@pytest.fixture
+def indice():
+    return IndiceMunicipios(MUNICIPIOS)
+
+
+@pytest.mark.parametrize("entrada, codigo", [
+    ("Fortaleza, CE, Brasil", 2304400),
+    ("fortaleza,ce", 2304400),
+    ("FORTALEZA - CE", 2304400),
+    ("Sao Paulo/SP", 3550308),
+    ("São Paulo, São Paulo, Brazil", 3550308),
+    ("Joao Pessoa, Paraíba", 2507507),
+    ("Fortalezza, CE", 2304400),
+    ("Palmas, PR", 4117602),
+    ("Palmas, Tocantins", 1721000),
+    ("Rio de Janeiro, RJ", 3304557),
+])
+def test_buscar_com_uf(indice, entrada, codigo):
+    assert indice.buscar(entrada)[0] == codigo
+
+
+@pytest.mark.parametrize("entrada", [
+    "Praça do Ferreira, Fortaleza, CE",
+    "Fortaleza, SP",
+    "Recife, PE",
+    "",
+])
+def test_buscar_sem_correspondencia(indice, entrada):
+    assert indice.buscar(entrada) is None
+
+
+def test_buscar_sem_uf_recusa_nome_ambiguo():
+    indice = IndiceMunicipios(MUNICIPIOS, busca_sem_uf=True)
+    assert indice.buscar("Palmas") is None
+    assert indice.buscar("Palmas, Brasil") is None
+    assert indice.buscar("Fortaleza")[0] == 2304400
+    assert indice.buscar("Fortalesa, Brasil")[0] == 2304400
+
+
+def test_lista_incompleta_nao_busca_sem_uf(indice):
+    # A semente só com capitais não sabe se existe outra "Natal" ou "Fortaleza" fora dela.
+    assert indice.busca_sem_uf is False
+    assert indice.buscar("Fortaleza") is None
+    assert indice.buscar("Natal, Brasil") is None
+    assert indice.buscar("Natal, RN")[0] == 2408102
+
+
+def test_lista_do_repositorio_tem_todos_os_municipios():
+    indice = carregar_indice_municipios()
+    assert len(indice) == 5570
+    assert indice.busca_sem_uf is True
+    assert indice.buscar("Sobral, CE")[:3] == (2312908, "Sobral", "CE")
+    assert indice.buscar("Campinas, SP")[:3] == (3509502, "Campinas", "SP")
+    assert indice.buscar("Alta Floresta D'Oeste, RO")[0] == 1100015
+    assert indice.buscar("Juazeiro do Norte")[2] == "CE"
+    # Palmas existe no TO e no PR: sem UF continua ambíguo.
+    assert indice.buscar("Palmas") is None
+    assert indice.buscar("Palmas, PR")[0] == 4117602
+
+
+def test_geocodificar_devolve_lon_lat(indice):
+    assert indice.geocodificar("Natal, RN") == [-35.2110, -5.79357]
+    assert indice.geocodificar("Rua Tal, 100, Natal") is None
+
+
+def test_carregar_arquivo(tmp_path):
+    caminho = tmp_path / "municipios.csv"
+    caminho.write_text("codigo_ibge,nome,uf,latitude,longitude\n"
+                       "2304400,Fortaleza,CE,-3.71839,-38.5267\n", encoding="utf-8")
+    indice = carregar_indice_municipios(str(caminho))
+    assert len(indice) == 1
+    assert indice.buscar("Fortaleza, CE") == (2304400, "Fortaleza", "CE", -38.5267, -3.71839)
+    assert len(carregar_indice_municipios(str(tmp_path / "ausente.csv"))) == 0
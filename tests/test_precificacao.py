@@ -0,0 +1,91 @@
+import math
+
+import pandas as pd
+import pytest
+
+from antt import VersaoTarifasANTT
+from precificacao import (CAPACIDADE_TOTAL_CAMINHAO_KG, SITUACAO_CAPACIDADE_TOTAL, SITUACAO_DISTANCIA_ZERO,
+                          SITUACAO_PROPORCIONAL, SITUACAO_SEM_CAPACIDADE, SITUACAO_SEM_DISTANCIA, SITUACAO_SEM_PESO,
+                          precificar, precificar_cotacoes)
+
+COEF, FIXO = 7.639, 623.07
+
+
+# Regras do formulário original (antes do motor vetorizado), linha por linha.
+def frete_original(distancia, coef, fixo, peso, adicional, dificuldade, capacidade):
+    custo_deslocamento = coef * distancia
+    custo_adicional = adicional * distancia
+    frete_cheio = custo_deslocamento + fixo + custo_adicional + dificuldade
+    frete_total = frete_cheio
+    if peso > 0 and capacidade > 0:
+        if peso < capacidade:
+            frete_total = frete_cheio * (peso / capacidade)
+    elif peso == 0:
+        frete_total = fixo + dificuldade
+    frete_real_por_km = frete_total / distancia
+    delta = frete_real_por_km - coef
+    return {
+        'custo_deslocamento_antt': custo_deslocamento,
+        'custo_adicional_desloc': custo_adicional,
+        'frete_total_calculado': frete_total,
+        'frete_real_por_km': frete_real_por_km,
+        'delta_vs_base_antt': delta,
+        'percent_vs_base_antt': delta / coef * 100 if coef > 0 else 0,
+        'peso_transportado_kg': peso if peso > 0 and distancia > 0 else 0.0,
+    }
+
+
+@pytest.mark.parametrize("peso, capacidade, situacao", [
+    (5000.0, CAPACIDADE_TOTAL_CAMINHAO_KG, SITUACAO_PROPORCIONAL),
+    (CAPACIDADE_TOTAL_CAMINHAO_KG, CAPACIDADE_TOTAL_CAMINHAO_KG, SITUACAO_CAPACIDADE_TOTAL),
+    (35000.0, CAPACIDADE_TOTAL_CAMINHAO_KG, SITUACAO_CAPACIDADE_TOTAL),
+    (0.0, CAPACIDADE_TOTAL_CAMINHAO_KG, SITUACAO_SEM_PESO),
+    (5000.0, 0.0, SITUACAO_SEM_CAPACIDADE),
+])
+def test_precificar_igual_ao_formulario_original(peso, capacidade, situacao):
+    calculo = precificar(2961.18, COEF, FIXO, peso, 0.35, 150.0, capacidade).iloc[0]
+    assert calculo['situacao'] == situacao
+    for coluna, esperado in frete_original(2961.18, COEF, FIXO, peso, 0.35, 150.0, capacidade).items():
+        assert calculo[coluna] == pytest.approx(esperado), coluna
+
+
+def test_precificar_distancia_zero_cobra_so_custos_fixos():
+    calculo = precificar(0.0, COEF, FIXO, 5000.0, 0.35, 150.0).iloc[0]
+    assert calculo['situacao'] == SITUACAO_DISTANCIA_ZERO
+    assert calculo['frete_total_calculado'] == pytest.approx(FIXO + 150.0)
+    assert math.isnan(calculo['frete_real_por_km'])
+
+
+def test_precificar_sem_distancia_nao_tem_valor_total():
+    calculo = precificar(float("nan"), COEF, FIXO, 5000.0).iloc[0]
+    assert calculo['situacao'] == SITUACAO_SEM_DISTANCIA
+    assert math.isnan(calculo['frete_total_calculado'])
+    assert calculo['peso_transportado_kg'] == 0.0
+
+
+def test_precificar_vetorizado_igual_a_linha_a_linha():
+    distancias = pd.Series([100.0, 0.0, 850.5, 2961.18], index=[10, 11, 12, 13])
+    pesos = pd.Series([0.0, 1000.0, 19999.0, 20000.0], index=distancias.index)
+    lote = precificar(distancias, COEF, FIXO, pesos, 0.2, 50.0)
+    assert list(lote.index) == [10, 11, 12, 13]
+    for i in distancias.index:
+        linha = precificar(distancias[i], COEF, FIXO, pesos[i], 0.2, 50.0).iloc[0]
+        pd.testing.assert_series_equal(lote.loc[i], linha, check_names=False)
+
+
+def test_precificar_cotacoes_resolve_normativo_e_status():
+    versao = VersaoTarifasANTT([
+        ("01/01/2024", "N1", "", None, 7.0, 600.0),
+        ("01/07/2024", "N2", "", None, 8.0, 700.0),
+    ])
+    df = pd.DataFrame({
+        'data': ["15/03/2024", "01/07/2024", "31/12/2023", "32/01/2024", "01/08/2024"],
+        'distancia_km': [100.0, 100.0, 100.0, 100.0, float("nan")],
+        'peso_kg': 0.0, 'adicional_km': 0.0, 'dificuldade': 0.0,
+    })
+    resultado = precificar_cotacoes(df, versao)
+    assert resultado['normativo'].tolist()[:2] == ["N1", "N2"]
+    assert pd.isna(resultado['normativo'].iloc[2])
+    assert resultado['frete_total_calculado'].iloc[1] == pytest.approx(700.0)
+    assert resultado['status'].tolist() == [
+        "ok", "ok", "sem normativo ANTT para a data", "data inválida", "distância não calculada"]
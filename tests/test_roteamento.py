@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from roteamento import BackendRoteamento, BackendStub, em_lote, prioridade_lote
+
+
+def test_trabalho_em_lote_usa_executor_proprio():
+    backend = BackendStub(max_concorrencia=1, max_concorrencia_lote=1)
+    liberar = threading.Event()
+    try:
+        with prioridade_lote():
+            bloqueado = backend.submeter(liberar.wait, 5)
+            marcado = backend.executar_em_paralelo(lambda _: (em_lote(), threading.current_thread().name), [0])
+        # O executor interativo continua livre enquanto o de lote está ocupado.
+        interativo = backend.submeter(lambda: (em_lote(), threading.current_thread().name))
+        assert interativo.result(timeout=5)[0] is False
+        assert not bloqueado.done()
+        liberar.set()
+        assert marcado[0].result(timeout=5)[0] is True
+        assert "lote" in marcado[0].result()[1]
+    finally:
+        liberar.set()
+        backend.encerrar()
+    assert em_lote() is False
+
+
+def test_stub_deterministico():
+    backend = BackendStub({"Fortaleza, CE": [-38.5267, -3.71839]})
+    try:
+        assert backend.geocodificar("fortaleza, ce") == [-38.5267, -3.71839]
+        assert backend.geocodificar("Lugar X") == backend.geocodificar("lugar  x")
+        assert backend.geocodificar("") is None
+        distancia, geometria = backend.rota([-38.5, -3.7], [-34.9, -8.0], "driving-car")
+        assert backend.matriz_distancias([[-38.5, -3.7]], [[-34.9, -8.0]], "driving-car") == [[distancia]]
+        assert geometria[0] == [-38.5, -3.7] and geometria[-1] == [-34.9, -8.0]
+    finally:
+        backend.encerrar()
+
+
+def test_backend_incompleto_nao_instancia():
+    class SemMatriz(BackendRoteamento):
+        nome = "incompleto"
+
+        def geocodificar(self, nome_lugar):
+            return None
+
+        def rota(self, coords_origem, coords_destino, perfil):
+            return None
+
+    with pytest.raises(TypeError):
+        SemMatriz()